@@ -1,9 +1,10 @@
-﻿import logging, os
+﻿import json, logging, os
 
 import gevent
 
 from DideRobot import DideRobot
 import GlobalStore
+from MetricsServer import MetricsServer
 
 
 class BotHandler:
@@ -12,6 +13,7 @@ class BotHandler:
 	def __init__(self, serverfolderList):
 		self.logger = logging.getLogger('DideRobot')
 		GlobalStore.bothandler = self
+		self.metricsServer = None
 
 		#Since a lot of modules save stuff to the 'data' subfolder, make sure it exists to save all of them some checking time
 		if not os.path.exists(os.path.join(GlobalStore.scriptfolder, 'data')):
@@ -21,9 +23,32 @@ class BotHandler:
 			self.logger.critical("'globalsettings.json' file not found in 'serverSettings' folder! Shutting down")
 			self.shutdown()
 		else:		
+			#The metrics server and blocking detector are for the whole program, not for a single bot, so their settings are only read from the global settings
+			with open(os.path.join(GlobalStore.scriptfolder, 'serverSettings', 'globalsettings.json'), 'r') as globalSettingsFile:
+				globalSettings = json.load(globalSettingsFile)
+			self.startMetricsServer(globalSettings)
+			self.startBlockingDetector(globalSettings)
 			for serverfolder in serverfolderList:
 				gevent.spawn(self.startBot, serverfolder)
 
+	def startMetricsServer(self, globalSettings):
+		metricsServerPort = globalSettings.get('metricsServerPort', 0)
+		if not metricsServerPort:
+			return
+		self.metricsServer = MetricsServer(globalSettings.get('metricsServerHost', '127.0.0.1'), metricsServerPort)
+		try:
+			self.metricsServer.start()
+		except (IOError, OSError) as e:
+			self.logger.error("Unable to start metrics server on port {}: {}".format(metricsServerPort, e))
+			self.metricsServer = None
+
+	def startBlockingDetector(self, globalSettings):
+		maxHubBlockingMilliseconds = globalSettings.get('maxHubBlockingMilliseconds', 500)
+		if maxHubBlockingMilliseconds <= 0:
+			return
+		GlobalStore.commandhandler.blockingDetector.maxBlockingSeconds = maxHubBlockingMilliseconds / 1000.0
+		GlobalStore.commandhandler.blockingDetector.start()
+
 	def startBot(self, serverfolder):
 		if serverfolder in self.bots:
 			self.logger.warning("BotHandler got command to join server which I'm already on, '{}'".format(serverfolder))
@@ -52,8 +77,12 @@ class BotHandler:
 		#If there's no more bots running, there's no need to hang about
 		if len(self.bots) == 0:
 			self.logger.info("Out of bots, shutting down!")
-			#Unload all commands. This will mean there won't be any greenlets left running, so the main loop will quit
+			#Unload all commands and stop the metrics server and blocking detector. This will mean there won't be any greenlets left running, so the main loop will quit
 			GlobalStore.commandhandler.unloadAllCommands()
+			GlobalStore.commandhandler.blockingDetector.stop()
+			if self.metricsServer:
+				self.metricsServer.stop()
+				self.metricsServer = None
 
 	def shutdown(self, quitmessage='Shutting down...'):
 		#Give all bots the same quit message
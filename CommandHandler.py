@@ -1,13 +1,18 @@
-import importlib, json, logging, os
-
-import gevent
+import importlib, json, logging, os, time
 
+from CommandMetrics import CommandMetrics
+from CommandWorkerPool import CommandWorkerPool
 import GlobalStore
+from commands.CommandTemplate import CommandTemplate
+from HubBlockingDetector import HubBlockingDetector
 from IrcMessage import IrcMessage
+from ProcessPool import ProcessPool
 
 
 class CommandHandler:
 	commands = {}
+	commandsByTrigger = {}  #Keys are trigger words, values are lists of the names of the commands that use that trigger
+	commandsCheckingAllMessages = []  #Names of the commands with their own 'shouldExecute', which need to see every message
 	commandFunctions = {}
 	apikeys = {}
 
@@ -15,6 +20,10 @@ class CommandHandler:
 	def __init__(self):
 		self.logger = logging.getLogger("DideRobot")
 		GlobalStore.commandhandler = self
+		self.commandMetrics = CommandMetrics()
+		self.workerPool = CommandWorkerPool(self)
+		self.processPool = ProcessPool()
+		self.blockingDetector = HubBlockingDetector()  #Started by the BotHandler, if it's enabled in the settings
 		self.loadApiKeys()
 
 	def loadApiKeys(self):
@@ -76,37 +85,96 @@ class CommandHandler:
 		:type message: IrcMessage
 		"""
 		if not message.bot.shouldUserBeIgnored(message.user, message.userNickname, message.userAddress):
-			for commandname, command in self.commands.iteritems():
+			#Most commands only fire on an exact trigger, so only check those, plus the commands that want to inspect every message
+			commandnamesToCheck = self.commandsCheckingAllMessages
+			if message.trigger and message.trigger in self.commandsByTrigger:
+				commandnamesToCheck = self.commandsByTrigger[message.trigger] + commandnamesToCheck
+			for commandname in commandnamesToCheck:
+				#A previous command may have unloaded this one
+				if commandname not in self.commands:
+					continue
 				if not self.isCommandAllowedForBot(message.bot, commandname):
 					continue
 
-				if command.shouldExecute(message):
+				command = self.commands[commandname]
+				#Let the blocking detector know which command is running, so it can name it if it blocks the hub
+				self.blockingDetector.setCurrentCommand(commandname, message)
+				startTime = time.time()
+				try:
+					shouldExecute = command.shouldExecute(message)
+				finally:
+					self.blockingDetector.clearCurrentCommand()
+				self.commandMetrics.recordShouldExecute(commandname, time.time() - startTime)
+				if shouldExecute:
 					if command.adminOnly and not message.bot.isUserAdmin(message.user, message.userNickname, message.userAddress):
 						message.reply("Sorry, this command is admin-only", "say")
 					else:
 						if command.callInThread:
-							gevent.spawn(self.executeCommand, commandname, message)
+							#Only complain about being busy if the command was called explicitly, otherwise a flood of links would lead to a flood of complaints
+							if not self.workerPool.queueCall(commandname, message) and message.trigger in command.triggers:
+								message.reply("Sorry, I'm a bit busy right now. Please try again in a little while", "say")
 						else:
 							self.executeCommand(commandname, message)
 						if command.stopAfterThisCommand:
 							break
 
 	def executeCommand(self, commandname, message):
+		self.blockingDetector.setCurrentCommand(commandname, message)
+		startTime = time.time()
 		try:
 			self.commands[commandname].execute(message)
 		except Exception as e:
+			self.commandMetrics.recordExecute(commandname, time.time() - startTime, True)
 			message.reply("Sorry, an error occurred while executing this command. It has been logged, and if you tell my owner(s), they could probably fix it", "say")
 			message.bot.messageLogger.log("ERROR executing '{}': {}".format(commandname, str(e)), message.source)
 			self.logger.error("Exception thrown while handling command '{}' and message '{}'".format(commandname, message.rawText), exc_info=True)
+		else:
+			self.commandMetrics.recordExecute(commandname, time.time() - startTime)
+		finally:
+			self.blockingDetector.clearCurrentCommand()
 
 	@staticmethod
 	def isCommandAllowedForBot(bot, commandname):
-		if bot.settings['commandWhitelist'] is not None and commandname not in bot.settings['commandWhitelist']:
-			return False
-		elif bot.settings['commandBlacklist'] is not None and commandname in bot.settings['commandBlacklist']:
-			return False
-		return True
-	
+		return commandname in bot.allowedCommandNames
+
+	def getAllowedCommandNames(self, settings):
+		"""
+		Returns a frozenset of the names of the loaded commands that are allowed by the whitelist and blacklist in the provided bot settings
+		"""
+		allowedCommandNames = []
+		for commandname in self.commands:
+			if settings['commandWhitelist'] is not None and commandname not in settings['commandWhitelist']:
+				continue
+			elif settings['commandBlacklist'] is not None and commandname in settings['commandBlacklist']:
+				continue
+			allowedCommandNames.append(commandname)
+		return frozenset(allowedCommandNames)
+
+	def rebuildCommandIndex(self):
+		"""
+		Rebuilds the lookup tables that map trigger words to commands, so handleMessage doesn't have to ask every command whether it should fire.
+		Commands that override 'shouldExecute' can fire on anything, so those get checked for every message
+		"""
+		commandsByTrigger = {}
+		commandsCheckingAllMessages = []
+		for commandname, command in self.commands.iteritems():
+			if type(command).shouldExecute.__func__ is not CommandTemplate.shouldExecute.__func__:
+				commandsCheckingAllMessages.append(commandname)
+			else:
+				for trigger in command.triggers:
+					if trigger not in commandsByTrigger:
+						commandsByTrigger[trigger] = [commandname]
+					elif commandname not in commandsByTrigger[trigger]:
+						commandsByTrigger[trigger].append(commandname)
+		#Replace instead of update, so a handleMessage call that's iterating over the old lists doesn't get confused
+		self.commandsByTrigger = commandsByTrigger
+		self.commandsCheckingAllMessages = commandsCheckingAllMessages
+		self.logger.debug("Rebuilt command index: {:,} triggers, {:,} commands that check every message".format(len(commandsByTrigger), len(commandsCheckingAllMessages)))
+		#The set of commands each bot is allowed to use depends on which commands are loaded, so update those too
+		if GlobalStore.bothandler:
+			for bot in GlobalStore.bothandler.bots.itervalues():
+				bot.updateAllowedCommandNames()
+
 	def loadCommands(self, folder='commands'):
 		modulesToIgnore = ('__init__.py', 'CommandTemplate.py')
 		success = True
@@ -135,6 +203,7 @@ class CommandHandler:
 			reload(loadedModule)
 			command = loadedModule.Command()
 			self.commands[name] = command
+			self.rebuildCommandIndex()
 			return (True, "Successfully loaded file '{}'".format(name))
 		except Exception as e:
 			self.logger.error("An error occurred while trying to load command '{}'".format(name), exc_info=True)
@@ -151,6 +220,7 @@ class CommandHandler:
 			self.commands[name].unload()
 			#And remove the reference to it
 			del self.commands[name]
+			self.rebuildCommandIndex()
 			#Check if any registered command functions belong to this module
 			functionsToRemove = []
 			for funcName in self.commandFunctions.keys():
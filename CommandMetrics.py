@@ -0,0 +1,85 @@
+import bisect
+
+
+class LatencyHistogram(object):
+	"""
+	Counts durations in buckets that grow by a fixed factor, so memory use stays the same no matter how many durations get recorded.
+	Percentiles are estimated from the bucket boundaries, so they're accurate to within one bucket (about 25%)
+	"""
+	#Bucket upper bounds in seconds, from 10 microseconds up to about 5 minutes. Anything slower ends up in an extra last bucket
+	bucketBounds = tuple(0.00001 * (1.25 ** bucketIndex) for bucketIndex in xrange(78))
+
+	def __init__(self):
+		self.bucketCounts = [0] * (len(self.bucketBounds) + 1)
+		self.count = 0
+		self.totalSeconds = 0.0
+		self.maxSeconds = 0.0
+
+	def record(self, seconds):
+		self.bucketCounts[bisect.bisect_left(self.bucketBounds, seconds)] += 1
+		self.count += 1
+		self.totalSeconds += seconds
+		if seconds > self.maxSeconds:
+			self.maxSeconds = seconds
+
+	def getPercentile(self, percentile):
+		"""Returns the estimated duration in seconds that 'percentile' percent of the recorded durations were shorter than, or 0.0 if nothing was recorded"""
+		if self.count == 0:
+			return 0.0
+		wantedCount = self.count * percentile / 100.0
+		cumulativeCount = 0
+		for bucketIndex, bucketCount in enumerate(self.bucketCounts):
+			cumulativeCount += bucketCount
+			if cumulativeCount >= wantedCount:
+				#The last bucket has no upper bound, use the slowest duration we saw instead
+				if bucketIndex >= len(self.bucketBounds):
+					return self.maxSeconds
+				return min(self.bucketBounds[bucketIndex], self.maxSeconds)
+		return self.maxSeconds
+
+	def getStats(self):
+		return {'count': self.count, 'average': self.totalSeconds / self.count if self.count else 0.0, 'max': self.maxSeconds,
+				'p50': self.getPercentile(50), 'p95': self.getPercentile(95), 'p99': self.getPercentile(99)}
+
+
+class CommandMetrics(object):
+	"""Keeps track of how often each command gets called, how often it fails, and how long its 'shouldExecute', 'execute' and scheduled function calls take"""
+
+	def __init__(self):
+		self.commandStats = {}  #Keys are command names, values are dicts with the counters and histograms for that command
+
+	def getCommandStats(self, commandname):
+		commandStats = self.commandStats.get(commandname)
+		if commandStats is None:
+			commandStats = {'invocations': 0, 'errors': 0, 'shouldExecute': LatencyHistogram(), 'execute': LatencyHistogram(), 'scheduledFunction': LatencyHistogram()}
+			self.commandStats[commandname] = commandStats
+		return commandStats
+
+	def recordShouldExecute(self, commandname, seconds):
+		self.getCommandStats(commandname)['shouldExecute'].record(seconds)
+
+	def recordExecute(self, commandname, seconds, hadError=False):
+		commandStats = self.getCommandStats(commandname)
+		commandStats['invocations'] += 1
+		if hadError:
+			commandStats['errors'] += 1
+		commandStats['execute'].record(seconds)
+
+	def recordScheduledFunction(self, commandname, seconds, hadError=False):
+		commandStats = self.getCommandStats(commandname)
+		if hadError:
+			commandStats['errors'] += 1
+		commandStats['scheduledFunction'].record(seconds)
+
+	def reset(self):
+		self.commandStats = {}
+
+	def getStats(self, commandname=None):
+		"""Returns a dict with the stats for every command, or just for the provided command. Histograms are turned into dicts with their count and percentiles"""
+		stats = {}
+		for statsCommandname, commandStats in self.commandStats.iteritems():
+			if commandname and statsCommandname != commandname:
+				continue
+			stats[statsCommandname] = {'invocations': commandStats['invocations'], 'errors': commandStats['errors'], 'shouldExecute': commandStats['shouldExecute'].getStats(),
+									   'execute': commandStats['execute'].getStats(), 'scheduledFunction': commandStats['scheduledFunction'].getStats()}
+		return stats
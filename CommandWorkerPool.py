@@ -0,0 +1,101 @@
+import collections, logging, time
+
+import gevent
+
+
+class CommandWorkerPool(object):
+	"""
+	Runs the commands that have 'callInThread' set in a limited number of greenlets, so a flood of links or slow searches can't spawn hundreds of greenlets.
+	If all workers are busy, or the command already has as many calls running as its 'maxConcurrentCalls' allows, the call waits in a queue.
+	If that queue is full too, the call is rejected, and the caller should tell the user the bot is busy
+	"""
+	maxWorkers = 25
+	maxQueuedCalls = 50
+
+	def __init__(self, commandhandler):
+		self.logger = logging.getLogger('DideRobot')
+		self.commandhandler = commandhandler
+		self.runningCount = 0
+		self.runningCountPerCommand = {}  #Keys are command names, values are how many calls of that command are currently running
+		self.queuedCalls = collections.deque()  #Calls waiting for a free worker, as (time queued, command name, message) tuples
+		#Statistics
+		self.startedCallCount = 0
+		self.rejectedCallCount = 0
+		self.maxRunningCount = 0
+		self.maxSecondsQueued = 0.0
+
+	def canStartCall(self, commandname):
+		if self.runningCount >= self.maxWorkers:
+			return False
+		maxConcurrentCalls = self.commandhandler.commands[commandname].maxConcurrentCalls
+		return not maxConcurrentCalls or self.runningCountPerCommand.get(commandname, 0) < maxConcurrentCalls
+
+	def queueCall(self, commandname, message):
+		"""
+		Runs the command in a worker greenlet, or queues it if it can't be started right now
+		:return: True if the call was started or queued, False if it was rejected because the queue is full
+		"""
+		if self.canStartCall(commandname):
+			self.startWorker(commandname, message)
+			return True
+		if len(self.queuedCalls) >= self.maxQueuedCalls:
+			self.rejectedCallCount += 1
+			self.logger.warning("Command worker pool is full, rejecting call to command '{}'".format(commandname))
+			return False
+		self.queuedCalls.append((time.time(), commandname, message))
+		return True
+
+	def markCallStarted(self, commandname):
+		self.runningCount += 1
+		self.runningCountPerCommand[commandname] = self.runningCountPerCommand.get(commandname, 0) + 1
+		self.startedCallCount += 1
+		if self.runningCount > self.maxRunningCount:
+			self.maxRunningCount = self.runningCount
+
+	def markCallFinished(self, commandname):
+		self.runningCount -= 1
+		self.runningCountPerCommand[commandname] -= 1
+		if self.runningCountPerCommand[commandname] <= 0:
+			del self.runningCountPerCommand[commandname]
+
+	def startWorker(self, commandname, message):
+		self.markCallStarted(commandname)
+		gevent.spawn(self.keepRunningCalls, commandname, message)
+
+	def getNextRunnableCall(self):
+		"""Removes and returns the oldest queued call that can be started now, or None if there isn't one"""
+		for queueIndex, (queuedAt, commandname, message) in enumerate(self.queuedCalls):
+			#The command may have been unloaded while the call was waiting
+			if commandname not in self.commandhandler.commands:
+				continue
+			if self.canStartCall(commandname):
+				del self.queuedCalls[queueIndex]
+				secondsQueued = time.time() - queuedAt
+				if secondsQueued > self.maxSecondsQueued:
+					self.maxSecondsQueued = secondsQueued
+				return (commandname, message)
+		return None
+
+	def keepRunningCalls(self, commandname, message):
+		#Instead of stopping after a call, a worker picks up the next queued call, so queued calls don't need a separate greenlet to start them
+		while True:
+			try:
+				self.commandhandler.executeCommand(commandname, message)
+			finally:
+				self.markCallFinished(commandname)
+			self.removeUnloadedCommandCalls()
+			nextCall = self.getNextRunnableCall()
+			if not nextCall:
+				return
+			commandname, message = nextCall
+			self.markCallStarted(commandname)
+
+	def removeUnloadedCommandCalls(self):
+		if self.queuedCalls and any(queuedCall[1] not in self.commandhandler.commands for queuedCall in self.queuedCalls):
+			self.queuedCalls = collections.deque(queuedCall for queuedCall in self.queuedCalls if queuedCall[1] in self.commandhandler.commands)
+
+	def getStats(self):
+		return {'runningCalls': self.runningCount, 'maxWorkers': self.maxWorkers, 'utilisation': float(self.runningCount) / self.maxWorkers,
+				'queuedCalls': len(self.queuedCalls), 'maxQueuedCalls': self.maxQueuedCalls, 'oldestQueuedCallAge': time.time() - self.queuedCalls[0][0] if self.queuedCalls else 0.0,
+				'runningCallsPerCommand': dict(self.runningCountPerCommand), 'startedCalls': self.startedCallCount, 'rejectedCalls': self.rejectedCallCount,
+				'maxRunningCalls': self.maxRunningCount, 'maxSecondsQueued': self.maxSecondsQueued}
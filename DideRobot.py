@@ -8,11 +8,16 @@ import gevent.socket
 
 import Constants
 import GlobalStore
+from IrcLineFramer import IrcLineFramer
+import IrcLineParser
 from IrcMessage import IrcMessage
+from LineSendScheduler import LineSendScheduler
 from MessageLogger import MessageLogger
 
 
 class DideRobot(object):
+	ircMessageHandlers = None  #Lookup table from message type to the function handling it, filled in by 'getIrcMessageHandlers'
+
 	def __init__(self, serverfolder):
 		self.logger = logging.getLogger('DideRobot')
 		self.logger.info("New bot for server '{}' created".format(serverfolder))
@@ -31,13 +36,24 @@ class DideRobot(object):
 		self.shouldReconnect = True
 		self.reconnectionAttempCount = None  # Will keep a count of how many times we've tried to connect, to see if we've exceeded the limit (if any)
 		self.maxConnectionRetries = None  # None means unlimited attempts, can be set by settings file
+		self.reconnectCount = 0  # How many times we've had to reconnect since the bot started
+
+		#Counters for monitoring, see MetricsServer
+		self.linesReceivedCount = 0
+		self.linesSentCount = 0
+		self.bytesReceivedCount = 0
+		self.bytesSentCount = 0
+		self.lastPingReceivedAt = None  # The time we last received a PING from the server on this connection, or None if we haven't yet
 
 		self.secondsBetweenLineSends = None  # If it's 'None', there's no rate limiting, otherwise it's a float of seconds between line sends
-		self.linesToSend = None  # A list with all the lines to send if there is a queue and rate limiting
-		self.lineSendingGreenlet = None  # Will store the greenlet that is currently working its way through the message queue, or is None if there is none
+		self.lineSendBurstSize = 1  # How many lines can be sent in quick succession before the rate limiting kicks in
+		self.lineScheduler = LineSendScheduler(self, self.sendLineToServer)  # Queues lines and sends them out when the rate limiting allows it
+		self.outgoingData = []  # Lines waiting to be written to the socket. Lines sent in the same hub loop iteration get written in one go
+		self.socketWriterGreenlet = None  # The greenlet writing 'outgoingData' to the socket, or None if nothing is being written
 
 		self.commandPrefix = ""  # Pulled from the settings file, separate variable because it's referenced a lot
 		self.commandPrefixLength = 0  # The length if the prefix is also often needed, prevent constant recalculation
+		self.allowedCommandNames = frozenset()  # The names of the commands allowed by the white- and blacklist, so checking a command is a single set lookup
 
 		#Load the settings, and only connect to the server if that succeeded
 		if self.loadSettings(False):
@@ -102,6 +118,7 @@ class DideRobot(object):
 		for l in ('commandWhitelist', 'commandBlacklist'):
 			if self.settings[l] is not None and len(self.settings[l]) == 0:
 				self.settings[l] = None
+		self.updateAllowedCommandNames()
 
 		#Load in the maximum connection settings to try, if there is any
 		self.maxConnectionRetries = self.settings.get('maxConnectionRetries', -1)
@@ -113,6 +130,14 @@ class DideRobot(object):
 		self.secondsBetweenLineSends = self.settings.get('minSecondsBetweenMessages', -1)
 		if self.secondsBetweenLineSends <= 0:
 			self.secondsBetweenLineSends = None
+		#How many lines can be sent at once before having to wait, to allow for some quick back-and-forth without hitting the rate limit
+		self.lineSendBurstSize = max(1, self.settings.get('messageBurstSize', 1))
+		self.lineScheduler.setRateLimit(self.secondsBetweenLineSends, self.lineSendBurstSize)
+
+	def updateAllowedCommandNames(self):
+		#Called when the settings change, and by the CommandHandler when modules get loaded or unloaded
+		if GlobalStore.commandhandler:
+			self.allowedCommandNames = GlobalStore.commandhandler.getAllowedCommandNames(self.settings)
 
 	def saveSettings(self):
 		#First get only the keys that are different from the globalsettings
@@ -163,17 +188,16 @@ class DideRobot(object):
 				self.handleConnection()
 				#If we reach here, 'handleConnection' returned, so we apparently lost the connection (either accidentally or intentionally)
 
-				#Check if we were still sending messages
-				if self.lineSendingGreenlet:
-					# Kill the message sending greenlet to prevent errors
-					self.lineSendingGreenlet.kill()
-					self.lineSendingGreenlet = None
-					#Also clear the message queue, just in case something in there caused the disconnect
-					self.linesToSend = None
+				#Stop sending queued messages to prevent errors, and clear the queue, just in case something in there caused the disconnect
+				self.lineScheduler.clear()
+				if self.socketWriterGreenlet:
+					self.socketWriterGreenlet.kill()
+				self.outgoingData = []
 
 				#Clear the channels and users lists
 				self.channelsUserList = {}
 				self.isUpdatingChannelsUserList = False
+				self.lastPingReceivedAt = None
 
 				#Shutdown here because it only makes sense if we have been connected previously
 				self.ircSocket.shutdown(gevent.socket.SHUT_RDWR)
@@ -197,62 +221,75 @@ class DideRobot(object):
 				self.reconnectionAttempCount = 1
 			else:
 				self.reconnectionAttempCount += 1
+			self.reconnectCount += 1
 			#Wait increasingly long between reconnection attempts, to give the server a chance to restart
 			sleepTime = self.reconnectionAttempCount ** 3
 			self.logger.info("Will try reconnecting to '{}' for attempt {} in {} seconds, max attempts is {}".format(
 				self.serverfolder, self.reconnectionAttempCount, sleepTime, self.maxConnectionRetries if self.maxConnectionRetries else "not set"))
 			gevent.sleep(sleepTime)
-		#If we ever leave this loop, the bot is shut down. Unregister ourselves
+		#If we ever leave this loop, the bot is shut down. Make sure all the logs are written, and unregister ourselves
+		self.messageLogger.shutdown()
 		GlobalStore.bothandler.unregisterBot(self.serverfolder)
 
 	def handleConnection(self):
 		#Keep reading for possible incoming messages
-		incomingData = ""
+		lineFramer = IrcLineFramer(self.settings.get('socketReadSize', 16384))
+		messageHandlers = self.getIrcMessageHandlers()
 		# Set the timeout to 10 minutes, so if our computer loses connection to the server/internet, we notice
 		self.ircSocket.settimeout(600)
 		while True:
 			try:
-				incomingData += self.ircSocket.recv(2048)
+				bytesReceived = lineFramer.receiveFrom(self.ircSocket)
 			except gevent.socket.timeout:
 				self.logger.warning("|{}| Our connection to the server timed out".format(self.serverfolder))
 				return
-			# A closed connection just makes recv return an empty string. Check for that
-			if incomingData == "":
+			# A closed connection just makes recv return nothing. Check for that
+			if bytesReceived == 0:
 				self.logger.info("|{}| Server closed the connection".format(self.serverfolder))
 				return
-			# Handle all completely sent messages (delimited by \r\n), leave any unfinished messages for the next loop
-			while '\r\n' in incomingData:
-				line, incomingData = incomingData.split('\r\n', 1)
+			self.bytesReceivedCount += bytesReceived
+			# Handle all completely sent messages (delimited by \r\n), the framer keeps any unfinished messages for the next loop
+			for lineView in lineFramer.getLines():
+				line = lineView.tobytes()
+				self.linesReceivedCount += 1
 				# First deal with the simplest type of message, PING. Just reply PONG
 				if line.startswith("PING"):
-					self.sendLineToServer(line.replace("PING", "PONG", 1), False)
+					self.lastPingReceivedAt = time.time()
+					self.queueLineToSend(line.replace("PING", "PONG", 1), isPriority=True, shouldLogMessage=False)
+					continue
+				# Let's find out what kind of message this is!
+				parsedLine = IrcLineParser.parseLine(line)
+				if not parsedLine:
+					self.logger.warning("|{}| Unable to parse line '{}'".format(self.serverfolder, line))
+					continue
+				#Lines without a prefix (like 'NOTICE AUTH' or 'ERROR' while connecting) don't come from a user, and the 'irc_' handlers expect one. Let the generic function log them
+				if parsedLine.prefix is None and parsedLine.command != 'PING':
+					self.irc_unknown_message_type(self.settings['server'], parsedLine.command, parsedLine.params)
+					continue
+				#Check if we have a function to deal with this type of message
+				messageTypeFunction = messageHandlers.get(parsedLine.command, None)
+				if messageTypeFunction:
+					messageTypeFunction(self, parsedLine.prefix, parsedLine.params)
 				else:
-					# Let's find out what kind of message this is!
-					lineParts = line.split(" ")
-					# A line consists at least of 'source messageType [target] content'
-					messageSource = lineParts[0]
-					# It usually starts with a colon, remove that
-					if messageSource.startswith(":"):
-						messageSource = messageSource[1:]
-					messageType = lineParts[1]
-					#Convert numerical replies to human-readable ones, if applicable
-					messageType = Constants.IRC_NUMERIC_TO_NAME.get(messageType, messageType)
-					#The IRC protocol uses ':' to denote the start of a multi-word string. Join those here too, for easier parsing later
-					messageParts = lineParts[2:]
-					for messagePartIndex, messagePart in enumerate(messageParts):
-						if messagePart.startswith(':'):
-							#Join all the separate parts of the wordgroup, and remove the starting colon
-							wordgroup = " ".join(messageParts[messagePartIndex:])[1:]
-							messageParts[messagePartIndex] = wordgroup
-							messageParts = messageParts[:messagePartIndex+1]
-							break
-					#Check if we have a function to deal with this type of message
-					messageTypeFunction = getattr(self, "irc_" + messageType, None)
-					if messageTypeFunction:
-						messageTypeFunction(messageSource, messageParts)
-					else:
-						#No function for this type of message, fall back to a generic function
-						self.irc_unknown_message_type(messageSource, messageType, lineParts)
+					#No function for this type of message, fall back to a generic function. Convert numerical replies to human-readable ones, if applicable
+					self.irc_unknown_message_type(parsedLine.prefix, Constants.IRC_NUMERIC_TO_NAME.get(parsedLine.command, parsedLine.command), parsedLine.params)
+
+	@classmethod
+	def getIrcMessageHandlers(cls):
+		"""
+		Returns a dict with IRC message types (both the numeric and the human-readable form) as keys, and the 'irc_' function that handles that message type as value.
+		It's built once per class, so incoming lines don't need string concatenation and a getattr call to find their handler
+		"""
+		if cls.__dict__.get('ircMessageHandlers', None) is None:
+			messageHandlers = {}
+			for attributeName in dir(cls):
+				if attributeName.startswith('irc_') and attributeName != 'irc_unknown_message_type':
+					messageHandlers[attributeName[4:]] = getattr(cls, attributeName)
+			for numeric, name in Constants.IRC_NUMERIC_TO_NAME.iteritems():
+				if name in messageHandlers:
+					messageHandlers[numeric] = messageHandlers[name]
+			cls.ircMessageHandlers = messageHandlers
+		return cls.ircMessageHandlers
 
 	def irc_RPL_WELCOME(self, source, parameters):
 		"""Called when we finished connecting to the server"""
@@ -312,9 +349,9 @@ class DideRobot(object):
 		#If we ARE connected, let the server know we want to quit
 		if self.connectedAt is not None:
 			if quitMessage:
-				self.sendLineToServer("QUIT :" + quitMessage)
+				self.queueLineToSend("QUIT :" + quitMessage, isPriority=True)
 			else:
-				self.sendLineToServer("QUIT")
+				self.queueLineToSend("QUIT", isPriority=True)
 
 
 	#MESSAGE TYPE HANDLING FUNCTIONS
@@ -324,6 +361,11 @@ class DideRobot(object):
 	def ctcp_unknown_message_type(self, ctcpType, user, messageTarget, message):
 		self.logger.info("|{}| Received unknown CTCP command '{}' on {} from {}, message '{}'".format(self.serverfolder, ctcpType, messageTarget, user, message))
 
+	def irc_PING(self, prefix, params):
+		#Most PINGs are answered before parsing, this catches the ones that come with a prefix or IRCv3 tags
+		self.lastPingReceivedAt = time.time()
+		self.queueLineToSend("PONG :" + (params[-1] if params else ""), isPriority=True, shouldLogMessage=False)
+
 	def irc_RPL_MOTD(self, prefix, params):
 		self.messageLogger.log("Server message of the day: " + params[1])
 
@@ -526,7 +568,25 @@ class DideRobot(object):
 			return
 		if shouldLogMessage:
 			self.logger.debug("|{}| > {}".format(self.serverfolder, lineToSend))
-		self.ircSocket.send(lineToSend + "\r\n")
+		self.outgoingData.append(lineToSend + "\r\n")
+		self.linesSentCount += 1
+		#Don't write right away, but let the writer greenlet start on the next loop iteration, so all lines sent before then get written in one call
+		if not self.socketWriterGreenlet:
+			self.socketWriterGreenlet = gevent.spawn(self.writeOutgoingData)
+
+	def writeOutgoingData(self):
+		try:
+			#If the server is slow to accept our data, 'sendall' waits until everything is written. Lines added in the meantime get written in the next loop
+			while self.outgoingData and self.ircSocket:
+				dataToWrite = "".join(self.outgoingData)
+				self.outgoingData = []
+				self.ircSocket.sendall(dataToWrite)
+				self.bytesSentCount += len(dataToWrite)
+		except (gevent.socket.timeout, gevent.socket.error) as e:
+			self.logger.error("|{}| Error while sending data to the server, discarding unsent lines: {}".format(self.serverfolder, e))
+			self.outgoingData = []
+		finally:
+			self.socketWriterGreenlet = None
 
 	def irc_ERR_NOTEXTTOSEND(self, prefix, params):
 		self.logger.error("|{}| We just sent an empty line to the server, which is probably a bug in a module!".format(self.serverfolder))
@@ -535,35 +595,12 @@ class DideRobot(object):
 	def formatCtcpMessage(ctcpType, messageText):
 		return "{delim}{ctcpType} {msg}{delim}".format(delim=Constants.CTCP_DELIMITER, ctcpType=ctcpType, msg=messageText)
 
-	def sendLineFromQueue(self):
-		try:
-			while True:
-				#Verify that we're still connected and there is still a message in the queue, otherwise reset everything
-				if self.connectedAt is None or not self.linesToSend or len(self.linesToSend) == 0:
-					self.linesToSend = None
-					self.lineSendingGreenlet = None
-					break
-				#Remove the first queued message and send it
-				self.sendLineToServer(self.linesToSend.pop(0))
-				#Keep going through the message queue until it's empty
-				gevent.sleep(self.secondsBetweenLineSends)
-		except gevent.GreenletExit:
-			self.logger.info("|{}| Line sender greenlet was killed".format(self.serverfolder))
-
-	def queueLineToSend(self, lineToSend):
-		#If there's no rate limiting, there's no need for queueing either. Send the message now
-		if not self.secondsBetweenLineSends:
-			self.sendLineToServer(lineToSend)
-			return
-		#If there are no lines queued, the list is set to 'None'. Create a new list
-		if not self.linesToSend:
-			self.linesToSend = [lineToSend]
-		# Add the message to the queue
-		else:
-			self.linesToSend.append(lineToSend)
-		# If there's not yet a greenlet clearing the message queue, create one
-		if not self.lineSendingGreenlet:
-			self.lineSendingGreenlet = gevent.spawn(self.sendLineFromQueue)
+	def queueLineToSend(self, lineToSend, target=None, isPriority=False, shouldLogMessage=True):
+		"""
+		Queues the line to be sent when the rate limiting allows it. If there's no rate limiting, it gets sent right away.
+		Lines for different targets take turns, and priority lines (PONG, QUIT, private messages) go before all other queued lines
+		"""
+		self.lineScheduler.queueLine(lineToSend, target, isPriority, shouldLogMessage)
 
 	def sendMessage(self, target, messageText, messageType='say'):
 		#Only say something if we're not muted, or if it's a private message or a notice
@@ -600,11 +637,8 @@ class DideRobot(object):
 				else:
 					extraLines.insert(0, line[Constants.MAX_MESSAGE_LENGTH:])
 				line = line[:Constants.MAX_MESSAGE_LENGTH]
-			if target[0] not in Constants.CHANNEL_PREFIXES:
-				#If it's a PM, bypass the message queue
-				self.sendLineToServer(line)
-			else:
-				self.queueLineToSend(line)
+			#PMs skip ahead of channel messages in the queue
+			self.queueLineToSend(line, target, isPriority=target[0] not in Constants.CHANNEL_PREFIXES)
 			self.messageLogger.log(logtext.format(user=self.nickname, message=messageText), target)
 			#Make sure any extra lines get sent too
 			if extraLines:
@@ -617,6 +651,9 @@ class DideRobot(object):
 		return self.isUserInList(self.settings['admins'], user, userNick, userAddress)
 
 	def shouldUserBeIgnored(self, user, userNick=None, userAddress=None):
+		#This gets called for every message, so skip the user parsing if there's nobody to ignore
+		if not self.settings['userIgnoreList']:
+			return False
 		return self.isUserInList(self.settings['userIgnoreList'], user, userNick, userAddress)
 
 	@staticmethod
@@ -0,0 +1,149 @@
+import collections, logging, sys, time, traceback
+
+import gevent
+import gevent.hub
+import gevent.monkey
+import greenlet
+
+
+class HubBlockingDetector(object):
+	"""
+	Detects code that keeps running without ever letting another greenlet run, which freezes every bot until it's done.
+	A greenlet trace function records every switch, and a native thread checks whether a greenlet other than the hub has been running for too long without switching.
+	If so, the stack of the running code and the command (and message) the blocking greenlet is handling get logged, and the incident is counted for that command.
+	The native thread never touches the bots, it hands incidents to the hub, which handles them as soon as the blocking code lets it run again
+	"""
+	noCommandName = "(no command)"  #Used in the stats when the blocking code wasn't running a command
+
+	def __init__(self, maxBlockingMilliseconds=500):
+		self.logger = logging.getLogger('DideRobot')
+		self.maxBlockingSeconds = maxBlockingMilliseconds / 1000.0
+		self.isRunning = False
+		self.hub = None
+		self.hubThreadId = None
+		self.incidentWatcher = None  #An 'async' watcher, the only hub object that's safe to use from another thread
+		self.previousTraceFunction = None
+		self.monitorThreadExitLock = None  #A native lock the monitoring thread holds while it runs, so 'stop' can wait for it to finish
+		#Updated by the trace function, read by the monitoring thread
+		self.switchCount = 0
+		self.lastSwitchTime = time.time()
+		self.currentGreenlet = None
+		#Keys are greenlets, values are (command name, message) tuples of the command that greenlet is running. Message is None for scheduled functions
+		self.commandsByGreenlet = {}
+		self.detectedIncidents = collections.deque()  #Filled by the monitoring thread, emptied by the hub
+		#Statistics, keys are command names, values are dicts with incident count and the longest block
+		self.incidentStats = {}
+
+	def start(self):
+		if self.isRunning:
+			return
+		self.isRunning = True
+		self.hub = gevent.get_hub()
+		self.hubThreadId = gevent.monkey.get_original('thread', 'get_ident')()
+		self.incidentWatcher = self.hub.loop.async_()
+		self.incidentWatcher.start(self.handleDetectedIncidents)
+		#The watcher shouldn't keep the program running when everything else is done
+		self.incidentWatcher.ref = False
+		self.currentGreenlet = greenlet.getcurrent()
+		self.lastSwitchTime = time.time()
+		self.previousTraceFunction = greenlet.settrace(self.trace)
+		self.monitorThreadExitLock = gevent.monkey.get_original('thread', 'allocate_lock')()
+		self.monitorThreadExitLock.acquire()
+		gevent.monkey.get_original('thread', 'start_new_thread')(self.keepCheckingForBlocking, ())
+		self.logger.info("Hub blocking detector started, reporting code that blocks for more than {:.0f} ms".format(self.maxBlockingSeconds * 1000))
+
+	def stop(self):
+		if not self.isRunning:
+			return
+		self.isRunning = False
+		#Wait for the monitoring thread to finish. If it's still running when the interpreter shuts down, it crashes with an unhandled exception while the modules get torn down
+		# It checks whether it should stop at least every 50 ms, so this doesn't block for long
+		self.monitorThreadExitLock.acquire()
+		self.monitorThreadExitLock.release()
+		self.monitorThreadExitLock = None
+		#Only remove our trace function if nothing replaced it in the meantime, otherwise we'd remove that one too
+		if greenlet.gettrace() == self.trace:
+			greenlet.settrace(self.previousTraceFunction)
+		self.incidentWatcher.stop()
+		self.incidentWatcher = None
+		self.logger.info("Hub blocking detector stopped")
+
+	def trace(self, event, args):
+		if event in ('switch', 'throw'):
+			self.switchCount += 1
+			self.lastSwitchTime = time.time()
+			self.currentGreenlet = args[1]
+		if self.previousTraceFunction:
+			self.previousTraceFunction(event, args)
+
+	def setCurrentCommand(self, commandname, message=None):
+		self.commandsByGreenlet[greenlet.getcurrent()] = (commandname, message)
+
+	def clearCurrentCommand(self):
+		self.commandsByGreenlet.pop(greenlet.getcurrent(), None)
+
+	def keepCheckingForBlocking(self):
+		try:
+			self.checkForBlocking()
+		finally:
+			#Tell 'stop' we're done
+			self.monitorThreadExitLock.release()
+
+	def checkForBlocking(self):
+		#This runs in a native thread, so it has to use the original sleep, and it can't use anything that might switch greenlets
+		nativeSleep = gevent.monkey.get_original('time', 'sleep')
+		reportedSwitchCount = None
+		while self.isRunning:
+			#Sleep in short steps, so 'stop' doesn't have to wait for a whole check interval
+			nextCheckTime = time.time() + max(0.05, self.maxBlockingSeconds / 2)
+			while self.isRunning and time.time() < nextCheckTime:
+				nativeSleep(min(0.05, max(0.0, nextCheckTime - time.time())))
+			if not self.isRunning:
+				break
+			switchCount = self.switchCount
+			blockingGreenlet = self.currentGreenlet
+			#The hub waiting for something to happen is fine, and a block only needs to be reported once
+			if switchCount == reportedSwitchCount or blockingGreenlet is self.hub or isinstance(blockingGreenlet, gevent.hub.Hub):
+				continue
+			blockedSince = self.lastSwitchTime
+			if time.time() - blockedSince < self.maxBlockingSeconds or switchCount != self.switchCount:
+				continue
+			reportedSwitchCount = switchCount
+			frame = sys._current_frames().get(self.hubThreadId)
+			stack = "".join(traceback.format_stack(frame)) if frame else "(stack not available)"
+			commandname, message = self.commandsByGreenlet.get(blockingGreenlet, (None, None))
+			self.detectedIncidents.append((blockedSince, blockingGreenlet, commandname, message, stack))
+			watcher = self.incidentWatcher
+			if watcher:
+				watcher.send()
+
+	def handleDetectedIncidents(self):
+		#Runs in the hub, right after the blocking code switched away, so we can tell how long the block lasted
+		now = time.time()
+		while self.detectedIncidents:
+			blockedSince, blockingGreenlet, commandname, message, stack = self.detectedIncidents.popleft()
+			blockedSeconds = now - blockedSince
+			statsCommandname = commandname if commandname else self.noCommandName
+			if statsCommandname not in self.incidentStats:
+				self.incidentStats[statsCommandname] = {'incidents': 0, 'maxBlockedSeconds': 0.0, 'totalBlockedSeconds': 0.0}
+			commandStats = self.incidentStats[statsCommandname]
+			commandStats['incidents'] += 1
+			commandStats['totalBlockedSeconds'] += blockedSeconds
+			if blockedSeconds > commandStats['maxBlockedSeconds']:
+				commandStats['maxBlockedSeconds'] = blockedSeconds
+			if message:
+				culprit = "command '{}' handling message '{}' from {} in {} on {}".format(commandname, message.rawText, message.user, message.source, message.bot.serverfolder)
+			elif commandname:
+				culprit = "the scheduled function of command '{}'".format(commandname)
+			else:
+				culprit = "greenlet {!r}, which wasn't running a command".format(blockingGreenlet)
+			self.logger.warning("The hub was blocked for {:.3f} seconds by {}. Stack while blocked:\n{}".format(blockedSeconds, culprit, stack))
+
+	def reset(self):
+		self.incidentStats = {}
+
+	def getStats(self, commandname=None):
+		"""Returns a dict with command names as keys, and a dict with the incident count, longest and total blocked seconds as values. Code that wasn't running a command is under '(no command)'"""
+		if commandname:
+			return {commandname: dict(self.incidentStats[commandname])} if commandname in self.incidentStats else {}
+		return {statsCommandname: dict(commandStats) for statsCommandname, commandStats in self.incidentStats.iteritems()}
@@ -0,0 +1,82 @@
+class IrcLineFramer(object):
+	"""
+	Splits the incoming byte stream from a socket into separate IRC lines.
+	Data is read into one reusable bytearray, and a scan offset is kept so every received byte is only searched for a line ending once,
+	 instead of copying and re-searching the whole buffer on every read like string concatenation and splitting does
+	"""
+
+	LINE_DELIMITER = '\r\n'
+
+	def __init__(self, readSize=4096, initialBufferSize=None):
+		#How many bytes to read from the socket at a time
+		self.readSize = readSize
+		#Make sure there's always room for a few reads, so we don't need to move data around too often
+		if not initialBufferSize or initialBufferSize < readSize * 4:
+			initialBufferSize = readSize * 4
+		self.buffer = bytearray(initialBufferSize)
+		self.bufferView = memoryview(self.buffer)
+		self.dataStart = 0  #Where the first not yet returned line starts
+		self.dataEnd = 0  #Where the received data ends, anything after this is unused buffer space
+		self.scanOffset = 0  #Everything before this index has already been checked for a line ending
+
+	def getBufferedByteCount(self):
+		return self.dataEnd - self.dataStart
+
+	def makeRoomForRead(self):
+		if self.dataEnd + self.readSize <= len(self.buffer):
+			return
+		unhandledByteCount = self.dataEnd - self.dataStart
+		#If the unfinished line is too long to fit alongside another read, we need a bigger buffer
+		if unhandledByteCount + self.readSize > len(self.buffer):
+			#Create a new buffer instead of resizing the current one, since resizing isn't allowed while memoryviews of it still exist
+			newBuffer = bytearray(max(len(self.buffer) * 2, unhandledByteCount + self.readSize))
+			newBuffer[0:unhandledByteCount] = self.buffer[self.dataStart:self.dataEnd]
+			self.buffer = newBuffer
+			self.bufferView = memoryview(newBuffer)
+		#Otherwise move the unfinished line to the start of the buffer. Slicing copies, so the source and target overlapping isn't a problem
+		else:
+			self.buffer[0:unhandledByteCount] = self.buffer[self.dataStart:self.dataEnd]
+		self.scanOffset -= self.dataStart
+		self.dataStart = 0
+		self.dataEnd = unhandledByteCount
+
+	def receiveFrom(self, sourceSocket):
+		"""
+		Reads once from the provided socket into the buffer
+		:return: The number of bytes read. 0 means the connection was closed
+		"""
+		self.makeRoomForRead()
+		bytesRead = sourceSocket.recv_into(self.bufferView[self.dataEnd:], self.readSize)
+		self.dataEnd += bytesRead
+		return bytesRead
+
+	def feed(self, data):
+		"""Adds the provided data to the buffer as if it had been received, useful for replaying recorded traffic"""
+		dataLength = len(data)
+		dataIndex = 0
+		while dataIndex < dataLength:
+			self.makeRoomForRead()
+			chunkLength = min(self.readSize, dataLength - dataIndex)
+			self.buffer[self.dataEnd:self.dataEnd + chunkLength] = data[dataIndex:dataIndex + chunkLength]
+			self.dataEnd += chunkLength
+			dataIndex += chunkLength
+
+	def getLines(self):
+		"""
+		Generator that returns all the complete lines currently in the buffer, without the line delimiter, as memoryview slices of the buffer.
+		The slices are only valid until the next 'receiveFrom' or 'feed' call, so call 'tobytes()' on them if they need to be kept around
+		"""
+		#Store often-used attributes locally, since attribute lookups add up when there's a lot of lines
+		findDelimiter = self.buffer.find
+		bufferView = self.bufferView
+		dataEnd = self.dataEnd
+		lineStart = self.dataStart
+		lineEnd = findDelimiter(self.LINE_DELIMITER, self.scanOffset, dataEnd)
+		while lineEnd != -1:
+			#Update the state before yielding, so it's correct even if the caller stops iterating halfway through
+			self.dataStart = self.scanOffset = lineEnd + 2
+			yield bufferView[lineStart:lineEnd]
+			lineStart = lineEnd + 2
+			lineEnd = findDelimiter(self.LINE_DELIMITER, lineStart, dataEnd)
+		#Resume searching at the last byte next time, since that could be the first half of the delimiter
+		self.scanOffset = max(lineStart, dataEnd - 1)
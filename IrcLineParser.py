@@ -0,0 +1,73 @@
+from collections import namedtuple
+
+
+#A single parsed line from the server. 'tags' is a dict of IRCv3 message tags or None if there weren't any, 'prefix' is the server or user the line came from
+# (or None if not provided), 'command' is the message type like 'PRIVMSG' or '001', and 'params' is a list of the parameters, with the trailing parameter (the one after ' :') as the last entry
+ParsedIrcLine = namedtuple('ParsedIrcLine', ('tags', 'prefix', 'command', 'params'))
+createParsedIrcLineTuple = tuple.__new__
+
+#IRCv3 tag values escape some characters, since they'd otherwise break up the tag section. See https://ircv3.net/specs/extensions/message-tags.html
+TAG_VALUE_UNESCAPES = {':': ';', 's': ' ', '\\': '\\', 'r': '\r', 'n': '\n'}
+
+
+def unescapeTagValue(value):
+	unescapedValue = []
+	charIndex = 0
+	valueLength = len(value)
+	while charIndex < valueLength:
+		char = value[charIndex]
+		if char == '\\':
+			charIndex += 1
+			#A backslash at the end of a value is just dropped, and an unknown escape becomes just the escaped character
+			if charIndex < valueLength:
+				unescapedValue.append(TAG_VALUE_UNESCAPES.get(value[charIndex], value[charIndex]))
+		else:
+			unescapedValue.append(char)
+		charIndex += 1
+	return "".join(unescapedValue)
+
+def parseTags(tagString):
+	"""Turns an IRCv3 tag string like 'time=2017-01-01T12:00:00.000Z;account=someone' into a dict. Tags without a value get an empty string as value"""
+	tags = {}
+	for tag in tagString.split(';'):
+		if not tag:
+			continue
+		key, separator, value = tag.partition('=')
+		if '\\' in value:
+			value = unescapeTagValue(value)
+		tags[key] = value
+	return tags
+
+def parseLine(line):
+	"""
+	Parses a single line received from the server (without the line delimiter) into a ParsedIrcLine
+	:return: The ParsedIrcLine, or None if the line is empty or malformed
+	"""
+	if not line:
+		return None
+	tags = None
+	if line[0] == '@':
+		spaceIndex = line.find(' ')
+		if spaceIndex == -1:
+			return None
+		tags = parseTags(line[1:spaceIndex])
+		line = line[spaceIndex + 1:].lstrip(' ')
+
+	prefix = None
+	if line and line[0] == ':':
+		spaceIndex = line.find(' ')
+		if spaceIndex == -1:
+			return None
+		prefix = line[1:spaceIndex]
+		line = line[spaceIndex + 1:]
+
+	#The IRC protocol uses ' :' to denote the start of the last parameter, which can contain spaces
+	middle, separator, trailing = line.partition(' :')
+	params = middle.split()
+	if not params:
+		return None
+	command = params.pop(0)
+	if separator:
+		params.append(trailing)
+	#Calling tuple.__new__ directly skips the namedtuple's Python-level constructor, which matters at this call rate
+	return createParsedIrcLineTuple(ParsedIrcLine, (tags, prefix, command, params))
@@ -6,6 +6,11 @@ import Constants
 class IrcMessage(object):
 	"""Parses incoming messages into usable parts like the command trigger"""
 
+	#A lot of these get created on busy channels, so use slots to keep them small.
+	# The slots starting with 'parsed' are filled in on first access by the properties below, since most messages never get looked at that closely
+	__slots__ = ('createdAt', 'messageType', 'bot', 'user', 'source', 'isPrivateMessage', 'rawText', 'trigger', 'message',
+				 'parsedUserNickname', 'parsedUserAddress', 'parsedUserNicknameLower', 'parsedMessageParts')
+
 	def __init__(self, messageType, bot, user=None, source=None, rawText=""):
 		self.createdAt = time.time()
 		#MessageType is what kind of message it is. A 'say', 'action' or 'quit', for instance
@@ -13,13 +18,8 @@ class IrcMessage(object):
 
 		self.bot = bot
 
-		#Info about the user that sent the message
+		#Info about the user that sent the message. The nickname and address get split off when they're needed
 		self.user = user
-		if self.user and '!' in self.user:
-			self.userNickname, self.userAddress = self.user.split("!", 1)
-		else:
-			self.userNickname = None
-			self.userAddress = None
 
 		#Info about the source the message came from, either a channel, or a PM from a user
 		#If there is no source provided, or the source isn't a channel, assume it's a PM
@@ -38,8 +38,6 @@ class IrcMessage(object):
 		if not self.rawText:
 			self.trigger = None
 			self.message = ""
-			self.messageParts = []
-			self.messagePartsLength = 0
 		else:
 			#Collect information about the possible command in this message
 			if self.rawText.startswith(bot.commandPrefix):
@@ -58,12 +56,50 @@ class IrcMessage(object):
 				self.trigger = None
 				self.message = self.rawText
 
-			if self.message != "":
-				self.messageParts = self.message.split(" ")
-				self.messagePartsLength = len(self.messageParts)
-			else:
-				self.messageParts = []
-				self.messagePartsLength = 0
+	def parseUser(self):
+		if self.user and '!' in self.user:
+			self.parsedUserNickname, self.parsedUserAddress = self.user.split("!", 1)
+		else:
+			self.parsedUserNickname = None
+			self.parsedUserAddress = None
+
+	@property
+	def userNickname(self):
+		#Unfilled slots raise an AttributeError, which means we haven't parsed this yet
+		try:
+			return self.parsedUserNickname
+		except AttributeError:
+			self.parseUser()
+			return self.parsedUserNickname
+
+	@property
+	def userAddress(self):
+		try:
+			return self.parsedUserAddress
+		except AttributeError:
+			self.parseUser()
+			return self.parsedUserAddress
+
+	@property
+	def userNicknameLower(self):
+		try:
+			return self.parsedUserNicknameLower
+		except AttributeError:
+			userNickname = self.userNickname
+			self.parsedUserNicknameLower = userNickname.lower() if userNickname else userNickname
+			return self.parsedUserNicknameLower
+
+	@property
+	def messageParts(self):
+		try:
+			return self.parsedMessageParts
+		except AttributeError:
+			self.parsedMessageParts = self.message.split(" ") if self.message != "" else []
+			return self.parsedMessageParts
+
+	@property
+	def messagePartsLength(self):
+		return len(self.messageParts)
 
 	def reply(self, replytext, messagetype=None):
 		if not messagetype:
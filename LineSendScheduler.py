@@ -0,0 +1,147 @@
+import collections, logging, time
+
+import gevent
+
+
+class LineSendScheduler(object):
+	"""
+	Decides when queued lines get sent to the server, so a rate-limited server doesn't kick the bot for flooding.
+	Sending is limited by a token bucket: every sent line costs a token, tokens refill at a fixed rate, and up to 'burstSize' tokens can be saved up.
+	Normal lines are queued per target (channel or user) and sent round-robin, so one channel getting a long reply doesn't starve the others.
+	Priority lines (PONGs, QUITs and private messages) skip ahead of all the normal lines
+	"""
+
+	def __init__(self, bot, sendFunction):
+		"""
+		:param bot: The DideRobot this scheduler sends lines for, used for logging
+		:param sendFunction: The function that actually sends a line to the server. Gets called with the line and whether the line should be logged
+		"""
+		self.logger = logging.getLogger('DideRobot')
+		self.bot = bot
+		self.sendFunction = sendFunction
+
+		self.secondsPerToken = None  #None means there's no rate limiting, so every line gets sent right away
+		self.burstSize = 1
+		self.tokenCount = 1.0
+		self.lastTokenUpdateTime = time.time()
+
+		#Each queue entry is a tuple of (time queued, line, whether the line should be logged)
+		self.priorityQueue = collections.deque()
+		self.targetQueues = {}  #Keys are targets, values are deques with the lines queued for that target
+		self.targetOrder = collections.deque()  #The targets that have lines queued, in the order they'll get to send their next line
+		self.queuedLineCount = 0
+		self.senderGreenlet = None
+
+		#Statistics, useful to see if the rate limiting is causing long delays
+		self.sentLineCount = 0
+		self.totalSecondsWaited = 0.0
+		self.maxSecondsWaited = 0.0
+
+	def setRateLimit(self, secondsBetweenLines, burstSize=1):
+		"""Updates how fast lines can be sent. If 'secondsBetweenLines' is None, lines won't be rate-limited"""
+		wasRateLimited = bool(self.secondsPerToken)
+		self.secondsPerToken = secondsBetweenLines
+		self.burstSize = max(1, burstSize)
+		#Start out with a full bucket, but don't hand out extra tokens if the limit just got changed
+		if not wasRateLimited:
+			self.tokenCount = float(self.burstSize)
+			self.lastTokenUpdateTime = time.time()
+		else:
+			self.tokenCount = min(self.tokenCount, self.burstSize)
+		#If rate limiting got turned off, there's no reason to keep lines waiting
+		if not self.secondsPerToken and self.queuedLineCount > 0:
+			self.sendQueuedLines()
+
+	def updateTokenCount(self):
+		now = time.time()
+		if self.tokenCount < self.burstSize:
+			self.tokenCount = min(self.burstSize, self.tokenCount + (now - self.lastTokenUpdateTime) / self.secondsPerToken)
+		self.lastTokenUpdateTime = now
+
+	def queueLine(self, line, target=None, isPriority=False, shouldLogMessage=True):
+		#Without rate limiting there's no need to queue anything
+		if not self.secondsPerToken:
+			self.sendFunction(line, shouldLogMessage)
+			return
+		queueEntry = (time.time(), line, shouldLogMessage)
+		if isPriority:
+			self.priorityQueue.append(queueEntry)
+		elif target in self.targetQueues:
+			self.targetQueues[target].append(queueEntry)
+		else:
+			self.targetQueues[target] = collections.deque((queueEntry,))
+			self.targetOrder.append(target)
+		self.queuedLineCount += 1
+		#If there's not yet a greenlet clearing the queue, start one. It sends right away if there's a token available
+		if not self.senderGreenlet:
+			self.senderGreenlet = gevent.spawn(self.keepSendingQueuedLines)
+
+	def getNextQueueEntry(self):
+		if self.priorityQueue:
+			return self.priorityQueue.popleft()
+		#Take a line from the target whose turn it is, and move that target to the back of the line if it has more lines queued
+		target = self.targetOrder.popleft()
+		targetQueue = self.targetQueues[target]
+		queueEntry = targetQueue.popleft()
+		if targetQueue:
+			self.targetOrder.append(target)
+		else:
+			del self.targetQueues[target]
+		return queueEntry
+
+	def sendNextQueuedLine(self):
+		queuedAt, line, shouldLogMessage = self.getNextQueueEntry()
+		self.queuedLineCount -= 1
+		secondsWaited = time.time() - queuedAt
+		self.sentLineCount += 1
+		self.totalSecondsWaited += secondsWaited
+		if secondsWaited > self.maxSecondsWaited:
+			self.maxSecondsWaited = secondsWaited
+		self.sendFunction(line, shouldLogMessage)
+
+	def sendQueuedLines(self):
+		"""Sends all the queued lines right now, ignoring the rate limit"""
+		while self.queuedLineCount > 0:
+			self.sendNextQueuedLine()
+
+	def keepSendingQueuedLines(self):
+		try:
+			while self.queuedLineCount > 0 and self.secondsPerToken:
+				self.updateTokenCount()
+				if self.tokenCount >= 1:
+					self.tokenCount -= 1
+					self.sendNextQueuedLine()
+				else:
+					#Wait until the next token is available
+					gevent.sleep((1 - self.tokenCount) * self.secondsPerToken)
+		except gevent.GreenletExit:
+			self.logger.info("|{}| Line sender greenlet was killed".format(self.bot.serverfolder))
+		finally:
+			self.senderGreenlet = None
+
+	def clear(self):
+		"""Stops sending and throws away all the queued lines, for instance because the connection was lost"""
+		if self.senderGreenlet:
+			self.senderGreenlet.kill()
+			self.senderGreenlet = None
+		self.priorityQueue.clear()
+		self.targetQueues = {}
+		self.targetOrder.clear()
+		self.queuedLineCount = 0
+
+	def getOldestQueuedLineAge(self):
+		"""Returns how many seconds the line that has been waiting longest has been in the queue, or 0 if there's no queued lines"""
+		oldestQueueTime = None
+		if self.priorityQueue:
+			oldestQueueTime = self.priorityQueue[0][0]
+		for targetQueue in self.targetQueues.itervalues():
+			if oldestQueueTime is None or targetQueue[0][0] < oldestQueueTime:
+				oldestQueueTime = targetQueue[0][0]
+		if oldestQueueTime is None:
+			return 0.0
+		return time.time() - oldestQueueTime
+
+	def getStats(self):
+		return {'queuedLines': self.queuedLineCount, 'queuedPriorityLines': len(self.priorityQueue), 'queuedTargets': len(self.targetQueues),
+				'oldestQueuedLineAge': self.getOldestQueuedLineAge(), 'sentLines': self.sentLineCount,
+				'averageSecondsWaited': self.totalSecondsWaited / self.sentLineCount if self.sentLineCount else 0.0, 'maxSecondsWaited': self.maxSecondsWaited}
@@ -0,0 +1,154 @@
+"""
+Compresses finished daily message logs, and reads them back.
+Each archive is a gzip file with a separate gzip member per hour, so a single hour can be decompressed without reading the rest of the day.
+Next to each archive an index file is written, which stores where each hour starts in the archive and on which lines each nick appears
+"""
+
+import gzip, itertools, json, os, re, zlib
+
+LOG_EXTENSION = '.log'
+ARCHIVE_EXTENSION = '.log.gz'
+INDEX_EXTENSION = '.log.index.json'
+GZIP_WBITS = 16 + zlib.MAX_WBITS  #Tells zlib to read and write gzip headers
+
+#Every logged line starts with a timestamp, like '[12:34:56] '
+LOGLINE_REGEX = re.compile(r"^\[(?P<hour>\d{2}):\d{2}:\d{2}\] ")
+#The formats MessageLogger gets messages in from DideRobot, with the nick of the user that did what's logged. They're checked in order, so the generic 'nick: message' is last
+# Lines that don't match any of them (server messages, errors, CTCP requests) don't belong to a nick
+LOGMESSAGE_NICK_REGEXES = (re.compile(r"(?:JOIN|PART|QUIT): (?P<nick>[^\s:]+) \("),  #'JOIN: nick (address)', PART is the same and QUIT has the quit message after it
+						   re.compile(r"KICK: [^\s:]+ was kicked by (?P<nick>[^\s:]+), reason: "),  #'KICK: kickednick was kicked by nick, reason: 'reason''
+						   re.compile(r"NICK CHANGE: (?P<nick>[^\s:]+) changed their nick to "),  #'NICK CHANGE: nick changed their nick to newnick'
+						   re.compile(r"(?P<nick>[^\s:]+) set mode to '"),  #'nick set mode to '+o' of user(s) othernick'
+						   re.compile(r"\[notice\] (?P<nick>[^\s:]+): "),  #'[notice] nick: message'
+						   re.compile(r"\*(?P<nick>[^\s:]+):? "),  #'*nick does something' for received actions, '*nick: does something' for sent ones
+						   re.compile(r"(?P<nick>[^\s:]+): "))  #'nick: message'
+LOGFILENAME_REGEX = re.compile(r"^(?P<source>.+)-(?P<date>\d{4}-\d{2}-\d{2})\.log$")
+
+
+def getLineNick(line, lineMatch):
+	"""Returns the lowercase nick the provided line was logged for, or None if it isn't a line about a user. 'lineMatch' is the LOGLINE_REGEX match of the line"""
+	messageStart = lineMatch.end()
+	for messageRegex in LOGMESSAGE_NICK_REGEXES:
+		messageMatch = messageRegex.match(line, messageStart)
+		if messageMatch:
+			return messageMatch.group('nick').lower()
+	return None
+
+def getLogBaseFilename(logfolder, source, dateString):
+	"""Returns the log path for the provided source and 'yyyy-mm-dd' date, without extension"""
+	return os.path.join(logfolder, "{}-{}".format(source, dateString))
+
+def getUnarchivedLogDates(logfolder):
+	"""Returns a list of (filename, date string) tuples for all the plain logfiles in the provided folder"""
+	logfiles = []
+	for filename in os.listdir(logfolder):
+		filenameMatch = LOGFILENAME_REGEX.match(filename)
+		if filenameMatch:
+			logfiles.append((filename, filenameMatch.group('date')))
+	return logfiles
+
+def archiveLogfile(logfilePath):
+	"""
+	Compresses the provided plain logfile into a gzip archive with one member per hour, writes the index for it, and removes the original
+	:return: A tuple with the number of lines archived and the size of the archive in bytes
+	"""
+	basePath = logfilePath[:-len(LOG_EXTENSION)]
+	archivePath = basePath + ARCHIVE_EXTENSION
+	blocks = []
+	nickLines = {}
+	lineNumber = 0
+	#If this day was already archived but more lines got logged afterwards, add the new lines to the existing archive
+	existingLines = []
+	if os.path.isfile(archivePath):
+		with gzip.open(archivePath, 'rb') as existingArchive:
+			existingLines = existingArchive.readlines()
+	with open(logfilePath, 'rb') as logfile, open(archivePath + '.new', 'wb') as archiveFile:
+		currentHour = None
+		blockLines = []
+		blockFirstLine = 0
+
+		def writeBlock():
+			compressor = zlib.compressobj(9, zlib.DEFLATED, GZIP_WBITS)
+			compressedData = compressor.compress("".join(blockLines)) + compressor.flush()
+			blocks.append({'hour': currentHour, 'offset': archiveFile.tell(), 'length': len(compressedData), 'firstLine': blockFirstLine, 'lineCount': len(blockLines)})
+			archiveFile.write(compressedData)
+
+		for line in itertools.chain(existingLines, logfile):
+			lineMatch = LOGLINE_REGEX.match(line)
+			#Lines without a timestamp (which shouldn't happen, but still) get added to the current hour
+			lineHour = int(lineMatch.group('hour')) if lineMatch else currentHour
+			if lineHour != currentHour:
+				if blockLines:
+					writeBlock()
+				currentHour = lineHour
+				blockLines = []
+				blockFirstLine = lineNumber
+			blockLines.append(line)
+			nick = getLineNick(line, lineMatch) if lineMatch else None
+			if nick:
+				if nick not in nickLines:
+					nickLines[nick] = [lineNumber]
+				else:
+					nickLines[nick].append(lineNumber)
+			lineNumber += 1
+		if blockLines:
+			writeBlock()
+		archiveSize = archiveFile.tell()
+
+	with open(basePath + INDEX_EXTENSION, 'w') as indexFile:
+		indexFile.write(json.dumps({'lineCount': lineNumber, 'blocks': blocks, 'nicks': nickLines}))
+	#Only replace the original once everything is written, so a crash halfway through doesn't lose anything
+	os.rename(archivePath + '.new', archivePath)
+	os.remove(logfilePath)
+	return (lineNumber, archiveSize)
+
+def hasLog(logfolder, source, dateString):
+	basePath = getLogBaseFilename(logfolder, source, dateString)
+	return os.path.isfile(basePath + LOG_EXTENSION) or os.path.isfile(basePath + ARCHIVE_EXTENSION)
+
+def readLogLines(logfolder, source, dateString, startHour=0, endHour=23, nick=None):
+	"""
+	Returns the lines logged for the provided source on the provided 'yyyy-mm-dd' date, optionally limited to an hour range (inclusive) or to a single nick.
+	Works on both plain and archived logs. For archived logs only the needed hours get decompressed
+	:return: A list of lines (including the newline), or None if there's no log for that day
+	"""
+	basePath = getLogBaseFilename(logfolder, source, dateString)
+	if nick:
+		nick = nick.lower()
+	#Plain logs are for recent days, so they're usually not that big. Just read through them
+	if os.path.isfile(basePath + LOG_EXTENSION):
+		lines = []
+		with open(basePath + LOG_EXTENSION, 'rb') as logfile:
+			for line in logfile:
+				lineMatch = LOGLINE_REGEX.match(line)
+				if lineMatch and not startHour <= int(lineMatch.group('hour')) <= endHour:
+					continue
+				if nick and (not lineMatch or getLineNick(line, lineMatch) != nick):
+					continue
+				lines.append(line)
+		return lines
+
+	if not os.path.isfile(basePath + ARCHIVE_EXTENSION) or not os.path.isfile(basePath + INDEX_EXTENSION):
+		return None
+	with open(basePath + INDEX_EXTENSION, 'r') as indexFile:
+		index = json.load(indexFile)
+	wantedLineNumbers = None
+	if nick:
+		wantedLineNumbers = set(index['nicks'].get(nick, ()))
+	lines = []
+	with open(basePath + ARCHIVE_EXTENSION, 'rb') as archiveFile:
+		for block in index['blocks']:
+			if block['hour'] is not None and not startHour <= block['hour'] <= endHour:
+				continue
+			#Skip blocks that don't contain any lines from the wanted nick
+			if wantedLineNumbers is not None and not any(lineNumber in wantedLineNumbers for lineNumber in xrange(block['firstLine'], block['firstLine'] + block['lineCount'])):
+				continue
+			archiveFile.seek(block['offset'])
+			blockLines = zlib.decompress(archiveFile.read(block['length']), GZIP_WBITS).splitlines(True)
+			if wantedLineNumbers is None:
+				lines.extend(blockLines)
+			else:
+				for lineIndex, line in enumerate(blockLines):
+					if block['firstLine'] + lineIndex in wantedLineNumbers:
+						lines.append(line)
+	return lines
@@ -1,17 +1,24 @@
-import datetime, logging, os
+import collections, datetime, logging, os, time
+
+import gevent
+import gevent.event
+import gevent.lock
 
 import Constants
 import GlobalStore
+import LogArchiver
 
 class MessageLogger(object):
-	logfiles = {}
-	currentDay = 0
-	logfolder = None
-	bot = None
-	shouldKeepSystemLogs = True
-	shouldKeepChannelLogs = True
-	shouldKeepPrivateLogs = True
-	
+	"""
+	Writes the messages the bot sees and sends to daily log files per channel.
+	Logging a message only puts it in a queue, a background greenlet writes the queue out in batches every few seconds,
+	 using gevent's threadpool so the actual disk access doesn't block the IRC connection
+	"""
+	maxQueuedLines = 10000  #If writing falls behind this far, the oldest lines get dropped, so memory use stays bounded
+	maxOpenLogfiles = 25  #The least recently used logfile gets closed if more than this many are open
+	secondsBetweenWrites = 2.0
+	secondsBetweenArchiveRuns = 3600  #How often to check for finished daily logs that can be compressed
+
 	def __init__(self, bot):
 		self.logger = logging.getLogger('DideRobot')
 		self.bot = bot
@@ -19,8 +26,20 @@ class MessageLogger(object):
 		self.logger.info("Creating new message logger for '{}', using logfolder '{}'".format(bot.serverfolder, self.logfolder))
 		if not os.path.exists(self.logfolder):
 				os.makedirs(self.logfolder)
+		self.logfiles = collections.OrderedDict()  #Keys are (source, date) tuples, values are the open files. Ordered from least to most recently used
+		self.currentDay = datetime.date.today()
+		self.queuedLines = collections.deque()  #Lines waiting to be written, as (timestamp, source, message) tuples
+		self.droppedLineCount = 0
+		self.writeLock = gevent.lock.Semaphore()  #Makes sure only one batch is being written at a time
+		self.stopEvent = gevent.event.Event()  #Gets set on shutdown, so the background greenlets finish what they're doing and then stop
+		self.shouldKeepSystemLogs = True
+		self.shouldKeepChannelLogs = True
+		self.shouldKeepPrivateLogs = True
+		self.shouldEchoToConsole = True
+		self.shouldArchiveOldLogs = True
 		self.updateLogSettings()
-		self.currentDay = datetime.datetime.now().day
+		self.writerGreenlet = gevent.spawn(self.keepWritingQueuedLines)
+		self.archiverGreenlet = gevent.spawn(self.keepArchivingOldLogs)
 
 	def updateLogSettings(self):
 		self.logger.info("[MessageLogger] |{}| Reloading settings".format(self.bot.serverfolder))
@@ -28,6 +47,8 @@ class MessageLogger(object):
 		self.shouldKeepSystemLogs = self.bot.settings["keepSystemLogs"]
 		self.shouldKeepChannelLogs = self.bot.settings["keepChannelLogs"]
 		self.shouldKeepPrivateLogs = self.bot.settings["keepPrivateLogs"]
+		self.shouldEchoToConsole = self.bot.settings.get("echoLogsToConsole", True)
+		self.shouldArchiveOldLogs = self.bot.settings.get("archiveOldLogs", True)
 		#Let's not let any file handlers linger about, in case logging settings were changed
 		self.closelogs()
 
@@ -41,38 +62,139 @@ class MessageLogger(object):
 		elif source[0] not in Constants.CHANNEL_PREFIXES and not self.shouldKeepPrivateLogs:
 			return
 
-		now = datetime.datetime.now()
-		#If we're at a new day, close all the logs, since they're daily
-		if now.day != self.currentDay:
-			self.logger.info("[MessageLogger] New day, new message logs")
-			self.closelogs()
-			self.currentDay = datetime.datetime.now().day
+		now = time.time()
+		if self.shouldEchoToConsole:
+			print "[MessageLogger] |{0}| {1} [{2}] {3}".format(self.bot.serverfolder, source, time.strftime("%H:%M:%S", time.localtime(now)), msg)
+
+		#If the writer can't keep up, drop the oldest line instead of using more and more memory
+		if len(self.queuedLines) >= self.maxQueuedLines:
+			self.queuedLines.popleft()
+			self.droppedLineCount += 1
+		self.queuedLines.append((now, source, msg))
+
+	def keepWritingQueuedLines(self):
+		#Wait for the stop event instead of sleeping, so shutting down never has to interrupt a write that's still running in the threadpool
+		while not self.stopEvent.wait(self.secondsBetweenWrites):
+			if self.queuedLines:
+				self.writeQueuedLines()
+		self.logger.info("[MessageLogger] |{}| Writer greenlet stopped".format(self.bot.serverfolder))
+
+	def keepArchivingOldLogs(self):
+		while not self.stopEvent.is_set():
+			if self.shouldArchiveOldLogs:
+				self.archiveOldLogs()
+			self.stopEvent.wait(self.secondsBetweenArchiveRuns)
+		self.logger.info("[MessageLogger] |{}| Archiver greenlet stopped".format(self.bot.serverfolder))
+
+	def archiveOldLogs(self):
+		"""Compresses and indexes the logs of finished days, see LogArchiver for the format"""
+		#Wait a bit after midnight, so lines that were still queued at midnight get written to yesterday's log before it's archived
+		cutoffDate = (datetime.datetime.now() - datetime.timedelta(seconds=self.secondsBetweenWrites * 10)).date()
+		for logfilename, logDateString in LogArchiver.getUnarchivedLogDates(self.logfolder):
+			#Leave the rest for the next run if we're shutting down
+			if self.stopEvent.is_set():
+				break
+			if logDateString >= cutoffDate.isoformat():
+				continue
+			with self.writeLock:
+				#Make sure we don't have the file open anymore
+				for logfileKey in [logfileKey for logfileKey in self.logfiles if logfileKey[1] < cutoffDate]:
+					self.logfiles.pop(logfileKey).close()
+				try:
+					#Compressing can take a while, so do it in a separate thread
+					lineCount, archiveSize = gevent.get_hub().threadpool.apply(LogArchiver.archiveLogfile, (os.path.join(self.logfolder, logfilename),))
+				except (IOError, OSError) as e:
+					self.logger.error("[MessageLogger] |{}| Error while archiving log '{}': {}".format(self.bot.serverfolder, logfilename, e))
+					continue
+			self.logger.info("[MessageLogger] |{}| Archived log '{}', {:,} lines compressed to {:,} bytes".format(self.bot.serverfolder, logfilename, lineCount, archiveSize))
+
+	def writeQueuedLines(self):
+		"""Writes all the queued lines to their logfiles. Call this if the logfiles need to be up to date, for instance before reading them"""
+		with self.writeLock:
+			if self.droppedLineCount > 0:
+				self.logger.warning("[MessageLogger] |{}| Writing fell behind, dropped {:,} log lines".format(self.bot.serverfolder, self.droppedLineCount))
+				self.droppedLineCount = 0
+			if not self.queuedLines:
+				return
+			linesToWrite = self.queuedLines
+			self.queuedLines = collections.deque()
+			#Do the actual writing in a separate thread, so slow disks don't stall all the bots
+			errors = gevent.get_hub().threadpool.apply(self.writeLinesToLogfiles, (linesToWrite,))
+		for error in errors:
+			self.logger.error("[MessageLogger] |{}| {}".format(self.bot.serverfolder, error))
 
-		timestamp = now.strftime("%H:%M:%S")
-		print "[MessageLogger] |{0}| {1} [{2}] {3}".format(self.bot.serverfolder, source, timestamp, msg)
+	def writeLinesToLogfiles(self, linesToWrite):
+		"""
+		Writes the provided lines to the right logfiles and flushes them. This runs in a separate thread, so it doesn't log itself
+		:return: A list of error messages, which can be empty
+		"""
+		errors = []
+		logfilesToFlush = set()
+		for timestamp, source, msg in linesToWrite:
+			logtime = datetime.datetime.fromtimestamp(timestamp)
+			#If we're at a new day, close all the logs, since they're daily
+			if logtime.date() != self.currentDay:
+				self.closeAllLogfiles()
+				self.currentDay = logtime.date()
+				logfilesToFlush = set()
+			logfile = self.getLogfile(source, logtime, errors)
+			if logfile:
+				logfile.write("[{0}] {1}\n".format(logtime.strftime("%H:%M:%S"), msg))
+				logfilesToFlush.add(logfile)
+		for logfile in logfilesToFlush:
+			if not logfile.closed:
+				logfile.flush()
+		return errors
 
+	def getLogfile(self, source, logtime, errors):
+		logfileKey = (source, self.currentDay)
+		#Move the logfile to the end of the dictionary, to keep the least recently used file at the start
+		logfile = self.logfiles.pop(logfileKey, None)
 		#If no file has been opened for this source, open it
-		if source not in self.logfiles:
-			logfilename = "{}-{}.log".format(source, now.strftime("%Y-%m-%d"))
+		if not logfile:
+			logfilename = "{}-{}.log".format(source, logtime.strftime("%Y-%m-%d"))
 			try:
-				self.logfiles[source] = open(os.path.join(self.logfolder, logfilename), 'a')
+				logfile = open(os.path.join(self.logfolder, logfilename), 'a')
 			except IOError as e:
-				self.logger.error("[MessageLogger] Error while trying to open logfile '{}': {}".format(logfilename, e.message))
-				return
-		self.logfiles[source].write("[{0}] {1}\n".format(timestamp, msg))
-		self.logfiles[source].flush()
+				errors.append("Error while trying to open logfile '{}': {}".format(logfilename, e))
+				return None
+			#Make sure we don't have too many files open at once
+			while len(self.logfiles) >= self.maxOpenLogfiles:
+				self.logfiles.popitem(last=False)[1].close()
+		self.logfiles[logfileKey] = logfile
+		return logfile
+
+	def closeAllLogfiles(self):
+		for logfile in self.logfiles.itervalues():
+			logfile.close()
+		self.logfiles = collections.OrderedDict()
 
 	def closelog(self, source):
-		if source in self.logfiles:
+		with self.writeLock:
+			logfileKeys = [logfileKey for logfileKey in self.logfiles if logfileKey[0] == source]
+			if not logfileKeys:
+				return False
 			self.logger.info("[MessageLogger] |{}| closing log '{}'".format(self.bot.serverfolder, source))
-			self.logfiles[source].close()
-			del self.logfiles[source]
+			for logfileKey in logfileKeys:
+				self.logfiles.pop(logfileKey).close()
 			return True
-		return False
-			
+
 	def closelogs(self):
 		self.logger.info("[MessageLogger] |{}| Closing ALL logs".format(self.bot.serverfolder))
-		for source, logfile in self.logfiles.iteritems():
-			logfile.close()
-		self.logfiles = {}
+		with self.writeLock:
+			self.closeAllLogfiles()
 		return True
+
+	def shutdown(self):
+		"""Writes out everything that's still queued and stops the writer greenlet, so it doesn't keep the program running"""
+		#Don't kill the greenlets. A write or archive running in the threadpool can't be interrupted, and killing the greenlet waiting for it
+		# would release the write lock while that thread is still using the logfiles. Let them finish and wait for that instead
+		self.stopEvent.set()
+		if self.archiverGreenlet:
+			self.archiverGreenlet.join()
+			self.archiverGreenlet = None
+		if self.writerGreenlet:
+			self.writerGreenlet.join()
+			self.writerGreenlet = None
+		self.writeQueuedLines()
+		self.closelogs()
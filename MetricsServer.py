@@ -0,0 +1,155 @@
+import collections, gc, logging, time
+
+import gevent
+import gevent.pywsgi
+import greenlet
+
+import GlobalStore
+
+
+class MetricsServer(object):
+	"""
+	A small HTTP server that shows metrics about all the running bots as plain text, in the Prometheus text format, so monitoring can alert on a bot that's lagging or stuck.
+	It should only listen on localhost, since there's no authentication
+	"""
+	secondsBetweenSamples = 10.0  #How often the bot counters get sampled to calculate per-second rates
+	samplesToKeep = 7  #With a sample every 10 seconds, this means rates are averaged over the last minute
+	secondsBetweenLagChecks = 1.0
+	secondsBetweenGreenletCounts = 300.0  #Counting greenlets means going through every object in memory, so don't do that for every request
+	objectsPerGreenletCountStep = 50000  #How many objects to check before letting other greenlets run, so counting doesn't block the bots
+
+	def __init__(self, host, port):
+		self.logger = logging.getLogger('DideRobot')
+		self.host = host
+		self.port = port
+		self.server = None
+		self.samplerGreenlet = None
+		self.lagCheckGreenlet = None
+		self.greenletCountGreenlet = None
+		self.greenletCount = None  #None until the first count is done
+		self.counterSamples = {}  #Keys are serverfolder names, values are deques with (time, lines received, lines sent) tuples, oldest first
+		self.hubLoopLag = 0.0
+		self.maxHubLoopLag = 0.0  #The highest lag since the last time the metrics were retrieved
+
+	def start(self):
+		self.server = gevent.pywsgi.WSGIServer((self.host, self.port), self.handleRequest, log=None)
+		self.server.start()
+		self.samplerGreenlet = gevent.spawn(self.keepSamplingCounters)
+		self.lagCheckGreenlet = gevent.spawn(self.keepCheckingHubLoopLag)
+		self.greenletCountGreenlet = gevent.spawn(self.keepCountingGreenlets)
+		self.logger.info("Metrics server listening on {}:{}".format(self.host, self.port))
+
+	def stop(self):
+		for greenletToKill in (self.samplerGreenlet, self.lagCheckGreenlet, self.greenletCountGreenlet):
+			if greenletToKill:
+				greenletToKill.kill()
+		self.samplerGreenlet = None
+		self.lagCheckGreenlet = None
+		self.greenletCountGreenlet = None
+		if self.server:
+			self.server.stop()
+			self.server = None
+		self.logger.info("Metrics server stopped")
+
+	def keepSamplingCounters(self):
+		while True:
+			now = time.time()
+			for serverfolder, bot in GlobalStore.bothandler.bots.items():
+				if serverfolder not in self.counterSamples:
+					self.counterSamples[serverfolder] = collections.deque(maxlen=self.samplesToKeep)
+				self.counterSamples[serverfolder].append((now, bot.linesReceivedCount, bot.linesSentCount))
+			#Forget about bots that stopped
+			for serverfolder in self.counterSamples.keys():
+				if serverfolder not in GlobalStore.bothandler.bots:
+					del self.counterSamples[serverfolder]
+			gevent.sleep(self.secondsBetweenSamples)
+
+	def keepCheckingHubLoopLag(self):
+		#If something blocks the hub, this greenlet wakes up later than it asked for. The difference is the lag
+		while True:
+			sleepStartTime = time.time()
+			gevent.sleep(self.secondsBetweenLagChecks)
+			self.hubLoopLag = max(0.0, time.time() - sleepStartTime - self.secondsBetweenLagChecks)
+			if self.hubLoopLag > self.maxHubLoopLag:
+				self.maxHubLoopLag = self.hubLoopLag
+
+	def keepCountingGreenlets(self):
+		greenletType = greenlet.greenlet
+		while True:
+			#There's no list of all greenlets, so the only way to count them is to check every object the garbage collector knows about
+			# With a lot of data in memory that takes seconds, so check the objects in steps, and let the bots run in between
+			allObjects = gc.get_objects()
+			greenletCount = 0
+			for stepStartIndex in xrange(0, len(allObjects), self.objectsPerGreenletCountStep):
+				for obj in allObjects[stepStartIndex:stepStartIndex + self.objectsPerGreenletCountStep]:
+					if isinstance(obj, greenletType):
+						greenletCount += 1
+				#'sleep(0)' only lets other callbacks run, 'idle' also lets the timers and sockets of the bots get handled
+				gevent.idle()
+			del allObjects
+			self.greenletCount = greenletCount
+			gevent.sleep(self.secondsBetweenGreenletCounts)
+
+	def getLineRates(self, serverfolder, bot):
+		"""Returns the lines received and sent per second for the provided bot, averaged over the sampled period"""
+		samples = self.counterSamples.get(serverfolder)
+		if not samples:
+			return (0.0, 0.0)
+		sampleTime, linesReceivedCount, linesSentCount = samples[0]
+		secondsPassed = time.time() - sampleTime
+		if secondsPassed <= 0:
+			return (0.0, 0.0)
+		return ((bot.linesReceivedCount - linesReceivedCount) / secondsPassed, (bot.linesSentCount - linesSentCount) / secondsPassed)
+
+	@staticmethod
+	def escapeLabelValue(value):
+		return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+	def getMetricsText(self):
+		metricLines = []
+		def addMetric(name, value, **labels):
+			if labels:
+				labelString = ",".join('{}="{}"'.format(labelName, self.escapeLabelValue(labelValue)) for labelName, labelValue in sorted(labels.iteritems()))
+				metricLines.append("diderobot_{}{{{}}} {}".format(name, labelString, value))
+			else:
+				metricLines.append("diderobot_{} {}".format(name, value))
+
+		now = time.time()
+		for serverfolder, bot in sorted(GlobalStore.bothandler.bots.items()):
+			linesReceivedPerSecond, linesSentPerSecond = self.getLineRates(serverfolder, bot)
+			addMetric('connected', 1 if bot.connectedAt else 0, bot=serverfolder)
+			addMetric('lines_received_total', bot.linesReceivedCount, bot=serverfolder)
+			addMetric('lines_sent_total', bot.linesSentCount, bot=serverfolder)
+			addMetric('lines_received_per_second', "{:.3f}".format(linesReceivedPerSecond), bot=serverfolder)
+			addMetric('lines_sent_per_second', "{:.3f}".format(linesSentPerSecond), bot=serverfolder)
+			addMetric('bytes_received_total', bot.bytesReceivedCount, bot=serverfolder)
+			addMetric('bytes_sent_total', bot.bytesSentCount, bot=serverfolder)
+			addMetric('outbound_queue_lines', bot.lineScheduler.queuedLineCount, bot=serverfolder)
+			addMetric('outbound_queue_oldest_line_age_seconds', "{:.3f}".format(bot.lineScheduler.getOldestQueuedLineAge()), bot=serverfolder)
+			addMetric('reconnects_total', bot.reconnectCount, bot=serverfolder)
+			#-1 means we haven't received a PING on this connection yet
+			addMetric('seconds_since_last_ping', "{:.1f}".format(now - bot.lastPingReceivedAt) if bot.lastPingReceivedAt else -1, bot=serverfolder)
+			addMetric('channels', len(bot.channelsUserList), bot=serverfolder)
+			for channel, channelUsers in sorted(bot.channelsUserList.items()):
+				addMetric('channel_users', len(channelUsers), bot=serverfolder, channel=channel)
+
+		addMetric('hub_loop_lag_seconds', "{:.4f}".format(self.hubLoopLag))
+		addMetric('hub_loop_lag_max_seconds', "{:.4f}".format(self.maxHubLoopLag))
+		self.maxHubLoopLag = self.hubLoopLag
+		#This is counted in the background every few minutes, since counting takes a while
+		if self.greenletCount is not None:
+			addMetric('greenlets', self.greenletCount)
+		return "\n".join(metricLines) + "\n"
+
+	def handleRequest(self, environ, startResponse):
+		if environ.get('PATH_INFO', '/') not in ('/', '/metrics'):
+			startResponse('404 Not Found', [('Content-Type', 'text/plain')])
+			return ["Not found, metrics are at /metrics\n"]
+		try:
+			metricsText = self.getMetricsText()
+		except Exception as e:
+			self.logger.error("Error while collecting metrics: {}".format(e), exc_info=True)
+			startResponse('500 Internal Server Error', [('Content-Type', 'text/plain')])
+			return ["Error while collecting metrics\n"]
+		startResponse('200 OK', [('Content-Type', 'text/plain; version=0.0.4'), ('Content-Length', str(len(metricsText)))])
+		return [metricsText]
@@ -0,0 +1,108 @@
+import cPickle, logging, multiprocessing, os, signal, traceback
+
+import gevent
+import gevent.lock
+import gevent.monkey
+import gevent.os
+
+
+class ProcessPool(object):
+	"""
+	Runs CPU-heavy functions in a separate process, so they can use another core and don't stall the IRC connections of every bot while they run.
+	Each call forks a new child process, which means the function and its arguments don't need to be picklable and the child always has the latest loaded modules.
+	Only the return value (or the raised exception) gets pickled and sent back to the parent through a pipe.
+	The calling greenlet waits without blocking the hub, and at most 'maxProcesses' children run at the same time
+	"""
+
+	def __init__(self, maxProcesses=None):
+		self.logger = logging.getLogger('DideRobot')
+		self.maxProcesses = maxProcesses if maxProcesses else multiprocessing.cpu_count()
+		self.processSlots = gevent.lock.BoundedSemaphore(self.maxProcesses)
+		self.runningProcessCount = 0
+		self.finishedCallCount = 0
+		self.failedCallCount = 0
+
+	def run(self, function, *args, **kwargs):
+		"""
+		Calls the function with the provided arguments in a child process and returns its result. Exceptions raised in the child get raised here too
+		On systems that can't fork, the function just gets called directly
+		"""
+		if not hasattr(os, 'fork'):
+			return function(*args, **kwargs)
+		with self.processSlots:
+			readFd, writeFd = os.pipe()
+			pid = gevent.os.fork_and_watch()
+			if pid == 0:
+				#We're the child process. Never return from this, otherwise the child would continue running the bot
+				try:
+					os.close(readFd)
+					self.runInChildProcess(writeFd, function, args, kwargs)
+				finally:
+					os._exit(0)
+
+			os.close(writeFd)
+			self.runningProcessCount += 1
+			resultChunks = []
+			try:
+				gevent.os.make_nonblocking(readFd)
+				while True:
+					resultChunk = gevent.os.nb_read(readFd, 65536)
+					if not resultChunk:
+						break
+					resultChunks.append(resultChunk)
+				gevent.os.waitpid(pid, 0)
+			except BaseException:
+				#If we got killed while waiting, the child shouldn't keep running
+				try:
+					os.kill(pid, signal.SIGKILL)
+				except OSError:
+					pass
+				raise
+			finally:
+				os.close(readFd)
+				self.runningProcessCount -= 1
+
+		if not resultChunks:
+			self.failedCallCount += 1
+			raise RuntimeError("Child process for function '{}' exited without returning a result".format(function.__name__))
+		success, result = cPickle.loads("".join(resultChunks))
+		if not success:
+			self.failedCallCount += 1
+			exception, childTraceback = result
+			self.logger.error("Function '{}' raised an exception in a child process:\n{}".format(function.__name__, childTraceback))
+			raise exception
+		self.finishedCallCount += 1
+		return result
+
+	@staticmethod
+	def runInChildProcess(writeFd, function, args, kwargs):
+		#The child got a copy of all the greenlets of the parent, like the ones reading from the IRC sockets. Those should never run here,
+		# so run the function in a new native thread, which gets its own empty hub if the function uses gevent,
+		# and block this thread (and with it the copied hub) on a native lock until the function is done
+		startNativeThread = gevent.monkey.get_original('thread', 'start_new_thread')
+		functionDoneLock = gevent.monkey.get_original('thread', 'allocate_lock')()
+		functionDoneLock.acquire()
+
+		def runFunction():
+			try:
+				try:
+					result = (True, function(*args, **kwargs))
+				except Exception as e:
+					result = (False, (e, traceback.format_exc()))
+				try:
+					resultData = cPickle.dumps(result, cPickle.HIGHEST_PROTOCOL)
+				except Exception as e:
+					#Not every return value or exception can be pickled
+					resultData = cPickle.dumps((False, (RuntimeError("Unable to send result back from child process: {!r}".format(e)), traceback.format_exc())), cPickle.HIGHEST_PROTOCOL)
+				bytesWritten = 0
+				while bytesWritten < len(resultData):
+					bytesWritten += os.write(writeFd, buffer(resultData, bytesWritten))
+				os.close(writeFd)
+			finally:
+				functionDoneLock.release()
+
+		startNativeThread(runFunction, ())
+		functionDoneLock.acquire()
+
+	def getStats(self):
+		return {'maxProcesses': self.maxProcesses, 'runningProcesses': self.runningProcessCount, 'finishedCalls': self.finishedCallCount, 'failedCalls': self.failedCallCount}
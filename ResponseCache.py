@@ -0,0 +1,62 @@
+import collections, time
+
+
+class ResponseCache(object):
+	"""
+	Stores the results of remote lookups for a while, so repeated lookups don't need another round-trip to the API (and don't use up API call limits).
+	Keys are strings or tuples of strings and numbers. Strings get their whitespace normalized, and are lowercased unless the cache is case-sensitive,
+	 so '!weather London' and '!weather  london' share a cache entry.
+	The cache holds at most 'maxEntries' results, if it's full the least recently used one gets removed
+	"""
+
+	def __init__(self, secondsToKeep, maxEntries=250, isCaseSensitive=False):
+		self.secondsToKeep = secondsToKeep
+		self.maxEntries = maxEntries
+		self.isCaseSensitive = isCaseSensitive
+		self.entries = collections.OrderedDict()  #Keys are the normalized keys, values are (expiry time, value) tuples. Ordered from least to most recently used
+		self.hitCount = 0
+		self.missCount = 0
+		self.evictionCount = 0
+
+	def normalizeKey(self, key):
+		if isinstance(key, basestring):
+			key = " ".join(key.split())
+			return key if self.isCaseSensitive else key.lower()
+		if isinstance(key, (tuple, list)):
+			return tuple(self.normalizeKey(keyPart) for keyPart in key)
+		return key
+
+	def get(self, key, defaultValue=None):
+		"""Returns the cached value for the provided key, or 'defaultValue' if it isn't cached or it expired"""
+		key = self.normalizeKey(key)
+		#Pop and re-add the entry, so it moves to the end as the most recently used one
+		entry = self.entries.pop(key, None)
+		if entry is None:
+			self.missCount += 1
+			return defaultValue
+		if entry[0] < time.time():
+			self.missCount += 1
+			return defaultValue
+		self.entries[key] = entry
+		self.hitCount += 1
+		return entry[1]
+
+	def set(self, key, value, secondsToKeep=None):
+		"""Stores the value under the provided key. 'secondsToKeep' overrides the default expiry time for just this entry"""
+		key = self.normalizeKey(key)
+		self.entries.pop(key, None)
+		while len(self.entries) >= self.maxEntries:
+			self.entries.popitem(last=False)
+			self.evictionCount += 1
+		self.entries[key] = (time.time() + (secondsToKeep if secondsToKeep is not None else self.secondsToKeep), value)
+
+	def remove(self, key):
+		return self.entries.pop(self.normalizeKey(key), None) is not None
+
+	def clear(self):
+		self.entries.clear()
+
+	def getStats(self):
+		lookupCount = self.hitCount + self.missCount
+		return {'entries': len(self.entries), 'maxEntries': self.maxEntries, 'secondsToKeep': self.secondsToKeep, 'hits': self.hitCount, 'misses': self.missCount,
+				'hitRate': float(self.hitCount) / lookupCount if lookupCount else 0.0, 'evictions': self.evictionCount}
@@ -1,11 +1,116 @@
-import base64, codecs, json, logging, os, random, re
+import array, base64, codecs, cookielib, json, logging, os, random, re, urlparse
+from collections import OrderedDict
 
+import gevent.event
 import requests
+import requests.adapters
 
 import Constants, GlobalStore
 
 logger = logging.getLogger('DideRobot')
 
+
+#HTTP functions. Modules should use these instead of calling 'requests' directly, so lookups to the same host reuse an open connection
+# instead of doing a new TCP and TLS handshake every time
+HTTP_DEFAULT_TIMEOUT = 15.0  #In seconds. Used if a call doesn't specify its own timeout, so a hanging server can't block a lookup forever
+HTTP_MAX_CONNECTIONS_PER_HOST = 10  #How many connections to a single host get kept open for reuse. Extra concurrent requests still work, their connection just gets closed afterwards
+HTTP_MAX_SESSIONS = 32  #How many hosts get their own Session. When a new host is looked up, the Session of the host that was least recently used gets closed
+httpSessions = OrderedDict()  #Keys are 'scheme://host' strings, values are the requests Session with the connection pool for that host. Ordered from least to most recently used
+httpRequestCounts = {}  #Keys are the same as in httpSessions, values are how many requests were sent to that host
+
+def getHttpSession(url):
+	"""Returns the Session for the host in the provided URL, creating it if it doesn't exist yet"""
+	urlParts = urlparse.urlsplit(url)
+	hostKey = u"{}://{}".format(urlParts.scheme, urlParts.netloc.lower())
+	session = httpSessions.pop(hostKey, None)
+	if not session:
+		if len(httpSessions) >= HTTP_MAX_SESSIONS:
+			#Links to lots of different sites would otherwise keep a Session and its connections around for each of them
+			oldHostKey, oldSession = httpSessions.popitem(last=False)
+			del httpRequestCounts[oldHostKey]
+			oldSession.close()
+		session = requests.Session()
+		#The Sessions are shared by all modules, so don't let cookies a site sets for one lookup get sent along with lookups from other modules
+		session.cookies.set_policy(cookielib.DefaultCookiePolicy(allowed_domains=[]))
+		#A bit more than one pool, so redirects to other hosts don't keep throwing away the pool of the main host
+		adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_MAX_CONNECTIONS_PER_HOST)
+		session.mount('http://', adapter)
+		session.mount('https://', adapter)
+		httpRequestCounts[hostKey] = 0
+	#(Re-)adding the Session puts it at the end, so the least recently used one stays at the start
+	httpSessions[hostKey] = session
+	httpRequestCounts[hostKey] += 1
+	return session
+
+def httpRequest(method, url, **kwargs):
+	"""
+	Sends a HTTP request over a pooled keep-alive connection. Takes the same keyword arguments as 'requests.request', and raises the same exceptions
+	:return: The requests Response object
+	"""
+	if 'timeout' not in kwargs:
+		kwargs['timeout'] = HTTP_DEFAULT_TIMEOUT
+	return getHttpSession(url).request(method, url, **kwargs)
+
+def httpGet(url, **kwargs):
+	return httpRequest('GET', url, **kwargs)
+
+def httpPost(url, **kwargs):
+	return httpRequest('POST', url, **kwargs)
+
+def getHttpConnectionStats():
+	"""Returns a dict with the request count and connection pool info per host"""
+	stats = {}
+	for hostKey, session in httpSessions.iteritems():
+		hostStats = {'requests': httpRequestCounts[hostKey], 'connectionsOpened': 0, 'idleConnections': 0}
+		for adapter in set(session.adapters.itervalues()):
+			pools = adapter.poolmanager.pools
+			for poolKey in pools.keys():
+				pool = pools.get(poolKey)
+				#Pools for other hosts are for redirects, those aren't interesting here
+				if pool is None or not hostKey.startswith(u"{}://{}".format(poolKey.key_scheme, poolKey.key_host)):
+					continue
+				hostStats['connectionsOpened'] += pool.num_connections
+				#The pool queue is filled with 'None' placeholders for connections that haven't been made yet, don't count those
+				hostStats['idleConnections'] += sum(1 for connection in list(pool.pool.queue) if connection is not None)
+		stats[hostKey] = hostStats
+	return stats
+
+
+#Single-flight calls. If several greenlets want the result of the same slow lookup at the same time (a link pasted in multiple channels for instance),
+# only the first one actually does the lookup, and the others wait for and share its result
+singleFlightResults = {}  #Keys are the keys of the calls currently running, values are AsyncResults that get the result once the call is done
+singleFlightSharedCallCount = 0  #How many calls got a result from another running call instead of running themselves
+
+def runSingleFlight(key, function, *args, **kwargs):
+	"""
+	Calls 'function' with the provided arguments, unless a call with the same key is already running, then it waits for that call and returns its result.
+	If the call raises an exception, all the waiting callers get that exception too. If the greenlet doing the call gets killed, the waiting callers get a RuntimeError.
+	The key should start with the module name, so different modules don't clash.
+	All callers get the same result object, so they should treat it as read-only. Make a copy before changing a shared list or dict
+	"""
+	global singleFlightSharedCallCount
+	asyncResult = singleFlightResults.get(key)
+	if asyncResult is not None:
+		singleFlightSharedCallCount += 1
+		return asyncResult.get()
+	asyncResult = gevent.event.AsyncResult()
+	singleFlightResults[key] = asyncResult
+	try:
+		result = function(*args, **kwargs)
+	except gevent.GreenletExit:
+		#Only this greenlet got killed, so the waiting callers shouldn't exit too. They still need to stop waiting though, otherwise they'd wait forever
+		asyncResult.set_exception(RuntimeError("shared lookup was cancelled"))
+		raise
+	except BaseException as e:
+		asyncResult.set_exception(e)
+		raise
+	else:
+		asyncResult.set(result)
+		return result
+	finally:
+		del singleFlightResults[key]
+
+
 #First some Twitter functions
 def updateTwitterToken():
 	apikeys = GlobalStore.commandhandler.apikeys
@@ -17,7 +122,7 @@ def updateTwitterToken():
 	headers = {"Authorization": "Basic {}".format(credentials), "Content-Type": "application/x-www-form-urlencoded;charset=UTF-8"}
 	data = "grant_type=client_credentials"
 
-	req = requests.post("https://api.twitter.com/oauth2/token", data=data, headers=headers)
+	req = httpPost("https://api.twitter.com/oauth2/token", data=data, headers=headers)
 	reply = json.loads(req.text)
 	if 'access_token' not in reply:
 		logger.error("An error occurred while retrieving Twitter token: " + json.dumps(reply))
@@ -56,7 +161,7 @@ def downloadTweets(username, maxTweetCount=200, downloadNewerThanId=None, downlo
 	while len(tweets) < maxTweetCount:
 		params['count'] = maxTweetCount - len(tweets)  #Get as much tweets as we still need
 		try:
-			req = requests.get("https://api.twitter.com/1.1/statuses/user_timeline.json", headers=headers, params=params, timeout=20.0)
+			req = httpGet("https://api.twitter.com/1.1/statuses/user_timeline.json", headers=headers, params=params, timeout=20.0)
 			apireply = json.loads(req.text)
 		except requests.exceptions.Timeout:
 			logger.error("Twitter API reply took too long to arrive")
@@ -110,17 +215,63 @@ def isAllowedPath(path):
 		return False
 	return True
 
+#Line index functions. Finding a specific line in a file normally means reading everything before it, so the byte offset where each line starts gets stored
+# Files that are only read line by line, like the MtG card file, should call 'writeLineIndex' after they're written, so even the first lookup doesn't need to read the whole file
+lineIndexes = {}  #Keys are absolute filenames, values are (file size, modification time, array with the offset of the start of each line) tuples
+
+def getLineIndexFilename(filename):
+	return filename + '.lineindex'
+
+def readLineOffsets(filename):
+	"""Reads the whole file once, and returns an array with the byte offset of the start of each line"""
+	lineOffsets = array.array('L')
+	offset = 0
+	with open(filename, 'rb') as f:
+		for line in f:
+			lineOffsets.append(offset)
+			offset += len(line)
+	return lineOffsets
+
+def writeLineIndex(filename):
+	"""Stores the offset of each line in the provided file in a '.lineindex' file next to it. Should be called whenever the file changes"""
+	if not filename.startswith(GlobalStore.scriptfolder):
+		filename = os.path.join(GlobalStore.scriptfolder, filename)
+	lineOffsets = readLineOffsets(filename)
+	fileStat = os.stat(filename)
+	with open(getLineIndexFilename(filename), 'w') as lineIndexFile:
+		lineIndexFile.write(json.dumps({'fileSize': fileStat.st_size, 'fileModifiedTime': fileStat.st_mtime, 'lineOffsets': lineOffsets.tolist()}))
+	lineIndexes[filename] = (fileStat.st_size, fileStat.st_mtime, lineOffsets)
+
+def getLineOffsets(filename):
+	"""
+	Returns an array with the byte offset of the start of each line in the provided file. The offsets are kept in memory, and come from the '.lineindex' file if there is one.
+	If the file changed since the offsets were stored, or there's no line index file, the file gets read once to find the offsets again
+	"""
+	fileStat = os.stat(filename)
+	lineIndex = lineIndexes.get(filename, None)
+	if lineIndex and lineIndex[0] == fileStat.st_size and lineIndex[1] == fileStat.st_mtime:
+		return lineIndex[2]
+	lineOffsets = None
+	lineIndexFilename = getLineIndexFilename(filename)
+	if os.path.isfile(lineIndexFilename):
+		try:
+			with open(lineIndexFilename, 'r') as lineIndexFile:
+				storedLineIndex = json.load(lineIndexFile)
+			if storedLineIndex['fileSize'] == fileStat.st_size and storedLineIndex['fileModifiedTime'] == fileStat.st_mtime:
+				lineOffsets = array.array('L', storedLineIndex['lineOffsets'])
+		except (IOError, ValueError, KeyError) as e:
+			logger.warning(u"[SharedFunctions] Line index file '{}' couldn't be read, reading the lines from the file itself ({})".format(lineIndexFilename, e))
+	if lineOffsets is None:
+		lineOffsets = readLineOffsets(filename)
+	lineIndexes[filename] = (fileStat.st_size, fileStat.st_mtime, lineOffsets)
+	return lineOffsets
+
 def getLineCount(filename):
-	#Set a default in case the file has no lines
-	linecount = -1  #'-1' so with the +1 at the end it ends up a 0 for an empty file
 	if not filename.startswith(GlobalStore.scriptfolder):
 		filename = os.path.join(GlobalStore.scriptfolder, filename)
 	if not os.path.isfile(filename):
 		return -1
-	with codecs.open(filename, 'r', 'utf-8') as f:
-		for linecount, line in enumerate(f):
-			continue
-	return linecount + 1  #'enumerate()' starts at 0, so add one
+	return len(getLineOffsets(filename))
 
 def getLineFromFile(filename, wantedLineNumber):
 	"""Returns the specified line number from the provided file (line number starts at 0)"""
@@ -132,11 +283,13 @@ def getLineFromFile(filename, wantedLineNumber):
 	if not os.path.isfile(filename):
 		logger.error(u"Can't read line {} from file '{}'; file does not exist".format(wantedLineNumber, filename))
 		return None
-	with codecs.open(filename, 'r', 'utf-8') as f:
-		for lineNumber, line in enumerate(f):
-			if lineNumber == wantedLineNumber:
-				return line.rstrip()
-	return None
+	lineOffsets = getLineOffsets(filename)
+	if wantedLineNumber < 0 or wantedLineNumber >= len(lineOffsets):
+		return None
+	#Jump straight to the start of the line instead of reading all the lines before it
+	with open(filename, 'rb') as f:
+		f.seek(lineOffsets[wantedLineNumber])
+		return f.readline().decode('utf-8').rstrip()
 
 def getRandomLineFromFile(filename, linecount=None):
 	if not filename.startswith(GlobalStore.scriptfolder):
@@ -258,7 +411,7 @@ def shortenUrl(longUrl):
 		logger.error("Url shortening requested but Google API key not found")
 		return (False, longUrl, "No Google API key found")
 	#The Google shortening API requires the url key in the POST message body for some reason, hence 'json' and not 'data'
-	response = requests.post('https://www.googleapis.com/urlshortener/v1/url?key=' + GlobalStore.commandhandler.apikeys['google'],
+	response = httpPost('https://www.googleapis.com/urlshortener/v1/url?key=' + GlobalStore.commandhandler.apikeys['google'],
 				  json={'longUrl': longUrl})
 	try:
 		data = response.json()
@@ -274,7 +427,7 @@ def shortenUrl(longUrl):
 
 def downloadFile(url, targetFilename, timeout=30.0):
 	try:
-		r = requests.get(url, headers={'user-agent': 'DideRobot (http://github.com/Didero/DideRobot)'}, timeout=timeout)
+		r = httpGet(url, headers={'user-agent': 'DideRobot (http://github.com/Didero/DideRobot)'}, timeout=timeout)
 		with open(targetFilename, 'wb') as f:
 			for chunk in r.iter_content(4096):
 				f.write(chunk)
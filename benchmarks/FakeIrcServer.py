@@ -0,0 +1,222 @@
+"""
+A fake IRC server that speaks just enough IRC to host bots for load testing: registration, JOIN, WHO, PING and PRIVMSG.
+Every connected bot gets sent traffic from a TrafficProfile at a fixed rate, and the server measures how long it takes for commands to be answered and PINGs to be PONGed
+"""
+
+import collections, random, time
+
+import gevent
+import gevent.event
+import gevent.server
+import gevent.socket
+
+import Constants
+from IrcLineFramer import IrcLineFramer
+import IrcLineParser
+
+
+class TrafficProfile(object):
+	"""
+	Produces the lines the fake server sends to a bot, with '{channel}' in them replaced by the channel the bot joined.
+	Lines that are a PRIVMSG starting with the command prefix are counted as commands, and the bot is expected to reply to each of them once
+	"""
+	def __init__(self, lines, commandPrefix="!"):
+		self.lines = lines
+		self.commandPrefix = commandPrefix
+		self.lineIndex = 0
+
+	@classmethod
+	def fromCapture(cls, captureFilename, commandPrefix="!"):
+		"""Replays the lines from a file with recorded IRC traffic, in order, starting over when it runs out"""
+		with open(captureFilename, 'rb') as captureFile:
+			lines = [line for line in captureFile.read().splitlines() if line]
+		return cls(lines, commandPrefix)
+
+	@classmethod
+	def createSynthetic(cls, commandTexts, commandRatio, lineCount=10000, commandPrefix="!", seed=1234):
+		"""Creates a mix of channel chatter, commands and joins and parts, where about 'commandRatio' of the lines are commands"""
+		randomizer = random.Random(seed)
+		nicks = ["user{}".format(i) for i in xrange(50)]
+		words = ["lorem", "ipsum", "dolor", "sit", "amet", "card", "weather", "hello", "there", "http", "example", "page"]
+		lines = []
+		for lineIndex in xrange(lineCount):
+			nick = randomizer.choice(nicks)
+			user = "{0}!~{0}@host-{1}.example.com".format(nick, nicks.index(nick))
+			lineType = randomizer.random()
+			if lineType < commandRatio:
+				lines.append(":{} PRIVMSG {{channel}} :{}{}".format(user, commandPrefix, randomizer.choice(commandTexts)))
+			elif lineType < 0.95:
+				lines.append(":{} PRIVMSG {{channel}} :{}".format(user, " ".join(randomizer.choice(words) for i in xrange(randomizer.randint(1, 25)))))
+			elif lineType < 0.975:
+				lines.append(":{} JOIN {{channel}}".format(user))
+			else:
+				lines.append(":{} PART {{channel}} :Leaving".format(user))
+		return cls(lines, commandPrefix)
+
+	def getNextLine(self, channel):
+		"""Returns the next line to send and whether it's a command"""
+		line = self.lines[self.lineIndex].replace("{channel}", channel)
+		self.lineIndex = (self.lineIndex + 1) % len(self.lines)
+		if " PRIVMSG " in line:
+			parsedLine = IrcLineParser.parseLine(line)
+			if parsedLine and len(parsedLine.params) > 1 and parsedLine.params[1].startswith(self.commandPrefix):
+				return (line, True)
+		return (line, False)
+
+
+class FakeIrcClientConnection(object):
+	"""The server side of a single connected bot"""
+	serverName = "irc.loadtest.example"
+
+	def __init__(self, server, socket):
+		self.server = server
+		self.socket = socket
+		self.nickname = None
+		self.channel = None
+		self.isRegistered = False
+		self.hasJoinedChannel = gevent.event.Event()
+		self.isClosed = False
+		self.commandSendTimes = collections.deque()  #When each unanswered command was sent, oldest first. Replies are matched to commands in order
+		self.pingSendTimes = {}  #Keys are PING tokens, values are when that PING was sent
+		#Statistics
+		self.linesSentCount = 0
+		self.commandsSentCount = 0
+		self.linesReceivedCount = 0
+
+	def sendLines(self, lines):
+		if self.isClosed:
+			return
+		try:
+			self.socket.sendall("".join(line + "\r\n" for line in lines))
+		except (gevent.socket.error, IOError):
+			self.isClosed = True
+			return
+		self.linesSentCount += len(lines)
+
+	def handle(self):
+		lineFramer = IrcLineFramer(16384)
+		try:
+			while not self.isClosed:
+				if lineFramer.receiveFrom(self.socket) == 0:
+					break
+				for lineView in lineFramer.getLines():
+					self.linesReceivedCount += 1
+					self.handleLine(lineView.tobytes())
+		except (gevent.socket.error, IOError):
+			pass
+		finally:
+			self.isClosed = True
+			self.socket.close()
+
+	def handleLine(self, line):
+		parsedLine = IrcLineParser.parseLine(line)
+		if not parsedLine:
+			return
+		command = parsedLine.command
+		params = parsedLine.params
+		if command == 'NICK':
+			self.nickname = params[0]
+		elif command == 'USER' and not self.isRegistered:
+			self.isRegistered = True
+			self.sendLines([":{} 001 {} :Welcome to the load test network, {}".format(self.serverName, self.nickname, self.nickname)])
+		elif command == 'JOIN':
+			self.channel = params[0]
+			self.sendLines([":{0}!~{0}@bot.example.com JOIN {1}".format(self.nickname, self.channel)])
+		elif command == 'WHO':
+			whoLines = [":{} 352 {} {} ~{} host-{}.example.com {} {} H :0 {}".format(self.serverName, self.nickname, params[0], "user{}".format(i), i, self.serverName, "user{}".format(i), "user{}".format(i))
+						for i in xrange(50)]
+			whoLines.append(":{} 315 {} {} :End of /WHO list.".format(self.serverName, self.nickname, params[0]))
+			self.sendLines(whoLines)
+			self.hasJoinedChannel.set()
+		elif command == 'PONG':
+			pingSentAt = self.pingSendTimes.pop(params[-1], None)
+			if pingSentAt:
+				self.server.pongLatencies.append(time.time() - pingSentAt)
+		elif command in ('PRIVMSG', 'NOTICE'):
+			#Only channel messages can be replies to commands, private messages are CTCP replies and the like
+			if params[0][0] in Constants.CHANNEL_PREFIXES and self.commandSendTimes:
+				self.server.replyLatencies.append(time.time() - self.commandSendTimes.popleft())
+		elif command == 'QUIT':
+			self.isClosed = True
+
+	def sendPing(self, token):
+		self.pingSendTimes[token] = time.time()
+		self.sendLines(["PING :" + token])
+
+	def sendTraffic(self, lineCount, trafficProfile):
+		lines = []
+		for i in xrange(lineCount):
+			line, isCommand = trafficProfile.getNextLine(self.channel)
+			lines.append(line)
+			if isCommand:
+				self.commandSendTimes.append(time.time())
+				self.commandsSentCount += 1
+		self.sendLines(lines)
+
+
+class FakeIrcServer(object):
+	def __init__(self, host='127.0.0.1', port=0):
+		self.streamServer = gevent.server.StreamServer((host, port), self.handleConnection)
+		self.connections = []
+		self.connectionAdded = gevent.event.Event()
+		self.replyLatencies = []
+		self.pongLatencies = []
+
+	@property
+	def port(self):
+		return self.streamServer.server_port
+
+	def start(self):
+		self.streamServer.start()
+
+	def stop(self):
+		self.streamServer.stop()
+
+	def handleConnection(self, socket, address):
+		connection = FakeIrcClientConnection(self, socket)
+		self.connections.append(connection)
+		self.connectionAdded.set()
+		connection.handle()
+
+	def waitForBots(self, botCount, timeout):
+		"""Waits until 'botCount' bots have connected and joined their channel. Returns whether that happened before the timeout"""
+		endTime = time.time() + timeout
+		while len(self.connections) < botCount:
+			self.connectionAdded.clear()
+			if not self.connectionAdded.wait(endTime - time.time()):
+				return False
+		for connection in self.connections:
+			if not connection.hasJoinedChannel.wait(max(0.0, endTime - time.time())):
+				return False
+		return True
+
+	def resetLatencies(self):
+		self.replyLatencies = []
+		self.pongLatencies = []
+
+	def keepSendingTraffic(self, trafficProfile, linesPerSecondPerBot, duration, secondsBetweenPings=1.0):
+		"""Sends traffic to every connected bot at the provided rate for 'duration' seconds, in small batches so the rate stays smooth"""
+		startTime = time.time()
+		endTime = startTime + duration
+		linesSentPerBot = 0
+		nextPingTime = startTime
+		pingCount = 0
+		while True:
+			now = time.time()
+			if now >= endTime:
+				break
+			linesDue = int((now - startTime) * linesPerSecondPerBot) - linesSentPerBot
+			if linesDue > 0:
+				for connection in self.connections:
+					connection.sendTraffic(linesDue, trafficProfile)
+				linesSentPerBot += linesDue
+			if now >= nextPingTime:
+				pingCount += 1
+				for connection in self.connections:
+					connection.sendPing("loadtest{}".format(pingCount))
+				nextPingTime += secondsBetweenPings
+			gevent.sleep(0.01)
+		return time.time() - startTime
+
+	def getUnansweredCommandCount(self):
+		return sum(len(connection.commandSendTimes) for connection in self.connections)
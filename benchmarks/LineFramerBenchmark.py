@@ -0,0 +1,112 @@
+"""
+Replays a capture of IRC traffic through the old string-concatenation line splitting and through the IrcLineFramer, and reports how long each took.
+Usage: python benchmarks/LineFramerBenchmark.py [--capture FILE] [--lines 100000] [--readsize 4096] [--rounds 3]
+Without a capture file, a synthetic one is generated with a mix of PRIVMSG, JOIN, PART, QUIT and WHO reply lines
+"""
+
+import argparse, os, random, sys, time
+
+#Make sure the bot's modules can be imported when this is called from the benchmarks folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from IrcLineFramer import IrcLineFramer
+
+
+class ReplaySocket(object):
+	"""Pretends to be a socket, returning the provided data in chunks of at most the requested size"""
+	def __init__(self, data):
+		self.data = data
+		self.dataLength = len(data)
+		self.position = 0
+
+	def recv(self, maxByteCount):
+		chunk = self.data[self.position:self.position + maxByteCount]
+		self.position += len(chunk)
+		return chunk
+
+	def recv_into(self, targetBuffer, maxByteCount):
+		chunkLength = min(maxByteCount, self.dataLength - self.position)
+		targetBuffer[0:chunkLength] = self.data[self.position:self.position + chunkLength]
+		self.position += chunkLength
+		return chunkLength
+
+
+def createSyntheticCapture(lineCount):
+	randomizer = random.Random(1234)
+	nicks = ["user{}".format(i) for i in xrange(200)]
+	words = ["lorem", "ipsum", "dolor", "sit", "amet", "!mtg", "ooze", "http://example.com/page", "card", "weather", "hello", "there"]
+	lines = []
+	for lineIndex in xrange(lineCount):
+		nick = randomizer.choice(nicks)
+		user = "{0}!~{0}@host-{1}.example.com".format(nick, randomizer.randint(1, 9999))
+		lineType = randomizer.random()
+		if lineType < 0.7:
+			lines.append(":{} PRIVMSG #channel{} :{}".format(user, randomizer.randint(1, 5), " ".join(randomizer.choice(words) for i in xrange(randomizer.randint(1, 30)))))
+		elif lineType < 0.8:
+			lines.append(":{} JOIN #channel{}".format(user, randomizer.randint(1, 5)))
+		elif lineType < 0.85:
+			lines.append(":{} PART #channel{} :Leaving".format(user, randomizer.randint(1, 5)))
+		elif lineType < 0.9:
+			lines.append(":{} QUIT :*.net *.split".format(user))
+		else:
+			lines.append(":irc.example.com 352 DideRobot #channel1 ~{0} host.example.com irc.example.com {0} H :0 {0}".format(nick))
+	return "\r\n".join(lines) + "\r\n"
+
+
+def runOldFramer(data, readSize):
+	"""The way DideRobot.handleConnection used to split incoming data into lines"""
+	replaySocket = ReplaySocket(data)
+	lineCount = 0
+	incomingData = ""
+	while True:
+		incomingData += replaySocket.recv(readSize)
+		if replaySocket.position >= replaySocket.dataLength and '\r\n' not in incomingData:
+			break
+		while '\r\n' in incomingData:
+			line, incomingData = incomingData.split('\r\n', 1)
+			lineCount += 1
+	return lineCount
+
+def runNewFramer(data, readSize):
+	replaySocket = ReplaySocket(data)
+	lineCount = 0
+	lineFramer = IrcLineFramer(readSize)
+	while lineFramer.receiveFrom(replaySocket) > 0:
+		for lineView in lineFramer.getLines():
+			line = lineView.tobytes()
+			lineCount += 1
+	return lineCount
+
+def timeFramer(framerFunction, data, readSize, rounds):
+	bestTime = None
+	lineCount = 0
+	for roundIndex in xrange(rounds):
+		startTime = time.time()
+		lineCount = framerFunction(data, readSize)
+		roundTime = time.time() - startTime
+		if bestTime is None or roundTime < bestTime:
+			bestTime = roundTime
+	return (bestTime, lineCount)
+
+
+if __name__ == '__main__':
+	argparser = argparse.ArgumentParser(description="Compare the old and new IRC line framers")
+	argparser.add_argument("--capture", help="A file with recorded raw IRC traffic, lines separated by '\\r\\n'. A synthetic capture is used if this isn't provided")
+	argparser.add_argument("--lines", type=int, default=100000, help="The number of lines in the synthetic capture")
+	argparser.add_argument("--readsize", type=int, default=4096, help="How many bytes to read at a time")
+	argparser.add_argument("--rounds", type=int, default=3, help="How often to run each framer. The fastest run is reported")
+	args = argparser.parse_args()
+
+	if args.capture:
+		with open(args.capture, 'rb') as captureFile:
+			captureData = captureFile.read()
+	else:
+		captureData = createSyntheticCapture(args.lines)
+
+	print("Replaying {:,} bytes in reads of {:,} bytes, best of {} rounds".format(len(captureData), args.readsize, args.rounds))
+	oldTime, oldLineCount = timeFramer(runOldFramer, captureData, args.readsize, args.rounds)
+	newTime, newLineCount = timeFramer(runNewFramer, captureData, args.readsize, args.rounds)
+	if oldLineCount != newLineCount:
+		print("WARNING: Framers returned a different number of lines! Old: {:,}, new: {:,}".format(oldLineCount, newLineCount))
+	print("Old string framer:    {:.3f} seconds for {:,} lines ({:,.0f} lines/sec)".format(oldTime, oldLineCount, oldLineCount / oldTime))
+	print("New bytearray framer: {:.3f} seconds for {:,} lines ({:,.0f} lines/sec)".format(newTime, newLineCount, newLineCount / newTime))
+	print("Speedup: {:.2f}x".format(oldTime / newTime))
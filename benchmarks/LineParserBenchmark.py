@@ -0,0 +1,145 @@
+"""
+Compares the old split-and-getattr way of parsing and dispatching IRC lines with IrcLineParser and a prebuilt handler table.
+Also checks that both return the same source and parameters for every line, so the 'irc_' handlers get what they expect.
+Usage: python benchmarks/LineParserBenchmark.py [--capture FILE] [--lines 100000] [--rounds 3]
+"""
+
+import argparse, os, sys, time
+
+#Make sure the bot's modules can be imported when this is called from the benchmarks folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import Constants
+from DideRobot import DideRobot
+import IrcLineParser
+from LineFramerBenchmark import createSyntheticCapture
+
+
+SERVER_NAME = "irc.example.com"
+PREFIXLESS_LINES = ["NOTICE AUTH :*** Looking up your hostname...", "NOTICE AUTH :*** Found your hostname", "NOTICE * :*** Checking Ident",
+					"ERROR :Closing Link: DideRobot[host.example.com] (Ping timeout)", "JOIN #channel1", "PRIVMSG #channel1 :no prefix here"]
+
+
+class DummyBot(object):
+	"""Has handlers for the most common message types, like DideRobot, but they don't do anything"""
+	ircMessageHandlers = None
+
+	def irc_PRIVMSG(self, prefix, params):
+		pass
+
+	def irc_NOTICE(self, prefix, params):
+		pass
+
+	def irc_JOIN(self, prefix, params):
+		pass
+
+	def irc_PART(self, prefix, params):
+		pass
+
+	def irc_QUIT(self, prefix, params):
+		pass
+
+	def irc_RPL_WHOREPLY(self, prefix, params):
+		pass
+
+	def irc_unknown_message_type(self, prefix, messageType, params):
+		pass
+
+	#Use the real handler table builder, so this benchmark measures what DideRobot actually does
+	getIrcMessageHandlers = classmethod(DideRobot.getIrcMessageHandlers.__func__)
+
+
+def parseLineOld(line):
+	"""How DideRobot.handleConnection used to parse a line"""
+	lineParts = line.split(" ")
+	messageSource = lineParts[0]
+	if messageSource.startswith(":"):
+		messageSource = messageSource[1:]
+	messageType = lineParts[1]
+	messageType = Constants.IRC_NUMERIC_TO_NAME.get(messageType, messageType)
+	messageParts = lineParts[2:]
+	for messagePartIndex, messagePart in enumerate(messageParts):
+		if messagePart.startswith(':'):
+			wordgroup = " ".join(messageParts[messagePartIndex:])[1:]
+			messageParts[messagePartIndex] = wordgroup
+			messageParts = messageParts[:messagePartIndex+1]
+			break
+	return (messageSource, messageType, messageParts, lineParts)
+
+def runOldParser(lines, bot):
+	for line in lines:
+		messageSource, messageType, messageParts, lineParts = parseLineOld(line)
+		messageTypeFunction = getattr(bot, "irc_" + messageType, None)
+		if messageTypeFunction:
+			messageTypeFunction(messageSource, messageParts)
+		else:
+			bot.irc_unknown_message_type(messageSource, messageType, lineParts)
+
+def runNewParser(lines, bot):
+	messageHandlers = bot.getIrcMessageHandlers()
+	parseLine = IrcLineParser.parseLine
+	for line in lines:
+		parsedLine = parseLine(line)
+		if parsedLine.prefix is None:
+			bot.irc_unknown_message_type(SERVER_NAME, parsedLine.command, parsedLine.params)
+			continue
+		messageTypeFunction = messageHandlers.get(parsedLine.command, None)
+		if messageTypeFunction:
+			messageTypeFunction(bot, parsedLine.prefix, parsedLine.params)
+		else:
+			bot.irc_unknown_message_type(parsedLine.prefix, parsedLine.command, parsedLine.params)
+
+def countMismatches(lines):
+	mismatchCount = 0
+	bot = DummyBot()
+	messageHandlers = bot.getIrcMessageHandlers()
+	for line in lines:
+		messageSource, messageType, messageParts, lineParts = parseLineOld(line)
+		parsedLine = IrcLineParser.parseLine(line)
+		if parsedLine.prefix is None:
+			#The old parser took the command as the source for lines without a prefix, so only check that both end up in the generic function
+			isMismatch = hasattr(bot, "irc_" + messageType)
+		else:
+			isMismatch = messageSource != parsedLine.prefix or messageType != Constants.IRC_NUMERIC_TO_NAME.get(parsedLine.command, parsedLine.command) or messageParts != parsedLine.params or \
+						 hasattr(bot, "irc_" + messageType) != (parsedLine.command in messageHandlers)
+		if isMismatch:
+			mismatchCount += 1
+			if mismatchCount <= 5:
+				print("Mismatch for line '{}':\n  old: {}\n  new: {}".format(line, (messageSource, messageType, messageParts), parsedLine))
+	return mismatchCount
+
+def timeParser(parserFunction, lines, rounds):
+	bestTime = None
+	for roundIndex in xrange(rounds):
+		bot = DummyBot()
+		startTime = time.time()
+		parserFunction(lines, bot)
+		roundTime = time.time() - startTime
+		if bestTime is None or roundTime < bestTime:
+			bestTime = roundTime
+	return bestTime
+
+
+if __name__ == '__main__':
+	argparser = argparse.ArgumentParser(description="Compare the old and new IRC line parsers")
+	argparser.add_argument("--capture", help="A file with recorded raw IRC traffic, lines separated by '\\r\\n'. A synthetic capture is used if this isn't provided")
+	argparser.add_argument("--lines", type=int, default=100000, help="The number of lines in the synthetic capture")
+	argparser.add_argument("--rounds", type=int, default=3, help="How often to run each parser. The fastest run is reported")
+	args = argparser.parse_args()
+
+	if args.capture:
+		with open(args.capture, 'rb') as captureFile:
+			captureData = captureFile.read()
+	else:
+		captureData = createSyntheticCapture(args.lines)
+	#The old parser can't handle PINGs or IRCv3 tags, so leave those out of the comparison
+	corpus = [line for line in captureData.split('\r\n') if line and not line.startswith('PING') and not line.startswith('@')]
+	#Servers send some lines without a prefix, mostly while connecting. Mix those in so their handling gets checked too
+	corpus.extend(PREFIXLESS_LINES * max(1, len(corpus) // 1000))
+
+	mismatches = countMismatches(corpus)
+	print("{:,} of {:,} lines parsed differently".format(mismatches, len(corpus)))
+	oldTime = timeParser(runOldParser, corpus, args.rounds)
+	newTime = timeParser(runNewParser, corpus, args.rounds)
+	print("Old split and getattr parser: {:.3f} seconds ({:,.0f} lines/sec)".format(oldTime, len(corpus) / oldTime))
+	print("New table-driven parser:      {:.3f} seconds ({:,.0f} lines/sec)".format(newTime, len(corpus) / newTime))
+	print("Speedup: {:.2f}x".format(oldTime / newTime))
@@ -0,0 +1,180 @@
+"""
+Starts a number of real bots through the BotHandler, connects them to a local FakeIrcServer, and sends them traffic at a fixed rate.
+Reports how many commands per second got answered, the reply and PONG latency percentiles, and how much memory use grew during the run.
+Everything runs offline, in a temporary folder, so it doesn't touch the real settings, logs or data.
+Usage: python benchmarks/LoadTestBenchmark.py [--bots 3] [--rate 50] [--duration 30] [--commands Choice,dice] [--capture FILE]
+ Use '--max-p95' and '--min-commands-per-second' to have the benchmark exit with an error if performance regressed
+"""
+
+import gevent.monkey
+gevent.monkey.patch_all()
+
+import argparse, gc, json, logging, os, resource, shutil, sys, tempfile, time
+
+import gevent
+import greenlet
+
+#Make sure the bot's modules can be imported when this is called from the benchmarks folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import GlobalStore
+from BotHandler import BotHandler
+from CommandHandler import CommandHandler
+from FakeIrcServer import FakeIrcServer, TrafficProfile
+
+
+def createScriptFolder(botCount, port, commandnames):
+	"""Creates a temporary folder with the settings the bots need, and a link to the real 'commands' folder so modules can be loaded from it"""
+	scriptfolder = tempfile.mkdtemp(prefix='DideRobotLoadTest')
+	repositoryFolder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+	os.mkdir(os.path.join(scriptfolder, 'data'))
+	with open(os.path.join(scriptfolder, 'data', 'apikeys.json'), 'w') as apikeysFile:
+		apikeysFile.write("{}")
+	if hasattr(os, 'symlink'):
+		os.symlink(os.path.join(repositoryFolder, 'commands'), os.path.join(scriptfolder, 'commands'))
+	else:
+		shutil.copytree(os.path.join(repositoryFolder, 'commands'), os.path.join(scriptfolder, 'commands'))
+	with open(os.path.join(repositoryFolder, 'serverSettings', 'globalsettings.json.example'), 'r') as globalSettingsFile:
+		globalSettings = json.load(globalSettingsFile)
+	globalSettings.update({'server': '127.0.0.1', 'port': port, 'maxConnectionRetries': 0, 'echoLogsToConsole': False, 'archiveOldLogs': False, 'metricsServerPort': 0,
+						   'commandWhitelist': commandnames})
+	with open(makeFolderFor(os.path.join(scriptfolder, 'serverSettings', 'globalsettings.json')), 'w') as globalSettingsFile:
+		globalSettingsFile.write(json.dumps(globalSettings, indent=2))
+	serverfolders = []
+	for botIndex in xrange(botCount):
+		serverfolder = 'loadtest{}'.format(botIndex)
+		with open(makeFolderFor(os.path.join(scriptfolder, 'serverSettings', serverfolder, 'settings.json')), 'w') as settingsFile:
+			settingsFile.write(json.dumps({'nickname': 'LoadTestBot{}'.format(botIndex), 'joinChannels': ['#loadtest{}'.format(botIndex)], 'admins': ['nobody']}))
+		serverfolders.append(serverfolder)
+	return (scriptfolder, serverfolders)
+
+def makeFolderFor(filename):
+	if not os.path.isdir(os.path.dirname(filename)):
+		os.makedirs(os.path.dirname(filename))
+	return filename
+
+def getMemoryUsage():
+	"""Returns the current resident memory size in bytes, or the peak size if the current one isn't available on this system"""
+	if os.path.exists('/proc/self/statm'):
+		with open('/proc/self/statm', 'r') as statmFile:
+			return int(statmFile.read().split()[1]) * resource.getpagesize()
+	#On Linux 'ru_maxrss' is in kilobytes, on macOS it's in bytes
+	maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+def getPercentile(sortedValues, percentile):
+	if not sortedValues:
+		return 0.0
+	return sortedValues[min(len(sortedValues) - 1, int(len(sortedValues) * percentile / 100.0))]
+
+def formatLatencies(latencies):
+	latencies = sorted(latencies)
+	return "p50 {:.2f} ms, p95 {:.2f} ms, p99 {:.2f} ms, max {:.2f} ms ({:,} samples)".format(getPercentile(latencies, 50) * 1000, getPercentile(latencies, 95) * 1000,
+																						  getPercentile(latencies, 99) * 1000, (latencies[-1] if latencies else 0.0) * 1000, len(latencies))
+
+
+if __name__ == '__main__':
+	argparser = argparse.ArgumentParser(description="Run bots against a fake local IRC server and measure throughput, latency and memory growth")
+	argparser.add_argument("--bots", type=int, default=3, help="How many bots to start")
+	argparser.add_argument("--rate", type=float, default=50.0, help="How many lines per second to send to each bot")
+	argparser.add_argument("--duration", type=float, default=30.0, help="How many seconds to send traffic for")
+	argparser.add_argument("--warmup", type=float, default=3.0, help="How many seconds to send traffic before measuring starts")
+	argparser.add_argument("--commands", default="Choice,dice", help="Comma-separated list of modules to load. Only load modules that don't need the internet")
+	argparser.add_argument("--command-texts", default="choose pizza, pasta, salad|roll 3d6|dice 20 4|choice tea;coffee",
+						   help="'|'-separated commands (without prefix) used in the synthetic traffic. Every command should get exactly one reply line")
+	argparser.add_argument("--command-ratio", type=float, default=0.2, help="Which part of the synthetic traffic lines are commands")
+	argparser.add_argument("--capture", help="A file with recorded IRC lines to replay instead of the synthetic traffic. '{channel}' in a line gets replaced by the bot's channel")
+	argparser.add_argument("--json", help="Also write the results as JSON to this file")
+	argparser.add_argument("--max-p95", type=float, help="Exit with an error if the p95 reply latency is higher than this many milliseconds")
+	argparser.add_argument("--min-commands-per-second", type=float, help="Exit with an error if fewer commands than this got answered per second")
+	argparser.add_argument("--verbose", action='store_true', help="Show the bot's log output")
+	args = argparser.parse_args()
+
+	logger = logging.getLogger('DideRobot')
+	logger.setLevel(logging.DEBUG if args.verbose else logging.WARNING)
+	loggingStreamHandler = logging.StreamHandler(sys.stderr)
+	loggingStreamHandler.setFormatter(logging.Formatter('%(asctime)s (%(levelname)s) %(message)s', datefmt="%H:%M:%S"))
+	logger.addHandler(loggingStreamHandler)
+
+	fakeServer = FakeIrcServer()
+	fakeServer.start()
+	commandnames = [commandname.strip() for commandname in args.commands.split(',') if commandname.strip()]
+	GlobalStore.scriptfolder, serverfolders = createScriptFolder(args.bots, fakeServer.port, commandnames)
+	try:
+		GlobalStore.commandhandler = CommandHandler()
+		for commandname in commandnames:
+			loadResult = GlobalStore.commandhandler.loadCommand(commandname)
+			if not loadResult[0]:
+				print("Unable to load module '{}': {}".format(commandname, loadResult[1]))
+				sys.exit(1)
+		BotHandler(serverfolders)
+		if not fakeServer.waitForBots(args.bots, 30):
+			print("Not all bots connected and joined their channel within 30 seconds, aborting")
+			sys.exit(1)
+
+		if args.capture:
+			trafficProfile = TrafficProfile.fromCapture(args.capture)
+		else:
+			trafficProfile = TrafficProfile.createSynthetic(args.command_texts.split('|'), args.command_ratio)
+		print("Sending {:,.0f} lines per second to each of {} bots for {:.0f} seconds, after {:.0f} seconds of warmup".format(args.rate, args.bots, args.duration, args.warmup))
+		if args.warmup > 0:
+			fakeServer.keepSendingTraffic(trafficProfile, args.rate, args.warmup)
+		fakeServer.resetLatencies()
+		gc.collect()
+		memoryAtStart = getMemoryUsage()
+		linesSentAtStart = sum(connection.linesSentCount for connection in fakeServer.connections)
+		commandsSentAtStart = sum(connection.commandsSentCount for connection in fakeServer.connections)
+		unansweredCommandsAtStart = fakeServer.getUnansweredCommandCount()
+		cpuTimeAtStart = time.clock()
+
+		secondsPassed = fakeServer.keepSendingTraffic(trafficProfile, args.rate, args.duration)
+		#Give the bots a moment to answer the last commands, but don't count that time towards the throughput
+		waitEndTime = time.time() + 5.0
+		while fakeServer.getUnansweredCommandCount() > 0 and time.time() < waitEndTime:
+			gevent.sleep(0.05)
+
+		cpuSeconds = time.clock() - cpuTimeAtStart
+		gc.collect()
+		memoryAtEnd = getMemoryUsage()
+		linesSent = sum(connection.linesSentCount for connection in fakeServer.connections) - linesSentAtStart
+		commandsSent = sum(connection.commandsSentCount for connection in fakeServer.connections) - commandsSentAtStart
+		replyLatencies = sorted(fakeServer.replyLatencies)
+		#Commands from the warmup can get answered during the run, so don't just count the replies
+		commandsAnswered = commandsSent + unansweredCommandsAtStart - fakeServer.getUnansweredCommandCount()
+		results = {'bots': args.bots, 'linesPerSecondPerBot': args.rate, 'seconds': secondsPassed, 'linesSent': linesSent, 'linesPerSecond': linesSent / secondsPassed,
+				   'commandsSent': commandsSent, 'commandsAnswered': commandsAnswered, 'commandsPerSecond': commandsAnswered / secondsPassed,
+				   'unansweredCommands': fakeServer.getUnansweredCommandCount(), 'cpuSeconds': cpuSeconds,
+				   'replyLatency': {'p50': getPercentile(replyLatencies, 50), 'p95': getPercentile(replyLatencies, 95), 'p99': getPercentile(replyLatencies, 99),
+									'max': replyLatencies[-1] if replyLatencies else 0.0},
+				   'pongLatency': {'p50': getPercentile(sorted(fakeServer.pongLatencies), 50), 'p95': getPercentile(sorted(fakeServer.pongLatencies), 95)},
+				   'memoryAtStart': memoryAtStart, 'memoryAtEnd': memoryAtEnd, 'memoryGrowth': memoryAtEnd - memoryAtStart,
+				   'greenlets': sum(1 for obj in gc.get_objects() if isinstance(obj, greenlet.greenlet))}
+
+		print("Lines sent:       {:,} ({:,.0f} lines/sec)".format(linesSent, results['linesPerSecond']))
+		print("Commands:         {:,} sent, {:,} answered, {:,} unanswered ({:,.1f} commands/sec)".format(commandsSent, commandsAnswered, results['unansweredCommands'], results['commandsPerSecond']))
+		print("Reply latency:    " + formatLatencies(replyLatencies))
+		print("PONG latency:     " + formatLatencies(fakeServer.pongLatencies))
+		print("CPU time:         {:.2f} seconds ({:.0%} of the run)".format(cpuSeconds, cpuSeconds / secondsPassed))
+		print("Memory:           {:,.1f} MB at start, {:,.1f} MB at end, grew {:,.1f} MB".format(memoryAtStart / 1048576.0, memoryAtEnd / 1048576.0, results['memoryGrowth'] / 1048576.0))
+		print("Greenlets:        {:,}".format(results['greenlets']))
+		if args.json:
+			with open(args.json, 'w') as jsonFile:
+				jsonFile.write(json.dumps(results, sort_keys=True, indent=4))
+
+		#Shut the bots down properly, so their logs get written and the modules get unloaded
+		GlobalStore.bothandler.shutdown("Load test finished")
+		shutdownEndTime = time.time() + 10.0
+		while GlobalStore.bothandler.bots and time.time() < shutdownEndTime:
+			gevent.sleep(0.1)
+		fakeServer.stop()
+
+		failures = []
+		if args.max_p95 is not None and results['replyLatency']['p95'] * 1000 > args.max_p95:
+			failures.append("p95 reply latency of {:.2f} ms is above the maximum of {:.2f} ms".format(results['replyLatency']['p95'] * 1000, args.max_p95))
+		if args.min_commands_per_second is not None and results['commandsPerSecond'] < args.min_commands_per_second:
+			failures.append("{:,.1f} commands per second is below the minimum of {:,.1f}".format(results['commandsPerSecond'], args.min_commands_per_second))
+		for failure in failures:
+			print("FAILED: " + failure)
+		if failures:
+			sys.exit(1)
+	finally:
+		shutil.rmtree(GlobalStore.scriptfolder, ignore_errors=True)
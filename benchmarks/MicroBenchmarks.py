@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+
+"""
+Times the functions that run most often, or that are slowest, with timeit, and compares the results to the baselines stored in 'MicroBenchmarkBaselines.json'.
+A benchmark that got slower than the baseline by more than the tolerance is marked in the table, so a slowdown shows up in review.
+Everything runs in a temporary folder with generated fixtures, so no internet connection or real card data is needed.
+Benchmarks for modules that can't be loaded (because something from 'requirements.txt' isn't installed, for instance) are skipped.
+Usage: python benchmarks/MicroBenchmarks.py [--filter NAME] [--repeat 5] [--tolerance 0.5] [--save-baseline] [--fail-on-regression]
+ The stored baselines only mean something on the machine they were recorded on, and even there timings drift by tens of percents between sessions.
+ So before comparing, record baselines of the unchanged code with '--save-baseline' on the machine that does the comparing, right before timing the changes
+"""
+
+import argparse, json, logging, os, random, shutil, sys, tempfile, timeit
+
+#Make sure the bot's modules can be imported when this is called from the benchmarks folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import GlobalStore
+from LineFramerBenchmark import createSyntheticCapture, runNewFramer
+
+REPOSITORY_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINES_FILENAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'MicroBenchmarkBaselines.json')
+SERVERFOLDER = 'microbenchmark'
+
+
+class DummySocket(object):
+	"""The benchmarks never let the socket writer greenlet run, this just makes the bot think it's connected"""
+	def sendall(self, data):
+		pass
+
+
+def createScriptFolder(cardCount):
+	"""Creates a temporary folder with settings for one bot, links to the real 'commands' and generator folders, and a synthetic MtG card file"""
+	scriptfolder = tempfile.mkdtemp(prefix='DideRobotMicroBenchmarks')
+	os.makedirs(os.path.join(scriptfolder, 'data'))
+	for foldername in ('commands', os.path.join('data', 'generators')):
+		if hasattr(os, 'symlink'):
+			os.symlink(os.path.join(REPOSITORY_FOLDER, foldername), os.path.join(scriptfolder, foldername))
+		else:
+			shutil.copytree(os.path.join(REPOSITORY_FOLDER, foldername), os.path.join(scriptfolder, foldername))
+	with open(os.path.join(scriptfolder, 'data', 'apikeys.json'), 'w') as apikeysFile:
+		apikeysFile.write("{}")
+	with open(os.path.join(REPOSITORY_FOLDER, 'serverSettings', 'globalsettings.json.example'), 'r') as globalSettingsFile:
+		globalSettings = json.load(globalSettingsFile)
+	globalSettings.update({'server': '127.0.0.1', 'nickname': 'DideRobot', 'admins': ['nobody'], 'echoLogsToConsole': False, 'archiveOldLogs': False})
+	os.makedirs(os.path.join(scriptfolder, 'serverSettings', SERVERFOLDER))
+	with open(os.path.join(scriptfolder, 'serverSettings', 'globalsettings.json'), 'w') as globalSettingsFile:
+		globalSettingsFile.write(json.dumps(globalSettings, indent=2))
+	with open(os.path.join(scriptfolder, 'serverSettings', SERVERFOLDER, 'settings.json'), 'w') as settingsFile:
+		settingsFile.write("{}")
+	createSyntheticCardFile(os.path.join(scriptfolder, 'data', 'MTGcards.json'), cardCount)
+	return scriptfolder
+
+def createSyntheticCardFile(filename, cardCount):
+	"""Writes a card file in the format MtGlookup uses: one JSON object per line, with the lowercase cardname as key and a list with the card data and the set data as value"""
+	randomizer = random.Random(1234)
+	syllables = ["ooze", "drake", "angel", "mirror", "entity", "storm", "crow", "elf", "goblin", "shade", "titan", "wurm", "sphinx", "lich", "knight"]
+	types = [u"Creature — Ooze", u"Creature — Elf Warrior", u"Legendary Creature — Angel", u"Instant", u"Sorcery", u"Artifact", u"Enchantment — Aura"]
+	setnames = ["Alpha", "Beta", "Mirage", "Tempest", "Urza's Saga", "Onslaught", "Innistrad", "Zendikar", "Theros", "Dominaria"]
+	with open(filename, 'w') as cardFile:
+		for cardIndex in xrange(cardCount):
+			cardname = u"{} {} {}".format(randomizer.choice(syllables).title(), randomizer.choice(syllables).title(), cardIndex)
+			card = {'name': cardname, 'type': randomizer.choice(types), 'manacost': u"{{{}}}{{G}}".format(randomizer.randint(1, 6)), 'cmc': unicode(randomizer.randint(1, 7)),
+					'text': u" ".join(randomizer.choice(syllables) for i in xrange(randomizer.randint(5, 40))), 'layout': u'normal'}
+			if card['type'].startswith(u"Creature") or card['type'].startswith(u"Legendary"):
+				card['power'] = unicode(randomizer.randint(0, 8))
+				card['toughness'] = unicode(randomizer.randint(1, 8))
+			sets = {}
+			for setname in randomizer.sample(setnames, randomizer.randint(1, 4)):
+				sets[setname.lower()] = {'artist': u"Artist {}".format(randomizer.randint(1, 100)), 'flavor': u" ".join(randomizer.choice(syllables) for i in xrange(randomizer.randint(0, 15))),
+										 'multiverseid': unicode(randomizer.randint(1, 500000)), 'number': unicode(randomizer.randint(1, 350)),
+										 'rarity': randomizer.choice([u"Common", u"Uncommon", u"Rare", u"Mythic Rare"]), 'watermark': u""}
+			cardFile.write(json.dumps({cardname.lower(): [card, sets]}) + "\n")
+
+def createBot():
+	"""Creates a bot that's set up like it's connected, but that never actually connects"""
+	from DideRobot import DideRobot
+	bot = DideRobot(SERVERFOLDER)
+	#The greenlets haven't started yet, so killing them just makes sure they never run
+	bot.connectionManagerGreenlet.kill()
+	bot.messageLogger.writerGreenlet.kill()
+	bot.messageLogger.archiverGreenlet.kill()
+	bot.nickname = bot.settings['nickname']
+	bot.ircSocket = DummySocket()
+	return bot
+
+
+def benchmarkIrcMessage(bot):
+	from IrcMessage import IrcMessage
+	user = "someone!~someone@host.example.com"
+	def createMessages():
+		IrcMessage('say', bot, user, "#channel", "just some normal chatter without a command in it")
+		IrcMessage('say', bot, user, "#channel", "!choose pizza, pasta, salad")
+	return createMessages
+
+def benchmarkLineSplitting(bot):
+	captureData = createSyntheticCapture(1000)
+	return lambda: runNewFramer(captureData, bot.settings.get('socketReadSize', 16384))
+
+def benchmarkHandleMessage(bot):
+	from IrcMessage import IrcMessage
+	user = "someone!~someone@host.example.com"
+	#Messages that don't make any module do something, so this measures how long it takes to find out no module needs to run
+	messages = [IrcMessage('say', bot, user, "#channel", "just some normal chatter without a command in it"),
+				IrcMessage('say', bot, user, "#channel", "!notamodule with some parameters"),
+				IrcMessage('join', bot, user, "#channel")]
+	def dispatchMessages():
+		for message in messages:
+			GlobalStore.commandhandler.handleMessage(message)
+	return dispatchMessages
+
+def benchmarkParseGrammarString(bot):
+	generatorsCommand = GlobalStore.commandhandler.commands['generators']
+	with open(os.path.join(generatorsCommand.filesLocation, 'CreatureGenerator.grammar'), 'r') as grammarFile:
+		grammar = json.load(grammarFile)
+	random.seed(1234)
+	return lambda: generatorsCommand.parseGrammarString(grammar['_start'], grammar, [], {})
+
+def benchmarkGetRandomLineFromFile(bot):
+	import SharedFunctions
+	random.seed(1234)
+	return lambda: SharedFunctions.getRandomLineFromFile(os.path.join('data', 'generators', 'LastNames.txt'))
+
+def benchmarkSearchCardStore(bot):
+	mtgCommand = GlobalStore.commandhandler.commands['MtGlookup']
+	regexDict = mtgCommand.searchDictToRegexDict({'name': 'ooze', 'type': 'creature', 'set': 'mirage|tempest'})[1]
+	#Without a loaded card store, this reads and parses the whole card file
+	return lambda: mtgCommand.searchCardStore(regexDict)
+
+def benchmarkSearchIndexedCardStore(bot):
+	mtgCommand = GlobalStore.commandhandler.commands['MtGlookup']
+	indexedCardStore = sys.modules[type(mtgCommand).__module__].IndexedCardStore.loadFromFile(os.path.join(GlobalStore.scriptfolder, 'data', 'MTGcards.json'))
+	regexDict = mtgCommand.searchDictToRegexDict({'name': 'ooze', 'type': 'creature', 'set': 'mirage|tempest'})[1]
+	return lambda: mtgCommand.searchCardStore(regexDict, indexedCardStore)
+
+def benchmarkSearchCardDatabase(bot):
+	mtgCommand = GlobalStore.commandhandler.commands['MtGlookup']
+	databaseFilename = os.path.join(GlobalStore.scriptfolder, 'data', 'MTGcards.db')
+	CardDatabase = sys.modules[type(mtgCommand).__module__].CardDatabase
+	CardDatabase.build(os.path.join(GlobalStore.scriptfolder, 'data', 'MTGcards.json'), databaseFilename)
+	cardDatabase = CardDatabase(databaseFilename)
+	regexDict = mtgCommand.searchDictToRegexDict({'name': 'ooze', 'type': 'creature', 'set': 'mirage|tempest'})[1]
+	return lambda: cardDatabase.search(regexDict)
+
+def benchmarkSendMessage(bot):
+	longText = u"A reply that's long enough to need splitting, with some unicode in it: Ætherling. " * 12
+	multilineText = u"First line of a reply\nSecond line of a reply\nThird line of a reply"
+	def sendMessages():
+		bot.sendMessage("#channel", longText)
+		bot.sendMessage("#channel", multilineText)
+		#The writer greenlet never runs, so clear the lines it would have written
+		del bot.outgoingData[:]
+	return sendMessages
+
+#Name, the module the benchmark needs (or None), how often to call the function per timing, and the function that returns the function to time
+BENCHMARKS = (
+	('IrcMessage', None, 10000, benchmarkIrcMessage),
+	('lineSplitting', None, 20, benchmarkLineSplitting),
+	('handleMessage', None, 5000, benchmarkHandleMessage),
+	('parseGrammarString', 'generators', 500, benchmarkParseGrammarString),
+	('getRandomLineFromFile', None, 200, benchmarkGetRandomLineFromFile),
+	('searchCardStore', 'MtGlookup', 3, benchmarkSearchCardStore),
+	('searchIndexedCardStore', 'MtGlookup', 100, benchmarkSearchIndexedCardStore),
+	('searchCardDatabase', 'MtGlookup', 100, benchmarkSearchCardDatabase),
+	('sendMessage', None, 2000, benchmarkSendMessage)
+)
+
+
+def formatSeconds(seconds):
+	if seconds >= 0.001:
+		return "{:.2f} ms".format(seconds * 1000)
+	return "{:.2f} us".format(seconds * 1000000)
+
+
+if __name__ == '__main__':
+	argparser = argparse.ArgumentParser(description="Time the hot functions of the bot and compare them to the stored baselines")
+	argparser.add_argument("--filter", help="Only run the benchmarks with this text in their name")
+	argparser.add_argument("--repeat", type=int, default=5, help="How often to time each benchmark. The fastest time is used")
+	argparser.add_argument("--tolerance", type=float, default=0.5, help="How much slower than the baseline a benchmark can be before it's marked as slower, 0.5 means 50 percent. "
+																		   "Back-to-back runs on the same machine can already differ by about a third, so lower values mostly catch noise")
+	argparser.add_argument("--cards", type=int, default=5000, help="How many cards to put in the synthetic card file")
+	argparser.add_argument("--save-baseline", action='store_true', help="Store the results as the new baselines")
+	argparser.add_argument("--fail-on-regression", action='store_true', help="Exit with an error if any benchmark is slower than its baseline")
+	args = argparser.parse_args()
+
+	logger = logging.getLogger('DideRobot')
+	logger.setLevel(logging.CRITICAL)  #Modules that can't be loaded are reported in the results table, so there's no need for their tracebacks
+	logger.addHandler(logging.StreamHandler(sys.stderr))
+
+	baselines = {}
+	if os.path.exists(BASELINES_FILENAME):
+		with open(BASELINES_FILENAME, 'r') as baselinesFile:
+			baselines = json.load(baselinesFile)
+
+	#Some modules store paths based on the script folder when they're imported, so this has to be set before any of them get loaded
+	GlobalStore.scriptfolder = createScriptFolder(args.cards)
+	try:
+		from CommandHandler import CommandHandler
+		GlobalStore.commandhandler = CommandHandler()
+		GlobalStore.commandhandler.loadCommands()
+		#Scheduled functions would start downloading data as soon as a benchmark lets other greenlets run, which would skew the timings, so stop them before they start
+		for command in GlobalStore.commandhandler.commands.itervalues():
+			if command.scheduledFunctionGreenlet:
+				command.scheduledFunctionGreenlet.kill()
+		bot = createBot()
+
+		results = {}
+		regressionCount = 0
+		print("{:<24}{:>14}{:>14}{:>10}".format("Benchmark", "Time per call", "Baseline", "Change"))
+		for name, requiredCommandname, number, benchmarkFunctionCreator in BENCHMARKS:
+			if args.filter and args.filter.lower() not in name.lower():
+				continue
+			if requiredCommandname and requiredCommandname not in GlobalStore.commandhandler.commands:
+				print("{:<24}{:>14}".format(name, "skipped, module '{}' couldn't be loaded. Check that everything in 'requirements.txt' is installed".format(requiredCommandname)))
+				continue
+			benchmarkFunction = benchmarkFunctionCreator(bot)
+			secondsPerCall = min(timeit.Timer(benchmarkFunction).repeat(args.repeat, number)) / number
+			results[name] = secondsPerCall
+			if name not in baselines:
+				print("{:<24}{:>14}{:>14}".format(name, formatSeconds(secondsPerCall), "none"))
+				continue
+			change = secondsPerCall / baselines[name] - 1.0
+			isRegression = change > args.tolerance
+			if isRegression:
+				regressionCount += 1
+			print("{:<24}{:>14}{:>14}{:>+10.0%}{}".format(name, formatSeconds(secondsPerCall), formatSeconds(baselines[name]), change, "  SLOWER" if isRegression else ""))
+
+		if args.save_baseline:
+			baselines.update(results)
+			with open(BASELINES_FILENAME, 'w') as baselinesFile:
+				baselinesFile.write(json.dumps(baselines, sort_keys=True, indent=4))
+			print("Saved {:,} results as the new baselines".format(len(results)))
+		if regressionCount:
+			print("{:,} benchmark{} got more than {:.0%} slower than the baseline. If the baselines weren't recorded on this machine just now, record them first with '--save-baseline'".format(
+				regressionCount, 's' if regressionCount > 1 else '', args.tolerance))
+			if args.fail_on_regression:
+				sys.exit(1)
+	finally:
+		shutil.rmtree(GlobalStore.scriptfolder, ignore_errors=True)
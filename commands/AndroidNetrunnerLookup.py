@@ -283,7 +283,7 @@ class Command(CommandTemplate):
 	def updateCardFile(self):
 		starttime = time.time()
 		try:
-			requestReply = requests.get("http://netrunnerdb.com/api/2.0/public/cards", timeout=60.0)
+			requestReply = SharedFunctions.httpGet("http://netrunnerdb.com/api/2.0/public/cards", timeout=60.0)
 			carddata = json.loads(requestReply.text)
 		except requests.exceptions.Timeout:
 			self.logError("[Netrunner] Data retrieval took too long")
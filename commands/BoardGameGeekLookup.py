@@ -12,6 +12,7 @@ import SharedFunctions
 class Command(CommandTemplate):
 	triggers = ['boardgame']
 	helptext = "Searches info on the provided board game name on BoardGameGeek.com (which can be pretty slow, sorry about that)"
+	responseCacheSeconds = 86400  #Game info doesn't change much, and BoardGameGeek is slow, so keep results around for a while
 
 	def execute(self, message):
 		"""
@@ -22,34 +23,40 @@ class Command(CommandTemplate):
 			message.reply("There's far too many boardgames to just pick a random one! Please provide a search query", "say")
 			return
 
-		#Since the API's search is a bit crap and doesn't sort properly, scrape the web search page
-		try:
-			request = requests.get("https://boardgamegeek.com/geeksearch.php", params={"action": "search", "objecttype": "boardgame", "q": message.message}, timeout=10.0)
-		except requests.exceptions.Timeout:
-			message.reply("Either your search query was too extensive for BoardGameGeek, or they're distracted by a boardgame. Either way, they took too long to respond, sorry")
-			return
-		if request.status_code != 200:
-			message.reply("Something seems to have gone wrong. At BoardGameGeek, I mean, because I never make mistaks. Try again in a little while", "say")
-			return
-		page = BeautifulSoup(request.content, "html.parser")
+		gameId = self.responseCache.get(('search', message.message))
+		if not gameId:
+			#Since the API's search is a bit crap and doesn't sort properly, scrape the web search page
+			try:
+				request = SharedFunctions.httpGet("https://boardgamegeek.com/geeksearch.php", params={"action": "search", "objecttype": "boardgame", "q": message.message}, timeout=10.0)
+			except requests.exceptions.Timeout:
+				message.reply("Either your search query was too extensive for BoardGameGeek, or they're distracted by a boardgame. Either way, they took too long to respond, sorry")
+				return
+			if request.status_code != 200:
+				message.reply("Something seems to have gone wrong. At BoardGameGeek, I mean, because I never make mistaks. Try again in a little while", "say")
+				return
+			page = BeautifulSoup(request.content, "html.parser")
 
-		#Get the first result row
-		row = page.find(class_="collection_objectname")
-		if row is None:
-			message.reply("BoardGameGeek doesn't think a game called '{}' exists. Maybe you made a typo?".format(message.message), "say")
-			return
-		#Then get the link to the board game page from that, to get the game ID from the URL
-		# Format of the url is '/boardgame/[ID]/[NAME]
-		gameId = row.find('a')['href'].split('/', 3)[2]
+			#Get the first result row
+			row = page.find(class_="collection_objectname")
+			if row is None:
+				message.reply("BoardGameGeek doesn't think a game called '{}' exists. Maybe you made a typo?".format(message.message), "say")
+				return
+			#Then get the link to the board game page from that, to get the game ID from the URL
+			# Format of the url is '/boardgame/[ID]/[NAME]
+			gameId = row.find('a')['href'].split('/', 3)[2]
+			self.responseCache.set(('search', message.message), gameId)
 
 		#Now query the API to get info on this game
+		gameData = self.responseCache.get(('game', gameId))
+		if not gameData:
+			try:
+				request = SharedFunctions.httpGet("https://www.boardgamegeek.com/xmlapi2/thing", params={'id': gameId}, timeout=10.0)
+			except requests.exceptions.Timeout:
+				message.reply("I know you need some patience for boardgames, but not for info about boardgames. BoardGameGeek took too long to respond, sorry")
+				return
+			gameData = request.content
 		try:
-			request = requests.get("https://www.boardgamegeek.com/xmlapi2/thing", params={'id': gameId}, timeout=10.0)
-		except requests.exceptions.Timeout:
-			message.reply("I know you need some patience for boardgames, but not for info about boardgames. BoardGameGeek took too long to respond, sorry")
-			return
-		try:
-			xml = ElementTree.fromstring(request.content)
+			xml = ElementTree.fromstring(gameData)
 		except ElementTree.ParseError:
 			message.reply("I don't know how to read the data returned by BoardGameGeek, which is weird because I'm coded very well. Try again in a little while, see if it works then?", "say")
 			return
@@ -57,8 +64,9 @@ class Command(CommandTemplate):
 		item = xml.find('item')
 		if item is None:  #Specific check otherwise Python prints a warning
 			message.reply("I'm sorry, I didn't find any games called '{}'. Did you make a typo? Or did you just invent a new game?!".format(message.message), "say")
-			print request.content
+			print gameData
 			return
+		self.responseCache.set(('game', gameId), gameData)
 
 		replytext = u"{} ({} players, {} minutes, {}): ".format(SharedFunctions.makeTextBold(item.find('name').attrib['value']), self.getValueRangeDescription(item, 'minplayers', 'maxplayers'),
 															   self.getValueRangeDescription(item, 'minplaytime', 'maxplaytime'), item.find('yearpublished').attrib['value'])
@@ -1,7 +1,10 @@
-import logging
+import logging, time
 
 import gevent
 
+import GlobalStore
+from ResponseCache import ResponseCache
+
 
 class CommandTemplate(object):
 	triggers = []
@@ -10,6 +13,7 @@ class CommandTemplate(object):
 
 	adminOnly = False
 	callInThread = False
+	maxConcurrentCalls = None  #If 'callInThread' is True, how many calls to this command can run at the same time. Extra calls wait in a queue. None means only the global worker limit applies
 	showInCommandList = True
 	stopAfterThisCommand = False  #Some modules might affect the command list, which leads to errors. If this is set to true and the command fires, no further commands are executed
 
@@ -17,8 +21,15 @@ class CommandTemplate(object):
 	scheduledFunctionGreenlet = None  #The greenlet that manages the scheduled function, or None if there isn't one
 	scheduledFunctionIsExecuting = False  #Set to True if the scheduled function is running, so we know when we can kill the scheduler greenlet
 
+	responseCacheSeconds = None  #Float, in seconds. If set, 'self.responseCache' is a ResponseCache that keeps lookup results for this long
+	responseCacheMaxEntries = 250
+	responseCacheIsCaseSensitive = False
+	responseCache = None
+
 
 	def __init__(self):
+		if self.responseCacheSeconds:
+			self.responseCache = ResponseCache(self.responseCacheSeconds, self.responseCacheMaxEntries, self.responseCacheIsCaseSensitive)
 		self.onLoad()  #Put this before starting the scheduled function because it may rely on loaded data
 		if self.scheduledFunctionTime:
 			self.scheduledFunctionGreenlet = gevent.spawn(self.keepRunningScheduledFunction)
@@ -41,6 +52,10 @@ class CommandTemplate(object):
 	def onUnload(self):
 		pass
 
+	def getCommandName(self):
+		#The command name is the module filename, like 'MtGlookup'
+		return type(self).__module__.rsplit('.', 1)[-1]
+
 	def getHelp(self, message):
 		return self.helptext.format(commandPrefix=message.bot.commandPrefix)
 		
@@ -54,12 +69,29 @@ class CommandTemplate(object):
 	def execute(self, message):
 		pass
 
+	@staticmethod
+	def runInProcess(function, *args, **kwargs):
+		"""
+		Runs a CPU-heavy function in a separate process, so it doesn't stall all the bots, and returns its result once it's done.
+		Only the return value has to be picklable. See ProcessPool for the details
+		"""
+		return GlobalStore.commandhandler.processPool.run(function, *args, **kwargs)
+
 	def keepRunningScheduledFunction(self):
 		self.logInfo("Executing looping function every {} seconds".format(self.scheduledFunctionTime))
 		try:
 			while self.scheduledFunctionTime and self.scheduledFunctionTime > 0:
 				self.scheduledFunctionIsExecuting = True
-				self.executeScheduledFunction()
+				GlobalStore.commandhandler.blockingDetector.setCurrentCommand(self.getCommandName())
+				startTime = time.time()
+				try:
+					self.executeScheduledFunction()
+				except Exception:
+					GlobalStore.commandhandler.commandMetrics.recordScheduledFunction(self.getCommandName(), time.time() - startTime, True)
+					raise
+				finally:
+					GlobalStore.commandhandler.blockingDetector.clearCurrentCommand()
+				GlobalStore.commandhandler.commandMetrics.recordScheduledFunction(self.getCommandName(), time.time() - startTime)
 				self.scheduledFunctionIsExecuting = False
 				gevent.sleep(self.scheduledFunctionTime)
 		except gevent.GreenletExit:
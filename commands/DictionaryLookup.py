@@ -10,6 +10,7 @@ import SharedFunctions
 class Command(CommandTemplate):
 	triggers = ['define', 'dictionary', 'dict', 'word']
 	helptext = "Looks up the definition of the provided word"
+	responseCacheSeconds = 86400  #Definitions don't change often
 
 	def execute(self, message):
 		"""
@@ -22,18 +23,21 @@ class Command(CommandTemplate):
 		#Lower case makes it easier to compare with later
 		searchQuery = message.message.lower()
 
-		#Get the data
-		try:
-			apireply = requests.get("http://api.pearson.com/v2/dictionaries/ldoce5/entries", params={'limit': 100, 'headword': searchQuery}, timeout=15.0)
-		except requests.exceptions.Timeout:
-			return message.reply("Sorry, the dictionary API took too long to respond. Please try again in a little while. Or a longer while, if the API is temporarily broken")
-		#Load the data
-		try:
-			definitionData = json.loads(apireply.text)
-		except ValueError:
-			self.logError("[DictLookup] Unexpected reply from Dictionary API:")
-			self.logError(apireply.text)
-			return message.reply("I'm sorry, the dictionary API I'm using returned some weird data. Tell my owner(s) about it, maybe it's something they can fix? Or just try again in a little while")
+		definitionData = self.responseCache.get(searchQuery)
+		if definitionData is None:
+			#Get the data
+			try:
+				apireply = SharedFunctions.httpGet("http://api.pearson.com/v2/dictionaries/ldoce5/entries", params={'limit': 100, 'headword': searchQuery}, timeout=15.0)
+			except requests.exceptions.Timeout:
+				return message.reply("Sorry, the dictionary API took too long to respond. Please try again in a little while. Or a longer while, if the API is temporarily broken")
+			#Load the data
+			try:
+				definitionData = json.loads(apireply.text)
+			except ValueError:
+				self.logError("[DictLookup] Unexpected reply from Dictionary API:")
+				self.logError(apireply.text)
+				return message.reply("I'm sorry, the dictionary API I'm using returned some weird data. Tell my owner(s) about it, maybe it's something they can fix? Or just try again in a little while")
+			self.responseCache.set(searchQuery, definitionData)
 
 		#Check to see if it's a recognised word/term
 		if 'total' not in definitionData or definitionData['total'] == 0 or 'results' not in definitionData or len(definitionData['results']) == 0:
@@ -5,6 +5,7 @@ import requests
 import Constants
 from CommandTemplate import CommandTemplate
 import GlobalStore
+import SharedFunctions
 from IrcMessage import IrcMessage
 
 
@@ -85,7 +86,7 @@ class Command(CommandTemplate):
 
 				apiReturn = None
 				try:
-					apiReturn = requests.get("http://api.locatorhq.com", params=params, timeout=10.0)
+					apiReturn = SharedFunctions.httpGet("http://api.locatorhq.com", params=params, timeout=10.0)
 					data = json.loads(apiReturn.text)
 				except requests.exceptions.Timeout:
 					replytext = u"I'm sorry, pinpointing {} location took too long for some reason. Maybe try again later?"
@@ -7,6 +7,8 @@ import requests
 from CommandTemplate import CommandTemplate
 from IrcMessage import IrcMessage
 import GlobalStore
+import LogArchiver
+import SharedFunctions
 
 
 class Command(CommandTemplate):
@@ -52,23 +54,20 @@ class Command(CommandTemplate):
 
 			#If we have a datetime object, parse it to the text format we save logs as
 			if date:
-				logfilename = "{}-{}.log".format(message.source, date.strftime("%Y-%m-%d"))
-				logfilename = os.path.join(GlobalStore.scriptfolder, "serverSettings", message.bot.serverfolder, "logs", logfilename)
-				#check if we've got a log for this channel and day
-				if not os.path.exists(logfilename):
+				logfolder = os.path.join(GlobalStore.scriptfolder, "serverSettings", message.bot.serverfolder, "logs")
+				#Logs are written in batches, make sure everything that's been said so far is in the file
+				message.bot.messageLogger.writeQueuedLines()
+				#Get the log for this channel and day, whether it's still a plain log or already archived
+				logLines = LogArchiver.readLogLines(logfolder, message.source, date.strftime("%Y-%m-%d"))
+				if logLines is None:
 					replytext = u"Sorry, no log for that day was found"
 				else:
 					pasteData = {"key": GlobalStore.commandhandler.apikeys["paste.ee"],
 								 "description": "Log for {} from {}".format(message.source, date.strftime("%Y-%m-%d")),
-								 "format": "json", "paste": u"", "expire": 600}  #Expire value is in supposedly in minutes, but apparently it's in seconds
-
-					#Add the actual log to the paste
-					with open(logfilename, 'r') as logfile:
-						for line in logfile:
-							pasteData["paste"] += line.decode('utf-8')
+								 "format": "json", "paste": u"".join(line.decode('utf-8') for line in logLines), "expire": 600}  #Expire value is in supposedly in minutes, but apparently it's in seconds
 
 					#Send the collected data to Paste.ee
-					reply = requests.post("http://paste.ee/api", data=pasteData)
+					reply = SharedFunctions.httpPost("http://paste.ee/api", data=pasteData)
 					if reply.status_code != requests.codes.ok:
 						replytext = u"Something went wrong while trying to upload the log. (HTTP code {})".format(reply.status_code)
 					else:
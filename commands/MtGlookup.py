@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 
-import gc, json, os, random, re, time, zipfile
+import json, os, random, re, sqlite3, sre_constants, sre_parse, time, zipfile
 import traceback
 
 import requests
@@ -21,9 +21,33 @@ class Command(CommandTemplate):
 	helptext += "{commandPrefix}mtgf adds the flavor text and sets to the output. '{commandPrefix}mtgb [setname]' opens a boosterpack"
 	scheduledFunctionTime = 172800.0  #Every other day, since it doesn't update too often
 	callInThread = True  #If a call causes a card update, make sure that doesn't block the whole bot
+	maxConcurrentCalls = 2  #Searches go through all the cards, so too many at once slows everything down
+
+	maxCardsToSearchInline = 1000  #If the indexes narrow a search down to at most this many cards, search them without starting a separate process
+	useCardDatabase = True  #If True, an SQLite database of the cards is built after each update, and used for searches the in-memory indexes can't narrow down much
 
 	areCardfilesInUse = False
-	dataFormatVersion = '4.3'
+	dataFormatVersion = '4.4'
+	indexedCardStore = None  #An IndexedCardStore with all the cards, or None if it's not loaded (yet)
+
+	def onLoad(self):
+		#Parsing all the cards takes a while, don't make loading all the modules wait for that
+		if self.doNeededFilesExist():
+			gevent.spawn(self.loadIndexedCardStore)
+
+	def loadIndexedCardStore(self):
+		#Drop the old store first, so there aren't two copies of all the cards in memory while the new one loads. Searches read the card file until it's done
+		self.indexedCardStore = None
+		starttime = time.time()
+		self.indexedCardStore = IndexedCardStore.loadFromFile(os.path.join(GlobalStore.scriptfolder, 'data', 'MTGcards.json'))
+		self.logInfo("[MtG] Loading {:,} cards into memory took {} seconds".format(len(self.indexedCardStore.cards), time.time() - starttime))
+
+	def getCardDatabase(self):
+		"""Returns a CardDatabase if it's enabled and has been built, or None otherwise"""
+		databaseFilename = os.path.join(GlobalStore.scriptfolder, 'data', 'MTGcards.db')
+		if self.useCardDatabase and os.path.isfile(databaseFilename):
+			return CardDatabase(databaseFilename)
+		return None
 
 	def executeScheduledFunction(self):
 		if not self.areCardfilesInUse and self.shouldUpdate():
@@ -51,6 +75,8 @@ class Command(CommandTemplate):
 			return
 
 		searchType = message.messageParts[0].lower()
+		#Use the same card store for the whole call, so the line numbers of found cards stay valid even if the store gets reloaded in the meantime
+		indexedCardStore = self.indexedCardStore
 
 		#Check for update command before file existence, to prevent message that card file is missing after update, which doesn't make much sense
 		if searchType == 'update' or searchType == 'forceupdate':
@@ -83,14 +109,17 @@ class Command(CommandTemplate):
 				message.reply("Please provide a set name, so I can open a boosterpack from that set. Or use 'random' to have me pick one")
 				return
 			setname = ' '.join(message.messageParts[1:]).lower() if searchType == 'booster' else message.message.lower()
-			message.reply(self.openBoosterpack(setname)[1])
+			message.reply(self.openBoosterpack(setname, indexedCardStore)[1])
 			return
 
 		elif searchType == 'random' and message.messagePartsLength == 1:
 			#Just pick a random card from all available ones
 			#Special case to prevent it having to load in all the cards before picking one
-			card = json.loads(SharedFunctions.getRandomLineFromFile(os.path.join(GlobalStore.scriptfolder, 'data', 'MTGcards.json')))
-			cardname, carddata = card.popitem()
+			if indexedCardStore:
+				carddata = random.choice(indexedCardStore.cards)
+			else:
+				card = json.loads(SharedFunctions.getRandomLineFromFile(os.path.join(GlobalStore.scriptfolder, 'data', 'MTGcards.json')))
+				cardname, carddata = card.popitem()
 			message.reply(self.getFormattedCardInfo(carddata, message.trigger == 'mtgf', False))
 			return
 
@@ -106,13 +135,26 @@ class Command(CommandTemplate):
 			#Again, 'regexDict' is the error string if an error occurred
 			message.reply(regexDict)
 			return
-		matchingCards = self.searchCardStore(regexDict)
+		#If the indexes narrow the search down to just a few cards, checking those is quick enough to do right here
+		searchPlan = CardSearchPlan(regexDict, indexedCardStore)
+		if indexedCardStore and searchPlan.candidateLineNumbers is not None and len(searchPlan.candidateLineNumbers) <= self.maxCardsToSearchInline:
+			matchingCards = indexedCardStore.search(regexDict, searchPlan)
+		else:
+			#The database can use its indexes for each attribute at the same time, if it's not available go through the cards
+			cardDatabase = self.getCardDatabase()
+			if cardDatabase and cardDatabase.canSearch(regexDict):
+				searchFunction, searchArguments = cardDatabase.search, (regexDict,)
+			else:
+				searchFunction, searchArguments = self.searchCardStore, (regexDict, indexedCardStore, searchPlan)
+			#If someone else is doing the exact same search right now, wait for that result instead of going through all the cards again
+			# The search itself runs in a separate process, since going through all the cards would otherwise block every bot until it's done
+			matchingCards = SharedFunctions.runSingleFlight(('MtGlookup', tuple(sorted(searchDict.iteritems()))), self.runInProcess, searchFunction, *searchArguments)
 		#Clear the stored regexes, since we don't need them anymore
 		del regexDict
 		re.purge()
 		#Done, show the formatted result
 		message.reply(self.formatSearchResult(matchingCards, message.trigger.endswith('f'), searchType.startswith('random'),
-											  20 if message.isPrivateMessage else 10, searchDict.get('name', None), len(searchDict) > 0))
+											  20 if message.isPrivateMessage else 10, searchDict.get('name', None), len(searchDict) > 0, indexedCardStore))
 
 	@staticmethod
 	def parseSearchParameters(searchType, message):
@@ -191,56 +233,25 @@ class Command(CommandTemplate):
 		return (True, regexDict)
 
 	@staticmethod
-	def searchCardStore(regexDict):
-		#Get the 'setname' search separately, so we can iterate over the rest later
-		setRegex = regexDict.pop('set', None)
-		setKeys = ('artist', 'flavor', 'multiverseid', 'number', 'rarity', 'watermark')
-
-		# A dict with cardname as key, and a list as value
-		#  First item in the list is line number of the card in the cardfile, last item is the matching setname (if any)
+	def searchCardStore(regexDict, indexedCardStore=None, searchPlan=None):
+		"""
+		Returns a dict with the names of the cards that match all the regexes as keys, and as values a tuple with the line number of the card in the card file
+		 and a list of the sets that matched, or None if all of the card's sets matched.
+		If the card store isn't loaded (yet), the card file gets read and parsed instead
+		"""
+		if indexedCardStore:
+			return indexedCardStore.search(regexDict, searchPlan)
+		if not searchPlan:
+			searchPlan = CardSearchPlan(regexDict)
 		matchingCards = {}
-		with open(os.path.join(GlobalStore.scriptfolder, 'data', 'MTGcards.json')) as jsonfile:
-			for cardlineNumber, cardline in enumerate(jsonfile):
-				cardname, carddata = json.loads(cardline).popitem()
-
-				#Store how much sets we started with, so we know at the end if any sets got removed
-				setCountAtStart = len(carddata[1])
-
-				#First check if we need to see if the set name matches
-				if setRegex:
-					for setname in carddata[1].keys():
-						#If the setname didn't match, remove it from the set list
-						if not setRegex.search(setname):
-							del carddata[1][setname]
-					if len(carddata[1]) == 0:
-						#No set name matched, skip this card
-						continue
-
-				#Then check if the rest of the attributes match
-				for attrib in regexDict:
-					#Some data is stored in the card data, some in the set data, because it differs per set (rarity etc)
-					if attrib in setKeys:
-						for setname in carddata[1].keys():
-							#If this attribute doesn't fit the search criteria, remove this set
-							if not regexDict[attrib].search(carddata[1][setname][attrib]):
-								del carddata[1][setname]
-						#No matching sets left, skip this card
-						if len(carddata[1]) == 0:
-							break
-					#Most data is stored as general card data
-					else:
-						if attrib not in carddata[0] or not regexDict[attrib].search(carddata[0][attrib]):
-							#If the wanted attribute is either not in the card, or it doesn't match, move on to the next card
-							break
-				else:
-					#If we didn't break from the loop, then the card matched all search criteria. Store it
-					# If all sets matched, don't store that. Otherwise, store a list of the sets that did match
-					setNameMatches = None if len(carddata[1]) == setCountAtStart else carddata[1].keys()
-					# Use the formatted name so displaying them is easier later
-					matchingCards[carddata[0]['name']] = (cardlineNumber, setNameMatches)
+		for cardlineNumber, carddata in IndexedCardStore.readCardFile(os.path.join(GlobalStore.scriptfolder, 'data', 'MTGcards.json')):
+			matchingSetnames = searchPlan.getMatchingSetnames(carddata)
+			if matchingSetnames:
+				# Use the formatted name so displaying them is easier later
+				matchingCards[carddata[0]['name']] = (cardlineNumber, None if len(matchingSetnames) == len(carddata[1]) else matchingSetnames)
 		return matchingCards
 
-	def formatSearchResult(self, cardstore, addExtendedCardInfo, pickRandomCard, maxCardsToList=10, nameToMatch=None, addResultCount=True):
+	def formatSearchResult(self, cardstore, addExtendedCardInfo, pickRandomCard, maxCardsToList=10, nameToMatch=None, addResultCount=True, indexedCardStore=None):
 		numberOfCardsFound = len(cardstore)
 
 		if numberOfCardsFound == 0:
@@ -265,7 +276,10 @@ class Command(CommandTemplate):
 		if len(cardstore) == 1:
 			#Retrieve the full info on the card we found
 			linenumber, setname = cardstore.values()[0]
-			cardname, carddata = json.loads(SharedFunctions.getLineFromFile(os.path.join("data", "MTGcards.json"), linenumber)).popitem()
+			if indexedCardStore:
+				carddata = indexedCardStore.cards[linenumber]
+			else:
+				cardname, carddata = json.loads(SharedFunctions.getLineFromFile(os.path.join("data", "MTGcards.json"), linenumber)).popitem()
 			replytext = self.getFormattedCardInfo(carddata, addExtendedCardInfo, setname)
 			#We may have culled the cardstore list, so there may have been more matches initially. List a count of those
 			if addResultCount and numberOfCardsFound > 1:
@@ -484,7 +498,7 @@ class Command(CommandTemplate):
 
 
 	@staticmethod
-	def openBoosterpack(askedSetname):
+	def openBoosterpack(askedSetname, indexedCardStore=None):
 		askedSetname = askedSetname.lower()
 		properSetname = u''
 		#First check if the message is a valid setname
@@ -574,23 +588,25 @@ class Command(CommandTemplate):
 		for rarity in boosterRarities:
 			possibleCards[rarity.lower()] = []
 
-		#Get all cards from that set
-		with open(os.path.join(GlobalStore.scriptfolder, 'data', 'MTGcards.json'), 'r') as jsonfile:
-			for cardline in jsonfile:
-				cardname, carddata = json.loads(cardline).popitem()
-				if properSetname not in carddata[1]:
-					continue
-				#Skip cards whose number ends with 'b', since they're the backside of doublefaced cards or the upside-down part of split cards
-				if 'number' in carddata[0] and carddata[0]['number'].endswith('b'):
-					continue
-				if collectTypes:
-					for typeName, typeRegex in typesToCollect:
-						if typeRegex.search(carddata[0]['type']):
-							possibleCards[typeName].append(carddata[0]['name'])
-							continue
-				rarity = carddata[1][properSetname]['rarity'].lower()
-				if rarity in boosterRarities:
-					possibleCards[rarity].append(carddata[0]['name'])
+		#Get all cards from that set. If the card store is loaded, its set index knows which cards those are
+		if indexedCardStore:
+			cardsToCheck = [indexedCardStore.cards[lineNumber] for lineNumber in indexedCardStore.setIndex.get(properSetname, [])]
+		else:
+			cardsToCheck = (carddata for lineNumber, carddata in IndexedCardStore.readCardFile(os.path.join(GlobalStore.scriptfolder, 'data', 'MTGcards.json')))
+		for carddata in cardsToCheck:
+			if properSetname not in carddata[1]:
+				continue
+			#Skip cards whose number ends with 'b', since they're the backside of doublefaced cards or the upside-down part of split cards
+			if 'number' in carddata[0] and carddata[0]['number'].endswith('b'):
+				continue
+			if collectTypes:
+				for typeName, typeRegex in typesToCollect:
+					if typeRegex.search(carddata[0]['type']):
+						possibleCards[typeName].append(carddata[0]['name'])
+						continue
+			rarity = carddata[1][properSetname]['rarity'].lower()
+			if rarity in boosterRarities:
+				possibleCards[rarity].append(carddata[0]['name'])
 
 		#Some sets don't have basic lands, but need them in their boosterpacks (Gatecrash f.i.) Fix that
 		#TODO: Handle rarities properly, a 'land' shouldn't be a 'basic land' but a land from that set
@@ -626,7 +642,7 @@ class Command(CommandTemplate):
 
 	def getLatestVersionNumber(self):
 		try:
-			latestVersion = requests.get("http://mtgjson.com/json/version.json", timeout=10.0).text
+			latestVersion = SharedFunctions.httpGet("http://mtgjson.com/json/version.json", timeout=10.0).text
 		except requests.exceptions.Timeout:
 			self.logError("[MTG] Fetching card version timed out")
 			return (False, "Fetching online card version took too long")
@@ -664,14 +680,24 @@ class Command(CommandTemplate):
 		return False
 
 	def updateCardFile(self, shouldUpdateDefinitions=True):
+		#Inform everything that we're going to be changing the card files
+		self.areCardfilesInUse = True
+		try:
+			#Parsing all the card data takes a while, do it in a separate process so the bots keep responding in the meantime
+			success, replytext = self.runInProcess(self.rebuildCardFiles, shouldUpdateDefinitions)
+		finally:
+			self.areCardfilesInUse = False
+		if success:
+			self.loadIndexedCardStore()
+		return (success, replytext)
+
+	def rebuildCardFiles(self, shouldUpdateDefinitions=True):
 		starttime = time.time()
 		cardStoreFilename = os.path.join(GlobalStore.scriptfolder, 'data', 'MTGcards.json')
-		gamewideCardStoreFilename = os.path.join(GlobalStore.scriptfolder, 'data', 'MTGcards_gamewide.json')
+		rebuildDatabaseFilename = os.path.join(GlobalStore.scriptfolder, 'data', 'MTGcards_rebuild.db')
 		setStoreFilename = os.path.join(GlobalStore.scriptfolder, 'data', 'MTGsets.json')
 		definitionsFilename = os.path.join(GlobalStore.scriptfolder, 'data', 'MTGdefinitions.json')
 
-		#Inform everything that we're going to be changing the card files
-		self.areCardfilesInUse = True
 		self.logInfo("[MtG] Updating card database!")
 
 		#Download the wrongly-formatted (for our purposes) card data
@@ -680,12 +706,12 @@ class Command(CommandTemplate):
 			return (False, result)
 		else:
 			cardDatasetFilename = result
+		stageStarttime = self.logRebuildStageTime("Downloading the card dataset", starttime)
 
-		#Set up the dicts we're going to store our data in
-		newcardstore = {}
+		#Set up the dict we're going to store the set data in. That's small enough to keep in memory, the card data isn't
 		setstore = {'_setsWithBoosterpacks': []}
-		#Since definitions from cards get written to file immediately, just keep a list of which keywords we already stored
-		definitions = []
+		#Since definitions from cards get written to file immediately, just keep a set of which keywords we already stored
+		definitions = set()
 		#Lists of what to do with certain set keys
 		setKeysToRemove = ('border', 'magicRaritiesCodes', 'mkm_id', 'mkm_name', 'oldCode', 'onlineOnly', 'translations')
 		raritiesToRemove = ('checklist', 'double faced', 'draft-matters', 'foil', 'marketing', 'power nine', 'timeshifted purple')
@@ -710,230 +736,261 @@ class Command(CommandTemplate):
 			text = re.sub(' {2,}', ' ', text).strip()
 			return text
 
-		#Reference to a temporary file where we will store gamewide JSON-parsed card info (Like card text, CMC)
-		# This way we don't have to keep that in memory during the entire loop
-		# Keys will be lower()'ed cardnames, values will be a dict of the card's fields that are true regardless of the set the card is in
-		gamewideCardStoreFile = open(gamewideCardStoreFilename, 'w')
-
+		#The card data from all the sets gets merged in a temporary database on disk, so memory use doesn't grow with the number of cards
+		# 'gamewide' has the card fields that are true regardless of the set the card is in (like card text, CMC), in the order the cards were found
+		# 'card_sets' has the set-specific data of each card. Both are keyed on the lower()'ed cardname
+		if os.path.exists(rebuildDatabaseFilename):
+			os.remove(rebuildDatabaseFilename)
+		rebuildDatabase = sqlite3.connect(rebuildDatabaseFilename)
 		#Write each keyword we find to the definitions file so we don't have to keep it in memory
-		if shouldUpdateDefinitions:
-			definitionsFile = open(definitionsFilename, 'w')
-
-		#Go through each file in the sets zip (Saves memory compared to downloading the single file with all the sets)
-		with zipfile.ZipFile(cardDatasetFilename, 'r') as setfilesZip:
-			#Go through each file in the sets zip
-			for setfilename in setfilesZip.namelist():
-				# Keep numbers as strings, saves on converting them back later
-				setData = json.loads(setfilesZip.read(setfilename), parse_int=lambda x: x, parse_float=lambda x: x)
-				#Put the cardlist in a separate variable, so we can store all the set information easily
-				cardlist = setData.pop('cards')
-				#Clean up the set data a bit
-				for setKeyToRemove in setKeysToRemove:
-					if setKeyToRemove in setData:
-						del setData[setKeyToRemove]
-				#The 'booster' set field is a bit verbose, make that shorter and easier to use
-				if 'booster' in setData:
-					originalBoosterList = setData.pop('booster')
-					countedBoosterData = {}
-					try:
-						for rarity in originalBoosterList:
-							#If the entry is a list, it's a list of possible choices for that card
-							#  ('['rare', 'mythic rare']' means a booster pack contains a rare OR a mythic rare)
-							if isinstance(rarity, list):
-								#Remove useless options here too
-								for rarityToRemove in raritiesToRemove:
-									if rarityToRemove in rarity:
-										rarity.remove(rarityToRemove)
-								#Rename 'wrongly' named rarites
-								for r in raritiesToRename:
-									if r in rarity:
-										rarity.remove(r)
-										rarity.append(raritiesToRename[r])
-								#Check if any of the choices have a prefix that needs to be removed (use a copy so we can delete elements in the loop)
-								for choice in rarity[:]:
-									for rp in rarityPrefixesToRemove:
-										if choice.startswith(rp):
-											#Remove the original choice...
-											rarity.remove(choice)
-											newRarity = choice[rarityPrefixesToRemove[rp]:]
-											#...and put in the choice without the prefix, if it's not there already
-											if newRarity not in rarity:
-												rarity.append(newRarity)
-								#If we removed all options and just have an empty list now, replace it with a rare
-								if len(rarity) == 0:
-									rarity = 'rare'
-								#If we've removed all but one option, it's not a choice anymore, so treat it like a 'normal' rarity
-								elif len(rarity) == 1:
-									rarity = rarity[0]
-								else:
-									#If it's still a list, keep it like that
-									if '_choice' not in countedBoosterData:
-										countedBoosterData['_choice'] = [rarity]
+		definitionsFile = open(definitionsFilename, 'w') if shouldUpdateDefinitions else None
+		try:
+			#It's a temporary database that gets rebuilt if something goes wrong, so don't spend time on keeping it safe from crashes
+			rebuildDatabase.execute("PRAGMA journal_mode = OFF")
+			rebuildDatabase.execute("PRAGMA synchronous = OFF")
+			rebuildDatabase.execute("CREATE TABLE gamewide (id INTEGER PRIMARY KEY, cardname TEXT NOT NULL UNIQUE, data TEXT NOT NULL)")
+			rebuildDatabase.execute("CREATE TABLE card_sets (cardname TEXT NOT NULL, setname TEXT NOT NULL, data TEXT NOT NULL, PRIMARY KEY (cardname, setname))")
+			cardCount = 0
+
+			#Go through each file in the sets zip (Saves memory compared to downloading the single file with all the sets)
+			with zipfile.ZipFile(cardDatasetFilename, 'r') as setfilesZip:
+				#Go through each file in the sets zip, only one set is in memory at a time
+				setfilenames = setfilesZip.namelist()
+				for setfileIndex, setfilename in enumerate(setfilenames):
+					# Keep numbers as strings, saves on converting them back later
+					setData = json.loads(setfilesZip.read(setfilename), parse_int=lambda x: x, parse_float=lambda x: x)
+					#Put the cardlist in a separate variable, so we can store all the set information easily
+					cardlist = setData.pop('cards')
+					#Clean up the set data a bit
+					for setKeyToRemove in setKeysToRemove:
+						if setKeyToRemove in setData:
+							del setData[setKeyToRemove]
+					#The 'booster' set field is a bit verbose, make that shorter and easier to use
+					if 'booster' in setData:
+						originalBoosterList = setData.pop('booster')
+						countedBoosterData = {}
+						try:
+							for rarity in originalBoosterList:
+								#If the entry is a list, it's a list of possible choices for that card
+								#  ('['rare', 'mythic rare']' means a booster pack contains a rare OR a mythic rare)
+								if isinstance(rarity, list):
+									#Remove useless options here too
+									for rarityToRemove in raritiesToRemove:
+										if rarityToRemove in rarity:
+											rarity.remove(rarityToRemove)
+									#Rename 'wrongly' named rarites
+									for r in raritiesToRename:
+										if r in rarity:
+											rarity.remove(r)
+											rarity.append(raritiesToRename[r])
+									#Check if any of the choices have a prefix that needs to be removed (use a copy so we can delete elements in the loop)
+									for choice in rarity[:]:
+										for rp in rarityPrefixesToRemove:
+											if choice.startswith(rp):
+												#Remove the original choice...
+												rarity.remove(choice)
+												newRarity = choice[rarityPrefixesToRemove[rp]:]
+												#...and put in the choice without the prefix, if it's not there already
+												if newRarity not in rarity:
+													rarity.append(newRarity)
+									#If we removed all options and just have an empty list now, replace it with a rare
+									if len(rarity) == 0:
+										rarity = 'rare'
+									#If we've removed all but one option, it's not a choice anymore, so treat it like a 'normal' rarity
+									elif len(rarity) == 1:
+										rarity = rarity[0]
 									else:
-										countedBoosterData['_choice'].append(rarity)
-									#...but don't do any of the other stuff
+										#If it's still a list, keep it like that
+										if '_choice' not in countedBoosterData:
+											countedBoosterData['_choice'] = [rarity]
+										else:
+											countedBoosterData['_choice'].append(rarity)
+										#...but don't do any of the other stuff
+										continue
+								#Some keys are dumb and useless ('marketing'). Ignore those
+								if rarity in raritiesToRemove:
 									continue
-							#Some keys are dumb and useless ('marketing'). Ignore those
-							if rarity in raritiesToRemove:
-								continue
-							#Here the rarity for a basic land is called 'land', while in the cards themselves it's 'basic land'. Correct that
-							for rarityToRename in raritiesToRename:
-								if rarity == rarityToRename:
-									rarity = raritiesToRename[rarity]
-							#Remove any useless prefixes like 'foil'
-							for rp in rarityPrefixesToRemove:
-								if rarity.startswith(rp):
-									rarity = rarity[rarityPrefixesToRemove[rp]:]
-							#Finally, count the rarity
-							if rarity not in countedBoosterData:
-								countedBoosterData[rarity] = 1
-							else:
-								countedBoosterData[rarity] += 1
-					except Exception as e:
-						self.logError("Error while parsing booster field of set '{}' ({}): {!r}".format(setData['name'], setfilename, e))
-					else:
-						#If no parsing error occurred, add the parsed booster data
-						setData['booster'] = countedBoosterData
-						# Keep a list of sets that have booster packs
-						setstore['_setsWithBoosterpacks'].append(setData['name'].lower())
-				setstore[setData['name'].lower()] = setData
-
-				#Pop off cards when we need them, to save on memory
-				for cardcount in xrange(0, len(cardlist)):
-					card = cardlist.pop()
-					cardname = card['name'].lower()  #lowering the keys makes searching easier later, especially when comparing against the literal searchstring
-
-					#Make flavor text read better
-					if 'flavor' in card:
-						card['flavor'] = formatNicer(card['flavor'])
-					#New and already listed cards need their set info stored
-					#TODO: Some sets have multiple cards with the same name but a different artist (f.i. land cards). Handle that
-					setSpecificCardData = {}
-					for setSpecificKey in setSpecificCardKeys:
-						if setSpecificKey in card:
-							setSpecificCardData[setSpecificKey] = card.pop(setSpecificKey)
-					#Don't add it to newcardstore yet, so we can check if it's in there already or not
-					# But do the loop now so the set-specific keys are removed from the card dict
-
-					#If the card isn't in the store yet, parse its data
-					if cardname not in newcardstore:
-						#Remove some useless data to save some space, memory and time
-						for keyToRemove in keysToRemove:
-							if keyToRemove in card:
-								del card[keyToRemove]
-
-						#No need to store there's nothing special about the card's layout or if the special-ness is already evident from the text
-						if card['layout'] in layoutTypesToRemove:
-							del card['layout']
-
-						#The 'Colors' field benefits from some ordering, for readability.
-						if 'colors' in card:
-							card['colors'] = sorted(card['colors'])
-
-						#Remove the current card from the list of names this card also contains (for flip cards)
-						# (Saves on having to remove it later, and the presence of this field shows it's in there too)
-						if 'names' in card:
-							card['names'].remove(card['name'])
-
-						#Make sure all stored values are strings, that makes searching later much easier
-						for attrib in listKeysToMakeString:
-							if attrib in card:
-								card[attrib] = u"; ".join(card[attrib])
-
-						#Make 'manaCost' lowercase, since we make the searchstring lowercase too, and we don't want to miss this
-						if 'manaCost' in card:
-							card['manacost'] = card['manaCost']
-							del card['manaCost']
-
-						#Get possible term definitions from this card's text, if needed
-						if shouldUpdateDefinitions and 'text' in card:
-							definitionsFromCard = self.parseKeywordDefinitionsFromCardText(card['text'], card['name'], definitions)
-							#Write the found definitions to file immediately, and store that we found them
-							for term, definition in definitionsFromCard.iteritems():
-								definitionsFile.write(json.dumps({term: definition}))
-								definitionsFile.write('\n')
-								definitions.append(term)
-
-						#Clean text up a bit to make it display better
-						for keyToFormat in keysToFormatNicer:
-							if keyToFormat in card:
-								card[keyToFormat] = formatNicer(card[keyToFormat])
-
-						#To make searching easier later, without all sorts of key checking, make sure the 'text' key always exists
-						if 'text' not in card:
-							card['text'] = u""
-
-						#Save the data to file for now, we'll add all the set-specific data later
-						gamewideCardStoreFile.write(json.dumps({cardname: card}))
-						gamewideCardStoreFile.write('\n')
-
-						#Store that we already parsed the gamewide card data, and make a dict for the set-specific data
-						newcardstore[cardname] = {}
-
-					#NOW store the set-specific info in the cardstore, so we can be sure the dict exists
-					newcardstore[cardname][setData['name']] = setSpecificCardData
-
-				#Don't hog the execution thread for too long, give it up after each set
-				gevent.idle()
-
-		#Make sure all the data is flushed to disk
-		gamewideCardStoreFile.close()
-
-		#First delete the original files
-		if os.path.exists(cardStoreFilename):
-			os.remove(cardStoreFilename)
-		if os.path.exists(setStoreFilename):
-			os.remove(setStoreFilename)
-		#Save the new databases to disk
-		with open(cardStoreFilename, 'w') as cardfile:
-			gamewideCardStoreFile = open(gamewideCardStoreFilename, 'r')
-			#Go through each card's game-wide data and append the set-specific data to it
-			for line in gamewideCardStoreFile:
-				cardname, gamewideCardData = json.loads(line).popitem()
-				#Write each card's as a separate JSON file so we can go through it line by line instead of having to load it all at once
-				cardfile.write(json.dumps({cardname: [gamewideCardData, newcardstore.pop(cardname)]}))
-				cardfile.write('\n')
-			gamewideCardStoreFile.close()
-		with open(setStoreFilename, 'w') as setsfile:
-			setsfile.write(json.dumps(setstore))
-
-		#We don't need the temporary gamewide card data file anymore
-		os.remove(gamewideCardStoreFilename)
-
-		#We don't need the card info in memory anymore, hopefully this way the memory used get freed
-		del setstore
-
-		#Store the new version data
-		with open(os.path.join(GlobalStore.scriptfolder, 'data', 'MTGversion.json'), 'w') as versionFile:
-			versionFile.write(json.dumps({'formatVersion': self.dataFormatVersion, 'dataVersion': self.getLatestVersionNumber()[1], 'lastUpdateTime': time.time()}))
-
-		replytext = "MtG card database successfully updated (Changelog: http://mtgjson.com/changelog.html)"
-		if shouldUpdateDefinitions:
-			#Download the definitions too, and add them to the definitions we found in the card texts
-			success, downloadedDefinitions = self.downloadDefinitions(definitions)
-			if success:
-				replytext += ", definitions also updated"
-			else:
-				replytext += ", but an error occurred when trying to download the definitions, check the logs for the error"
-			#Save the definitions to file
-			for term, definition in downloadedDefinitions.iteritems():
-				definitionsFile.write(json.dumps({term: definition}))
-				definitionsFile.write('\n')
-			#And (try to) clean up the memory used
-			del definitions
-			del downloadedDefinitions
+								#Here the rarity for a basic land is called 'land', while in the cards themselves it's 'basic land'. Correct that
+								for rarityToRename in raritiesToRename:
+									if rarity == rarityToRename:
+										rarity = raritiesToRename[rarity]
+								#Remove any useless prefixes like 'foil'
+								for rp in rarityPrefixesToRemove:
+									if rarity.startswith(rp):
+										rarity = rarity[rarityPrefixesToRemove[rp]:]
+								#Finally, count the rarity
+								if rarity not in countedBoosterData:
+									countedBoosterData[rarity] = 1
+								else:
+									countedBoosterData[rarity] += 1
+						except Exception as e:
+							self.logError("Error while parsing booster field of set '{}' ({}): {!r}".format(setData['name'], setfilename, e))
+						else:
+							#If no parsing error occurred, add the parsed booster data
+							setData['booster'] = countedBoosterData
+							# Keep a list of sets that have booster packs
+							setstore['_setsWithBoosterpacks'].append(setData['name'].lower())
+					setstore[setData['name'].lower()] = setData
+
+					#Pop off cards when we need them, to save on memory
+					for cardcount in xrange(0, len(cardlist)):
+						card = cardlist.pop()
+						cardname = card['name'].lower()  #lowering the keys makes searching easier later, especially when comparing against the literal searchstring
+
+						#Make flavor text read better
+						if 'flavor' in card:
+							card['flavor'] = formatNicer(card['flavor'])
+						#New and already listed cards need their set info stored
+						#TODO: Some sets have multiple cards with the same name but a different artist (f.i. land cards). Handle that
+						setSpecificCardData = {}
+						for setSpecificKey in setSpecificCardKeys:
+							if setSpecificKey in card:
+								setSpecificCardData[setSpecificKey] = card.pop(setSpecificKey)
+						#Don't store the card yet, so we can check if it's been stored already or not
+						# But do the loop now so the set-specific keys are removed from the card dict
+
+						#If the card isn't in the store yet, parse its data
+						if rebuildDatabase.execute("SELECT 1 FROM gamewide WHERE cardname = ?", (cardname,)).fetchone() is None:
+							#Remove some useless data to save some space, memory and time
+							for keyToRemove in keysToRemove:
+								if keyToRemove in card:
+									del card[keyToRemove]
+
+							#No need to store there's nothing special about the card's layout or if the special-ness is already evident from the text
+							if card['layout'] in layoutTypesToRemove:
+								del card['layout']
+
+							#The 'Colors' field benefits from some ordering, for readability.
+							if 'colors' in card:
+								card['colors'] = sorted(card['colors'])
+
+							#Remove the current card from the list of names this card also contains (for flip cards)
+							# (Saves on having to remove it later, and the presence of this field shows it's in there too)
+							if 'names' in card:
+								card['names'].remove(card['name'])
+
+							#Make sure all stored values are strings, that makes searching later much easier
+							for attrib in listKeysToMakeString:
+								if attrib in card:
+									card[attrib] = u"; ".join(card[attrib])
+
+							#Make 'manaCost' lowercase, since we make the searchstring lowercase too, and we don't want to miss this
+							if 'manaCost' in card:
+								card['manacost'] = card['manaCost']
+								del card['manaCost']
+
+							#Get possible term definitions from this card's text, if needed
+							if shouldUpdateDefinitions and 'text' in card:
+								definitionsFromCard = self.parseKeywordDefinitionsFromCardText(card['text'], card['name'], definitions)
+								#Write the found definitions to file immediately, and store that we found them
+								for term, definition in definitionsFromCard.iteritems():
+									definitionsFile.write(json.dumps({term: definition}))
+									definitionsFile.write('\n')
+									definitions.add(term)
+
+							#Clean text up a bit to make it display better
+							for keyToFormat in keysToFormatNicer:
+								if keyToFormat in card:
+									card[keyToFormat] = formatNicer(card[keyToFormat])
+
+							#To make searching easier later, without all sorts of key checking, make sure the 'text' key always exists
+							if 'text' not in card:
+								card['text'] = u""
+
+							#Store the data for now, we'll add all the set-specific data later. This also stores that we already parsed the gamewide card data
+							rebuildDatabase.execute("INSERT INTO gamewide (cardname, data) VALUES (?, ?)", (cardname, json.dumps(card)))
+							cardCount += 1
+
+						#NOW store the set-specific info. If a set has multiple cards with the same name, the last one is kept
+						rebuildDatabase.execute("INSERT OR REPLACE INTO card_sets (cardname, setname, data) VALUES (?, ?, ?)", (cardname, setData['name'], json.dumps(setSpecificCardData)))
+
+					if (setfileIndex + 1) % 25 == 0:
+						self.logInfo("[MtG] Parsed {:,} of {:,} sets, found {:,} cards so far".format(setfileIndex + 1, len(setfilenames), cardCount))
+					#Don't hog the execution thread for too long, give it up after each set
+					gevent.idle()
+
+			#Make sure all the data is stored
+			rebuildDatabase.commit()
+			stageStarttime = self.logRebuildStageTime(u"Parsing {:,} cards from {:,} sets".format(cardCount, len(setfilenames)), stageStarttime)
+
+			#First delete the original files
+			if os.path.exists(cardStoreFilename):
+				os.remove(cardStoreFilename)
+			if os.path.exists(setStoreFilename):
+				os.remove(setStoreFilename)
+			#Save the new databases to disk
+			with open(cardStoreFilename, 'w') as cardfile:
+				def writeCard(cardname, carddata):
+					#Write each card's as a separate JSON file so we can go through it line by line instead of having to load it all at once
+					cardfile.write(json.dumps({cardname: carddata}))
+					cardfile.write('\n')
+				#Go through each card's game-wide data in the order they were found, and append the set-specific data to it
+				# The rows of each card come one after the other, so only one card needs to be in memory at a time
+				cardnameToWrite = None
+				carddataToWrite = None
+				for cardname, gamewideCardData, setname, setSpecificCardData in rebuildDatabase.execute("SELECT gamewide.cardname, gamewide.data, card_sets.setname, card_sets.data "
+																										  "FROM gamewide JOIN card_sets ON card_sets.cardname = gamewide.cardname ORDER BY gamewide.id"):
+					if cardname != cardnameToWrite:
+						if carddataToWrite:
+							writeCard(cardnameToWrite, carddataToWrite)
+						cardnameToWrite = cardname
+						carddataToWrite = [json.loads(gamewideCardData), {}]
+					carddataToWrite[1][setname] = json.loads(setSpecificCardData)
+				if carddataToWrite:
+					writeCard(cardnameToWrite, carddataToWrite)
+			#We don't need the temporary database anymore
+			rebuildDatabase.close()
+			os.remove(rebuildDatabaseFilename)
+			with open(setStoreFilename, 'w') as setsfile:
+				setsfile.write(json.dumps(setstore))
+			stageStarttime = self.logRebuildStageTime("Writing the card and set files", stageStarttime)
+
+			#Cards get looked up by line number, store where each line starts so that doesn't require reading the whole file
+			SharedFunctions.writeLineIndex(cardStoreFilename)
+			stageStarttime = self.logRebuildStageTime("Writing the card file line index", stageStarttime)
+			if self.useCardDatabase:
+				CardDatabase.build(cardStoreFilename, os.path.join(GlobalStore.scriptfolder, 'data', 'MTGcards.db'))
+				stageStarttime = self.logRebuildStageTime("Building the card database", stageStarttime)
+
+			#Store the new version data
+			with open(os.path.join(GlobalStore.scriptfolder, 'data', 'MTGversion.json'), 'w') as versionFile:
+				versionFile.write(json.dumps({'formatVersion': self.dataFormatVersion, 'dataVersion': self.getLatestVersionNumber()[1], 'lastUpdateTime': time.time()}))
+
+			replytext = "MtG card database successfully updated (Changelog: http://mtgjson.com/changelog.html)"
+			if shouldUpdateDefinitions:
+				#Download the definitions too, and add them to the definitions we found in the card texts
+				success, downloadedDefinitions = self.downloadDefinitions(definitions)
+				if success:
+					replytext += ", definitions also updated"
+				else:
+					replytext += ", but an error occurred when trying to download the definitions, check the logs for the error"
+				#Save the definitions to file
+				for term, definition in downloadedDefinitions.iteritems():
+					definitionsFile.write(json.dumps({term: definition}))
+					definitionsFile.write('\n')
+				definitionsFile.close()
+				SharedFunctions.writeLineIndex(definitionsFilename)
+				stageStarttime = self.logRebuildStageTime(u"Downloading definitions, {:,} in total".format(len(definitions) + len(downloadedDefinitions)), stageStarttime)
+		finally:
+			#Don't leave the temporary database or an open definitions file behind, also not if something went wrong halfway through
+			rebuildDatabase.close()
+			if os.path.exists(rebuildDatabaseFilename):
+				os.remove(rebuildDatabaseFilename)
+			if definitionsFile:
+				definitionsFile.close()
 
 		#Since we don't need the cardfile anymore now, delete it
 		os.remove(cardDatasetFilename)
 
-		#Updating apparently uses up RAM that Python doesn't clear up soon or properly. Force it to
-		re.purge()
-		gc.collect()
-
-		self.areCardfilesInUse = False
 		self.logInfo("[MtG] updating database took {} seconds".format(time.time() - starttime))
 		return (True, replytext)
 
+	def logRebuildStageTime(self, stageDescription, stageStarttime):
+		"""Logs how long a stage of the card database update took, and returns the current time so it can be used as the start time of the next stage"""
+		now = time.time()
+		self.logInfo(u"[MtG] {} took {:.2f} seconds".format(stageDescription, now - stageStarttime))
+		return now
+
 	@staticmethod
 	def parseKeywordDefinitionsFromCardText(cardtext, cardname, existingDefinitions=None):
 		newDefinitions = {}
@@ -986,7 +1043,7 @@ class Command(CommandTemplate):
 			("http://mtgsalvation.gamepedia.com/List_of_Magic_slang", "mw-body")]
 		try:
 			for url, section in definitionSources:
-				defHeaders = BeautifulSoup(requests.get(url, timeout=10.0).text.replace('\n', ''), 'html.parser').find(class_=section).find_all(['h3', 'h4'])
+				defHeaders = BeautifulSoup(SharedFunctions.httpGet(url, timeout=10.0).text.replace('\n', ''), 'html.parser').find(class_=section).find_all(['h3', 'h4'])
 				for defHeader in defHeaders:
 					keyword = defHeader.find(class_='mw-headline').text.lower()
 					#On MTGSalvation, sections are sorted into alphabetized subsections. Ignore the letter headers
@@ -1017,3 +1074,373 @@ class Command(CommandTemplate):
 				self.logError(" no request attribute found")
 			return (False, newDefinitions)
 		return (True, newDefinitions)
+
+
+class IndexedCardStore(object):
+	"""
+	All the cards from the card file, parsed once and kept in memory, so a search doesn't have to read and parse the entire card file again.
+	Has indexes from the lowercase words in the name, type and text of the cards to the cards containing them, and from each set name and rarity to the cards in that set or with that rarity.
+	Cards are referred to by their line number in the card file, which is also their position in 'cards'
+	"""
+	indexedCardKeys = ('name', 'type', 'text')
+	setSpecificKeys = ('artist', 'flavor', 'multiverseid', 'number', 'rarity', 'watermark')
+	wordRegex = re.compile(r"\w+", re.UNICODE)
+	linesBetweenIdles = 250  #How many cards to load before letting the other greenlets run
+
+	def __init__(self):
+		self.cards = []  #A list of '[card data, set data]' lists
+		self.wordIndexes = {cardKey: {} for cardKey in self.indexedCardKeys}  #Keys are the card keys, values are dicts with words as keys and lists of line numbers as values
+		self.setIndex = {}  #Keys are set names, values are lists of the line numbers of the cards in that set
+		self.rarityIndex = {}  #Keys are rarities, values are lists of the line numbers of the cards that have that rarity in at least one set
+
+	@classmethod
+	def loadFromFile(cls, cardFilename):
+		indexedCardStore = cls()
+		for lineNumber, carddata in cls.readCardFile(cardFilename):
+			indexedCardStore.addCard(lineNumber, carddata)
+			#Loading takes a while, don't block the bots until it's done
+			if lineNumber % cls.linesBetweenIdles == 0:
+				gevent.idle()
+		return indexedCardStore
+
+	@staticmethod
+	def readCardFile(cardFilename):
+		"""Yields a (line number, card data) tuple for each card in the card file"""
+		with open(cardFilename, 'r') as cardFile:
+			for lineNumber, cardline in enumerate(cardFile):
+				yield (lineNumber, json.loads(cardline).popitem()[1])
+
+	def addCard(self, lineNumber, carddata):
+		self.cards.append(carddata)
+		for cardKey in self.indexedCardKeys:
+			if cardKey in carddata[0]:
+				wordIndex = self.wordIndexes[cardKey]
+				for word in set(self.wordRegex.findall(carddata[0][cardKey].lower())):
+					if word in wordIndex:
+						wordIndex[word].append(lineNumber)
+					else:
+						wordIndex[word] = [lineNumber]
+		rarities = set()
+		for setname, setSpecificCardData in carddata[1].iteritems():
+			if setname in self.setIndex:
+				self.setIndex[setname].append(lineNumber)
+			else:
+				self.setIndex[setname] = [lineNumber]
+			if 'rarity' in setSpecificCardData:
+				rarities.add(setSpecificCardData['rarity'])
+		for rarity in rarities:
+			if rarity in self.rarityIndex:
+				self.rarityIndex[rarity].append(lineNumber)
+			else:
+				self.rarityIndex[rarity] = [lineNumber]
+
+	@staticmethod
+	def getLineNumbersFromIndex(index, isMatchingKey):
+		lineNumbers = set()
+		for key, keyLineNumbers in index.iteritems():
+			if isMatchingKey(key):
+				lineNumbers.update(keyLineNumbers)
+		return lineNumbers
+
+	def search(self, regexDict, searchPlan=None):
+		"""
+		Returns a dict with the names of the cards that match all the regexes as keys, and as values a tuple with the line number of the card
+		 and a list of the sets that matched, or None if all of the card's sets matched
+		"""
+		if not searchPlan:
+			searchPlan = CardSearchPlan(regexDict, self)
+		lineNumbersToCheck = xrange(len(self.cards)) if searchPlan.candidateLineNumbers is None else searchPlan.candidateLineNumbers
+		matchingCards = {}
+		for lineNumber in lineNumbersToCheck:
+			carddata = self.cards[lineNumber]
+			matchingSetnames = searchPlan.getMatchingSetnames(carddata)
+			if matchingSetnames:
+				matchingCards[carddata[0]['name']] = (lineNumber, None if len(matchingSetnames) == len(carddata[1]) else matchingSetnames)
+		return matchingCards
+
+
+class CardSearchPlan(object):
+	"""
+	Decides how to check whether a card matches a search, so that as few regexes as possible have to run:
+	 - Each regex gets the literal text any match has to contain ('legendary.+creature' needs 'legendary' and 'creature'), and a quick 'in' check for those runs before the regex
+	 - Set names and rarities only get checked against their regex once, after that it's just a lookup per card
+	 - With an IndexedCardStore, its indexes pick the only cards that can match, and the checks get ordered so the ones that let the fewest cards of a sample through run first
+	"""
+	sampleSize = 250
+
+	def __init__(self, regexDict, indexedCardStore=None):
+		self.setRegex = regexDict.get('set', None)
+		self.rarityRegex = regexDict.get('rarity', None)
+		#Keys are 'set' and 'rarity', values are dicts with set names or rarities as keys and whether they match as values. Filled in as values get checked
+		self.valueMatches = {'set': {}, 'rarity': {}}
+		self.candidateLineNumbers = None  #A set with the line numbers of the only cards that can match, or None if all of them need to be checked
+		#A list of (attribute, whether it's a set-specific attribute, required lowercase literals, regex) tuples, in the order they should be checked
+		self.checks = []
+		for attrib, regex in regexDict.iteritems():
+			if attrib not in ('set', 'rarity'):
+				self.checks.append((attrib, attrib in IndexedCardStore.setSpecificKeys, self.getRequiredLiterals(regex), regex))
+		self.passRates = {}  #Keys are attributes, values are the part of the sample that passed that attribute's check
+		#Until there's a sample, assume that checks with longer literal text reject more cards
+		self.checks.sort(key=lambda check: -max(len(literal) for literal in check[2]) if check[2] else 0)
+		if indexedCardStore:
+			self.useIndexes(indexedCardStore)
+		CommandTemplate.logDebug(u"[MtG] Search plan: {}".format(self.describe(len(indexedCardStore.cards) if indexedCardStore else None)))
+
+	@staticmethod
+	def getRequiredLiterals(regex):
+		"""Returns a list of the lowercase pieces of text that anything the regex matches has to contain"""
+		literals = []
+		currentLiteral = []
+
+		def endCurrentLiteral():
+			if currentLiteral:
+				literals.append(u"".join(currentLiteral).lower())
+				del currentLiteral[:]
+
+		def addLiteralsFromPattern(parsedPattern):
+			for opcode, value in parsedPattern:
+				if opcode == sre_constants.LITERAL:
+					currentLiteral.append(unichr(value))
+				elif opcode == sre_constants.SUBPATTERN:
+					#A group is matched in place, so its text continues the text before it
+					addLiteralsFromPattern(value[1])
+				elif opcode in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT) and value[0] >= 1:
+					#Something that has to be there at least once, but it could be repeated, so it's separate from the text around it
+					endCurrentLiteral()
+					addLiteralsFromPattern(value[2])
+					endCurrentLiteral()
+				else:
+					#Anything else ('.', '[abc]', 'a|b', optional parts) could match different text, so it ends the literal text
+					endCurrentLiteral()
+
+		addLiteralsFromPattern(sre_parse.parse(regex.pattern, regex.flags))
+		endCurrentLiteral()
+		return literals
+
+	def useIndexes(self, indexedCardStore):
+		candidateLineNumberSets = []
+		#There aren't that many sets and rarities, so check the regex against all of them once, and use the indexes to get the cards
+		if self.setRegex:
+			candidateLineNumberSets.append(indexedCardStore.getLineNumbersFromIndex(indexedCardStore.setIndex, lambda setname: self.doesValueMatch('set', setname)))
+		if self.rarityRegex:
+			candidateLineNumberSets.append(indexedCardStore.getLineNumbersFromIndex(indexedCardStore.rarityIndex, lambda rarity: self.doesValueMatch('rarity', rarity)))
+		#Literal text can start or end in the middle of a word ('ooze' should find 'Oozeling'), so look for indexed words that contain each word of the literal
+		for attrib, isSetSpecific, literals, regex in self.checks:
+			if attrib in indexedCardStore.indexedCardKeys:
+				for literal in literals:
+					for literalWord in set(indexedCardStore.wordRegex.findall(literal)):
+						candidateLineNumberSets.append(indexedCardStore.getLineNumbersFromIndex(indexedCardStore.wordIndexes[attrib], lambda word: literalWord in word))
+		if candidateLineNumberSets:
+			#Start with the smallest set, that keeps the intersections small
+			candidateLineNumberSets.sort(key=len)
+			self.candidateLineNumbers = candidateLineNumberSets[0]
+			for lineNumbers in candidateLineNumberSets[1:]:
+				self.candidateLineNumbers.intersection_update(lineNumbers)
+
+		#Find out how selective each check is on an evenly spread sample of the cards that are left. Only worth it if there are a lot more cards to check than the sample size
+		cardsToCheckCount = len(indexedCardStore.cards) if self.candidateLineNumbers is None else len(self.candidateLineNumbers)
+		if len(self.checks) > 1 and cardsToCheckCount >= self.sampleSize * 4:
+			if self.candidateLineNumbers is None:
+				sampleLineNumbers = xrange(0, len(indexedCardStore.cards), max(1, len(indexedCardStore.cards) // self.sampleSize))
+			else:
+				sampleLineNumbers = list(self.candidateLineNumbers)[::max(1, len(self.candidateLineNumbers) // self.sampleSize)]
+			sample = [indexedCardStore.cards[lineNumber] for lineNumber in sampleLineNumbers]
+			for check in self.checks:
+				passCount = 0
+				for carddata in sample:
+					if self.doesCardPassCheck(carddata, check):
+						passCount += 1
+				self.passRates[check[0]] = float(passCount) / len(sample) if sample else 0.0
+			self.checks.sort(key=lambda check: self.passRates[check[0]])
+
+	def doesValueMatch(self, attrib, value):
+		"""Checks whether the set name or rarity matches the searched one, checking each value against the regex only once"""
+		knownMatches = self.valueMatches[attrib]
+		isMatch = knownMatches.get(value, None)
+		if isMatch is None:
+			isMatch = (self.setRegex if attrib == 'set' else self.rarityRegex).search(value) is not None
+			knownMatches[value] = isMatch
+		return isMatch
+
+	@staticmethod
+	def doesTextMatch(text, literals, regex):
+		if literals:
+			lowercaseText = text.lower()
+			for literal in literals:
+				if literal not in lowercaseText:
+					return False
+		return regex.search(text) is not None
+
+	def doesCardPassCheck(self, carddata, check):
+		attrib, isSetSpecific, literals, regex = check
+		if isSetSpecific:
+			for setSpecificCardData in carddata[1].itervalues():
+				if attrib in setSpecificCardData and self.doesTextMatch(setSpecificCardData[attrib], literals, regex):
+					return True
+			return False
+		return attrib in carddata[0] and self.doesTextMatch(carddata[0][attrib], literals, regex)
+
+	def getMatchingSetnames(self, carddata):
+		"""Returns a list of the sets for which the card matches all the searched attributes, or an empty list if the card doesn't match"""
+		card, sets = carddata
+		#Check the set name and rarity first, since those are just lookups
+		if self.setRegex:
+			setnames = [setname for setname in sets if self.doesValueMatch('set', setname)]
+			if len(setnames) == 0:
+				return []
+		else:
+			setnames = sets.keys()
+		if self.rarityRegex:
+			setnames = [setname for setname in setnames if 'rarity' in sets[setname] and self.doesValueMatch('rarity', sets[setname]['rarity'])]
+			if len(setnames) == 0:
+				return []
+		for attrib, isSetSpecific, literals, regex in self.checks:
+			#Some data is stored in the card data, some in the set data, because it differs per set (artist etc)
+			if isSetSpecific:
+				setnames = [setname for setname in setnames if attrib in sets[setname] and self.doesTextMatch(sets[setname][attrib], literals, regex)]
+				if len(setnames) == 0:
+					return []
+			elif attrib not in card or not self.doesTextMatch(card[attrib], literals, regex):
+				return []
+		return setnames
+
+	def describe(self, cardCount=None):
+		if self.candidateLineNumbers is None:
+			description = u"indexes didn't narrow down the cards"
+		elif cardCount is None:
+			description = u"{:,} cards left after the indexes".format(len(self.candidateLineNumbers))
+		else:
+			description = u"{:,} of {:,} cards left after the indexes".format(len(self.candidateLineNumbers), cardCount)
+		lookups = [attrib for attrib, regex in (('set', self.setRegex), ('rarity', self.rarityRegex)) if regex]
+		if lookups:
+			description += u"; lookups for {}".format(u" and ".join(lookups))
+		checkDescriptions = []
+		for attrib, isSetSpecific, literals, regex in self.checks:
+			checkDescription = attrib
+			if literals:
+				checkDescription += u" (prefilter {}".format(u", ".join(u"'{}'".format(literal) for literal in literals))
+			else:
+				checkDescription += u" (regex only"
+			if attrib in self.passRates:
+				checkDescription += u", {:.0%} of sample passed".format(self.passRates[attrib])
+			checkDescriptions.append(checkDescription + u")")
+		if checkDescriptions:
+			description += u"; checks in order: " + u", ".join(checkDescriptions)
+		return description
+
+
+class CardDatabase(object):
+	"""
+	The cards from the card file stored in an SQLite database, which gets built after each update. Has tables for the game-wide card data, the sets, and the set-specific data of each card,
+	 and a full-text search table over the name, type, text and flavor of each card that can find any substring of 3 or more characters, so literal queries only have to check a few cards.
+	Regexes get checked with an SQL 'REGEXP' function that calls Python's 're', so the results are the same as those of a regular search
+	"""
+	cardColumns = ('name', 'names', 'type', 'text', 'manacost', 'cmc', 'colors', 'power', 'toughness', 'loyalty', 'hand', 'life', 'layout', 'source')
+	setSpecificColumns = ('artist', 'flavor', 'multiverseid', 'number', 'rarity', 'watermark')
+	fullTextColumns = ('name', 'type', 'text', 'flavor')
+
+	def __init__(self, databaseFilename):
+		self.databaseFilename = databaseFilename
+
+	@classmethod
+	def build(cls, cardFilename, databaseFilename):
+		#Build the database in a temporary file and only replace the old one when it's done, so searches never see a half-built database
+		temporaryDatabaseFilename = databaseFilename + '.new'
+		if os.path.exists(temporaryDatabaseFilename):
+			os.remove(temporaryDatabaseFilename)
+		connection = sqlite3.connect(temporaryDatabaseFilename)
+		try:
+			connection.execute("CREATE TABLE sets (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)")
+			#The card IDs are the line numbers of the cards in the card file
+			connection.execute("CREATE TABLE cards (id INTEGER PRIMARY KEY, setcount INTEGER NOT NULL, {})".format(", ".join(column + " TEXT" for column in cls.cardColumns)))
+			connection.execute("CREATE TABLE card_sets (card_id INTEGER NOT NULL REFERENCES cards(id), set_id INTEGER NOT NULL REFERENCES sets(id), {})".format(
+				", ".join(column + " TEXT" for column in cls.setSpecificColumns)))
+			#The trigram tokenizer makes substring searches fast, but it needs SQLite 3.34 or newer. Without it everything still works, literal searches just aren't faster
+			try:
+				connection.execute("CREATE VIRTUAL TABLE card_search USING fts5({}, tokenize='trigram')".format(", ".join(cls.fullTextColumns)))
+				hasFullTextTable = True
+			except sqlite3.OperationalError as e:
+				CommandTemplate.logWarning(u"[MtG] SQLite {} can't create the full-text search table, literal searches won't use an index ({})".format(sqlite3.sqlite_version, e))
+				hasFullTextTable = False
+
+			setIds = {}
+			cardInsertQuery = "INSERT INTO cards (id, setcount, {}) VALUES (?, ?, {})".format(", ".join(cls.cardColumns), ", ".join("?" * len(cls.cardColumns)))
+			cardSetInsertQuery = "INSERT INTO card_sets (card_id, set_id, {}) VALUES (?, ?, {})".format(", ".join(cls.setSpecificColumns), ", ".join("?" * len(cls.setSpecificColumns)))
+			for lineNumber, carddata in IndexedCardStore.readCardFile(cardFilename):
+				card, sets = carddata
+				connection.execute(cardInsertQuery, [lineNumber, len(sets)] + [card.get(column, None) for column in cls.cardColumns])
+				for setname, setSpecificCardData in sets.iteritems():
+					if setname not in setIds:
+						setIds[setname] = connection.execute("INSERT INTO sets (name) VALUES (?)", (setname,)).lastrowid
+					connection.execute(cardSetInsertQuery, [lineNumber, setIds[setname]] + [setSpecificCardData.get(column, None) for column in cls.setSpecificColumns])
+				if hasFullTextTable:
+					flavors = u"\n".join(setSpecificCardData['flavor'] for setSpecificCardData in sets.itervalues() if 'flavor' in setSpecificCardData)
+					connection.execute("INSERT INTO card_search (rowid, name, type, text, flavor) VALUES (?, ?, ?, ?, ?)", (lineNumber, card['name'], card.get('type', u""), card['text'], flavors))
+
+			connection.execute("CREATE INDEX card_sets_card_id ON card_sets (card_id)")
+			connection.execute("CREATE INDEX card_sets_set_id ON card_sets (set_id)")
+			connection.execute("CREATE INDEX card_sets_rarity ON card_sets (rarity)")
+			connection.commit()
+			#Store statistics about the indexes, so SQLite can pick the best one for each search
+			connection.execute("ANALYZE")
+			connection.commit()
+		finally:
+			connection.close()
+		if os.path.exists(databaseFilename):
+			os.remove(databaseFilename)
+		os.rename(temporaryDatabaseFilename, databaseFilename)
+
+	def canSearch(self, regexDict):
+		"""The database only stores the card attributes that are text, returns whether all the searched attributes are in it"""
+		for attrib in regexDict:
+			if attrib != 'set' and attrib not in self.cardColumns and attrib not in self.setSpecificColumns:
+				return False
+		return True
+
+	def search(self, regexDict):
+		"""Returns the same dict 'IndexedCardStore.search' does: the card names as keys, and a tuple with the card line number and the matching sets (or None if all sets matched) as values"""
+		connection = sqlite3.connect(self.databaseFilename)
+		try:
+			regexesByPattern = {regex.pattern: regex for regex in regexDict.itervalues()}
+			#SQLite turns 'value REGEXP pattern' into a call to 'regexp(pattern, value)'. Missing attributes are NULL, and those never match, like in a regular search
+			connection.create_function('regexp', 2, lambda pattern, value: value is not None and regexesByPattern[pattern].search(value) is not None)
+			hasFullTextTable = connection.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'card_search'").fetchone()[0] > 0
+
+			conditions = []
+			parameters = []
+			for attrib, regex in regexDict.iteritems():
+				#There aren't many sets and rarities, so check the regex against each of them once, and then use the index to find the cards
+				if attrib == 'set':
+					conditions.append("card_sets.set_id IN (SELECT id FROM sets WHERE name REGEXP ?)")
+					parameters.append(regex.pattern)
+				elif attrib == 'rarity':
+					conditions.append("card_sets.rarity IN (SELECT DISTINCT rarity FROM card_sets WHERE rarity REGEXP ?)")
+					parameters.append(regex.pattern)
+				else:
+					#The full-text table can find the literal text a match needs to contain, if it's at least 3 characters. Its 'LIKE' treats '_' and '%' as wildcards, so skip text with those
+					# 'LIKE' also only ignores case for ASCII letters, so a lowercase 'æther' wouldn't find 'Æther'. Leave text with other characters to the regex too
+					# The regex still needs to be checked afterwards
+					if hasFullTextTable and attrib in self.fullTextColumns:
+						for literal in CardSearchPlan.getRequiredLiterals(regex):
+							if len(literal) >= 3 and '_' not in literal and '%' not in literal and all(ord(character) < 128 for character in literal):
+								conditions.append("cards.id IN (SELECT rowid FROM card_search WHERE {} LIKE ?)".format(attrib))
+								parameters.append(u"%" + literal + u"%")
+					conditions.append("{}.{} REGEXP ?".format('card_sets' if attrib in self.setSpecificColumns else 'cards', attrib))
+					parameters.append(regex.pattern)
+			query = "SELECT cards.id, cards.name, cards.setcount, sets.name FROM cards JOIN card_sets ON card_sets.card_id = cards.id JOIN sets ON sets.id = card_sets.set_id"
+			if conditions:
+				query += " WHERE " + " AND ".join(conditions)
+
+			#Each row is a set in which a card matches, so collect the matching sets per card
+			matchingSetsPerCard = {}
+			for cardId, cardname, setCount, setname in connection.execute(query, parameters):
+				if cardId in matchingSetsPerCard:
+					matchingSetsPerCard[cardId][2].append(setname)
+				else:
+					matchingSetsPerCard[cardId] = (cardname, setCount, [setname])
+		finally:
+			connection.close()
+		matchingCards = {}
+		for cardId, (cardname, setCount, matchingSetnames) in matchingSetsPerCard.iteritems():
+			matchingCards[cardname] = (cardId, None if len(matchingSetnames) == setCount else matchingSetnames)
+		return matchingCards
@@ -32,7 +32,7 @@ class Command(CommandTemplate):
 
 		if message.trigger == 'nickmessage':
 			#Search if we know the provided nick (or use the user's nick if there's none provided)
-			nickToSearchFor = message.messageParts[0].lower() if message.messagePartsLength > 0 else message.userNickname.lower()
+			nickToSearchFor = message.messageParts[0].lower() if message.messagePartsLength > 0 else message.userNicknameLower
 
 			if serverfolder not in nickmessages or nickToSearchFor not in nickmessages[serverfolder]:
 				message.reply(u"I don't have a nick message stored for '{}'".format(nickToSearchFor))
@@ -45,7 +45,7 @@ class Command(CommandTemplate):
 			else:
 				if serverfolder not in nickmessages:
 					nickmessages[serverfolder] = {}
-				nickmessages[serverfolder][message.userNickname.lower()] = (message.message, time.time())
+				nickmessages[serverfolder][message.userNicknameLower] = (message.message, time.time())
 				#Only save the file if the message doesn't contain any weird Unicode characters that might trip up the JSON lib
 				try:
 					nickMessagesString = json.dumps(nickmessages)
@@ -56,10 +56,10 @@ class Command(CommandTemplate):
 						nickmessagesFile.write(nickMessagesString)
 					message.reply(u"Your nick message was successfully set")
 		elif message.trigger == 'clearnickmessage':
-			if serverfolder not in nickmessages or message.userNickname.lower() not in nickmessages[serverfolder]:
+			if serverfolder not in nickmessages or message.userNicknameLower not in nickmessages[serverfolder]:
 				message.reply(u"There is no message stored for your nick")
 			else:
-				del nickmessages[serverfolder][message.userNickname.lower()]
+				del nickmessages[serverfolder][message.userNicknameLower]
 				#Might as well clear the serverfolder entry if there's no messages in it
 				if len(nickmessages[serverfolder]) == 0:
 					del nickmessages[serverfolder]
@@ -95,7 +95,7 @@ class Command(CommandTemplate):
 				#If we don't have data on this streamer yet, retrieve it
 				if not streamerdata:
 					try:
-						r = requests.get("https://api.twitch.tv/kraken/users", params={"client_id": GlobalStore.commandhandler.apikeys['twitch'],
+						r = SharedFunctions.httpGet("https://api.twitch.tv/kraken/users", params={"client_id": GlobalStore.commandhandler.apikeys['twitch'],
 																				   "api_version": 5, "login": streamername}, timeout=10.0)
 					except requests.exceptions.Timeout:
 						message.reply(u"Apparently Twitch is distracted by its own streams, because it's too slow to respond. Try again in a bit?")
@@ -317,7 +317,7 @@ class Command(CommandTemplate):
 	def retrieveStreamDataForIds(idList):
 		# Add a 'limit' parameter in case we need to check more streamers than the default limit allows
 		try:
-			r = requests.get("https://api.twitch.tv/kraken/streams/", params={"client_id": GlobalStore.commandhandler.apikeys['twitch'], "api_version": 5,
+			r = SharedFunctions.httpGet("https://api.twitch.tv/kraken/streams/", params={"client_id": GlobalStore.commandhandler.apikeys['twitch'], "api_version": 5,
 								 "limit": len(idList), "stream_type": "live", "channel": ",".join(idList)}, timeout=10.0)
 		except requests.exceptions.Timeout:
 			return (False, "Twitch took too long to respond")
@@ -16,8 +16,9 @@ class Command(CommandTemplate):
 		triggerlist = {}
 		shortTriggerlist = {}
 		isUserAdmin = message.bot.isUserAdmin(message.user, message.userNickname, message.userAddress)
-		for commandname, command in GlobalStore.commandhandler.commands.iteritems():
-			if command.showInCommandList and (isUserAdmin or not command.adminOnly) and len(command.triggers) > 0 and GlobalStore.commandhandler.isCommandAllowedForBot(message.bot, commandname):
+		for commandname in message.bot.allowedCommandNames:
+			command = GlobalStore.commandhandler.commands[commandname]
+			if command.showInCommandList and (isUserAdmin or not command.adminOnly) and len(command.triggers) > 0:
 				shortTriggerlist[command.triggers[0]] = command
 				for trigger in command.triggers:
 					triggerlist[trigger] = command
@@ -37,7 +37,7 @@ class Command(CommandTemplate):
 		maxMessageLength = 300
 
 		try:
-			pageDownload = requests.get(url, timeout=10.0)
+			pageDownload = SharedFunctions.httpGet(url, timeout=10.0)
 		except requests.ConnectionError:
 			message.reply("Sorry, I couldn't connect to the Humble Bundle site. Try again in a little while!")
 			return
@@ -16,17 +16,13 @@ class Command(CommandTemplate):
 		if message.messagePartsLength > 0:
 			modulename = message.messageParts[0]
 		
-		if modulename in GlobalStore.commandhandler.commands and GlobalStore.commandhandler.isCommandAllowedForBot(message.bot, modulename):
+		if modulename in message.bot.allowedCommandNames:
 			module = GlobalStore.commandhandler.commands[modulename]
 			replytext = "Module '{0}' has triggers: {1}; Helptext: {2}".format(modulename, ", ".join(module.triggers), module.helptext.format(commandPrefix=message.bot.commandPrefix))
 		else:
 			if modulename != "":
 				replytext = "Unknown module. "
-			modules = []
-			for loadedModuleName in GlobalStore.commandhandler.commands.keys():
-				if GlobalStore.commandhandler.isCommandAllowedForBot(message.bot, loadedModuleName):
-					modules.append(loadedModuleName)
-			modules = sorted(modules, key=lambda s: s.lower())  #The key=lambda part is so the sort ignores case
+			modules = sorted(message.bot.allowedCommandNames, key=lambda s: s.lower())  #The key=lambda part is so the sort ignores case
 
 			replytext += "Modules loaded: {}".format(", ".join(modules)) 
 			
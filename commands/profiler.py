@@ -0,0 +1,174 @@
+import cProfile, os, pstats, StringIO, time
+
+import gevent
+import gevent.hub
+import greenlet
+
+from CommandTemplate import CommandTemplate
+import GlobalStore
+import SharedFunctions
+from IrcMessage import IrcMessage
+
+
+class Command(CommandTemplate):
+	triggers = ['profile']
+	helptext = "Profiles all the bots for the provided number of seconds, and saves the functions that took the most time to the data folder. " \
+			   "Add 'switches' to also keep track of which greenlets were running and how often they switched. Format: {commandPrefix}profile [seconds] (switches)"
+	adminOnly = True
+	showInCommandList = False
+	callInThread = True  #Waiting for the profile to finish shouldn't stop the bot from reading from the server
+	maxProfileSeconds = 300
+	topFunctionCount = 40  #How many functions get saved to the profile file
+
+	isProfiling = False
+
+	def execute(self, message):
+		"""
+		:type message: IrcMessage
+		"""
+		if message.messagePartsLength == 0:
+			message.reply(self.getHelp(message), "say")
+			return
+		if self.isProfiling:
+			message.reply(u"I'm already profiling, please wait until that's done", "say")
+			return
+		try:
+			secondsToProfile = float(message.messageParts[0])
+		except ValueError:
+			message.reply(u"'{}' isn't a valid number of seconds".format(message.messageParts[0]), "say")
+			return
+		if secondsToProfile <= 0 or secondsToProfile > self.maxProfileSeconds:
+			message.reply(u"Please provide a number of seconds between 0 and {}".format(self.maxProfileSeconds), "say")
+			return
+		shouldTraceSwitches = message.messagePartsLength > 1 and message.messageParts[1].lower() in ('switch', 'switches')
+
+		message.reply(u"Profiling for {:g} seconds{}...".format(secondsToProfile, u", including greenlet switches" if shouldTraceSwitches else u""), "say")
+		self.isProfiling = True
+		try:
+			profileStats, switchTracker = self.profile(secondsToProfile, shouldTraceSwitches)
+		finally:
+			self.isProfiling = False
+
+		profileFilename = self.saveProfile(profileStats, switchTracker, secondsToProfile)
+		replytext = u"Profiled {:,} function calls in {:g} seconds, using {:.3f} seconds of CPU time".format(profileStats.total_calls, secondsToProfile, profileStats.total_tt)
+		#The hub is always waiting in its own run loop, so cumulative times aren't very telling. List the functions that took the most time themselves
+		busiestFunctions = self.getBusiestFunctions(profileStats, 3)
+		if busiestFunctions:
+			replytext += u". Most time spent in: " + SharedFunctions.joinWithSeparator([u"{} ({:.3f} s)".format(functionName, seconds) for functionName, seconds in busiestFunctions])
+		if switchTracker:
+			replytext += u". {:,} greenlet switches, busiest greenlet: {}".format(switchTracker.switchCount, switchTracker.getBusiestGreenletDescription())
+		replytext += u". Full results saved to '{}'".format(os.path.relpath(profileFilename, GlobalStore.scriptfolder))
+		message.reply(replytext, "say")
+
+	@staticmethod
+	def profile(secondsToProfile, shouldTraceSwitches):
+		"""
+		Runs cProfile for the provided number of seconds. All greenlets run in the same thread, so the profiler sees all the bots and modules, not just this greenlet.
+		Returns the resulting stats, and the GreenletSwitchTracker if switches were traced, or None if they weren't
+		"""
+		#Measure CPU time instead of wall time, otherwise the time greenlets spend waiting for the network makes it look like 'sleep' and 'wait' are the slowest functions
+		# On Windows 'time.clock' is wall time, but there it's at least more precise than 'time.time'
+		profiler = cProfile.Profile(time.clock)
+		switchTracker = GreenletSwitchTracker() if shouldTraceSwitches else None
+		if switchTracker:
+			switchTracker.start()
+		profiler.enable()
+		try:
+			gevent.sleep(secondsToProfile)
+		finally:
+			profiler.disable()
+			if switchTracker:
+				switchTracker.stop()
+		return (pstats.Stats(profiler), switchTracker)
+
+	@staticmethod
+	def getBusiestFunctions(profileStats, count):
+		"""Returns a list of (function name, seconds) tuples for the functions that spent the most time in their own code"""
+		busiestFunctions = []
+		for (filename, lineNumber, functionName), (primitiveCallCount, callCount, ownTime, cumulativeTime, callers) in profileStats.stats.iteritems():
+			busiestFunctions.append((u"{}:{}".format(os.path.basename(filename), functionName), ownTime))
+		busiestFunctions.sort(key=lambda functionTuple: functionTuple[1], reverse=True)
+		return busiestFunctions[:count]
+
+	def saveProfile(self, profileStats, switchTracker, secondsProfiled):
+		profileFolder = os.path.join(GlobalStore.scriptfolder, 'data', 'profiles')
+		if not os.path.exists(profileFolder):
+			os.makedirs(profileFolder)
+		profileFilename = os.path.join(profileFolder, time.strftime("profile-%Y-%m-%d_%H-%M-%S.txt"))
+		profileOutput = StringIO.StringIO()
+		profileOutput.write("Profiled for {:g} seconds, times are CPU time\n\n".format(secondsProfiled))
+		profileStats.stream = profileOutput
+		profileStats.sort_stats('cumulative').print_stats(self.topFunctionCount)
+		profileStats.sort_stats('time').print_stats(self.topFunctionCount)
+		if switchTracker:
+			profileOutput.write("Greenlet switches: {:,}\n".format(switchTracker.switchCount))
+			profileOutput.write("{:>12}{:>12}  {}\n".format("Seconds", "Switches", "Greenlet"))
+			for greenletDescription, (seconds, switchCount) in switchTracker.getGreenletTimes():
+				profileOutput.write("{:>12.4f}{:>12,}  {}\n".format(seconds, switchCount, greenletDescription))
+		with open(profileFilename, 'w') as profileFile:
+			profileFile.write(profileOutput.getvalue())
+		return profileFilename
+
+
+class GreenletSwitchTracker(object):
+	"""Uses greenlet's trace function to count how often greenlets get switched to, and how long each one runs before switching away"""
+
+	def __init__(self):
+		self.switchCount = 0
+		self.greenletTimes = {}  #Keys are greenlet descriptions, values are lists with the seconds spent in greenlets with that description, and how often they were switched to
+		self.currentGreenletDescription = None
+		self.currentGreenletStartTime = None
+		self.previousTraceFunction = None
+
+	@staticmethod
+	def describeGreenlet(greenletToDescribe):
+		"""Greenlets don't have useful names, so describe them by the function they run, like 'DideRobot.handleConnection'"""
+		if isinstance(greenletToDescribe, gevent.hub.Hub):
+			return "Hub"
+		if greenletToDescribe.parent is None:
+			return "Main greenlet"
+		runFunction = getattr(greenletToDescribe, '_run', None) or getattr(greenletToDescribe, 'run', None)
+		if runFunction is None:
+			return type(greenletToDescribe).__name__
+		if hasattr(runFunction, 'im_class'):
+			return "{}.{}".format(runFunction.im_class.__name__, runFunction.__name__)
+		return getattr(runFunction, '__name__', repr(runFunction))
+
+	def start(self):
+		self.currentGreenletDescription = self.describeGreenlet(greenlet.getcurrent())
+		self.currentGreenletStartTime = time.time()
+		self.previousTraceFunction = greenlet.settrace(self.trace)
+
+	def stop(self):
+		greenlet.settrace(self.previousTraceFunction)
+		self.addGreenletTime(self.currentGreenletDescription, time.time() - self.currentGreenletStartTime, 0)
+
+	def addGreenletTime(self, greenletDescription, seconds, switchCount):
+		if greenletDescription in self.greenletTimes:
+			self.greenletTimes[greenletDescription][0] += seconds
+			self.greenletTimes[greenletDescription][1] += switchCount
+		else:
+			self.greenletTimes[greenletDescription] = [seconds, switchCount]
+
+	def trace(self, event, args):
+		if event in ('switch', 'throw'):
+			now = time.time()
+			origin, target = args
+			self.switchCount += 1
+			self.addGreenletTime(self.currentGreenletDescription, now - self.currentGreenletStartTime, 0)
+			self.currentGreenletDescription = self.describeGreenlet(target)
+			self.currentGreenletStartTime = now
+			self.addGreenletTime(self.currentGreenletDescription, 0.0, 1)
+		if self.previousTraceFunction:
+			self.previousTraceFunction(event, args)
+
+	def getGreenletTimes(self):
+		"""Returns a list of (greenlet description, (seconds, switch count)) tuples, with the greenlets that ran longest first"""
+		return sorted(self.greenletTimes.iteritems(), key=lambda greenletTuple: greenletTuple[1][0], reverse=True)
+
+	def getBusiestGreenletDescription(self):
+		#The hub is mostly waiting for something to happen, so skip that
+		for greenletDescription, (seconds, switchCount) in self.getGreenletTimes():
+			if greenletDescription != "Hub":
+				return u"{} ({:.3f} s over {:,} switches)".format(greenletDescription, seconds, switchCount)
+		return u"none"
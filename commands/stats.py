@@ -0,0 +1,127 @@
+import json, os, time
+
+from CommandTemplate import CommandTemplate
+import GlobalStore
+import SharedFunctions
+from IrcMessage import IrcMessage
+
+
+class Command(CommandTemplate):
+	triggers = ['stats']
+	helptext = "Shows how long modules take to run. Without parameters, lists the slowest modules. " \
+			   "'{commandPrefix}stats [module]' shows details for that module, '{commandPrefix}stats pools' shows worker, process, HTTP and cache usage, " \
+			   "'{commandPrefix}stats dump' saves all the stats to the data folder, and '{commandPrefix}stats reset' clears the module stats"
+	adminOnly = True
+	showInCommandList = False
+	scheduledFunctionTime = None  #Set from the 'statsDumpIntervalMinutes' global setting. If that's not set, the stats only get saved when asked
+	shouldSkipNextScheduledDump = True
+
+	def onLoad(self):
+		#Like the metrics server, this is for all the bots together, so the setting is only read from the global settings
+		globalSettingsFilename = os.path.join(GlobalStore.scriptfolder, 'serverSettings', 'globalsettings.json')
+		if os.path.isfile(globalSettingsFilename):
+			with open(globalSettingsFilename, 'r') as globalSettingsFile:
+				statsDumpIntervalMinutes = json.load(globalSettingsFile).get('statsDumpIntervalMinutes', 0)
+			if statsDumpIntervalMinutes > 0:
+				self.scheduledFunctionTime = statsDumpIntervalMinutes * 60.0
+		#The scheduled function runs right after loading too, when there aren't any stats yet. Skip that run, so it doesn't overwrite the dump from before a restart
+		self.shouldSkipNextScheduledDump = True
+
+	def executeScheduledFunction(self):
+		if self.shouldSkipNextScheduledDump:
+			self.shouldSkipNextScheduledDump = False
+			return
+		self.dumpStats()
+
+	@staticmethod
+	def formatSeconds(seconds):
+		if seconds >= 1.0:
+			return u"{:.2f} s".format(seconds)
+		if seconds >= 0.001:
+			return u"{:.1f} ms".format(seconds * 1000)
+		return u"{:.0f} us".format(seconds * 1000000)
+
+	def formatHistogramStats(self, histogramStats):
+		return u"{:,} calls, p50 {}, p95 {}, p99 {}, max {}".format(histogramStats['count'], self.formatSeconds(histogramStats['p50']), self.formatSeconds(histogramStats['p95']),
+																	 self.formatSeconds(histogramStats['p99']), self.formatSeconds(histogramStats['max']))
+
+	@staticmethod
+	def getAllStats():
+		commandhandler = GlobalStore.commandhandler
+		responseCacheStats = {}
+		for commandname, command in commandhandler.commands.iteritems():
+			if command.responseCache:
+				responseCacheStats[commandname] = command.responseCache.getStats()
+		return {'time': time.time(), 'commands': commandhandler.commandMetrics.getStats(), 'workerPool': commandhandler.workerPool.getStats(),
+				'processPool': commandhandler.processPool.getStats(), 'http': SharedFunctions.getHttpConnectionStats(),
+				'singleFlightSharedCalls': SharedFunctions.singleFlightSharedCallCount, 'responseCaches': responseCacheStats, 'hubBlocking': commandhandler.blockingDetector.getStats()}
+
+	def dumpStats(self):
+		statsFilename = os.path.join(GlobalStore.scriptfolder, 'data', 'stats.json')
+		with open(statsFilename, 'w') as statsFile:
+			statsFile.write(json.dumps(self.getAllStats(), sort_keys=True, indent=4))
+		return statsFilename
+
+	def execute(self, message):
+		"""
+		:type message: IrcMessage
+		"""
+		commandhandler = GlobalStore.commandhandler
+		parameter = message.messageParts[0] if message.messagePartsLength > 0 else None
+
+		if parameter == 'dump':
+			replytext = u"Saved all the stats to '{}'".format(os.path.relpath(self.dumpStats(), GlobalStore.scriptfolder))
+		elif parameter == 'reset':
+			commandhandler.commandMetrics.reset()
+			commandhandler.blockingDetector.reset()
+			replytext = u"Module stats cleared"
+		elif parameter == 'pools':
+			workerPoolStats = commandhandler.workerPool.getStats()
+			processPoolStats = commandhandler.processPool.getStats()
+			replytext = u"Workers: {:,}/{:,} busy, {:,} queued, {:,} rejected".format(workerPoolStats['runningCalls'], workerPoolStats['maxWorkers'],
+																					 workerPoolStats['queuedCalls'], workerPoolStats['rejectedCalls'])
+			replytext += u"; Processes: {:,}/{:,} running, {:,} finished, {:,} failed".format(processPoolStats['runningProcesses'], processPoolStats['maxProcesses'],
+																							  processPoolStats['finishedCalls'], processPoolStats['failedCalls'])
+			httpStats = SharedFunctions.getHttpConnectionStats()
+			replytext += u"; HTTP: {:,} requests over {:,} connections to {:,} hosts".format(sum(hostStats['requests'] for hostStats in httpStats.itervalues()),
+																						   sum(hostStats['connectionsOpened'] for hostStats in httpStats.itervalues()), len(httpStats))
+			replytext += u"; {:,} shared lookups".format(SharedFunctions.singleFlightSharedCallCount)
+			cacheHits = 0
+			cacheMisses = 0
+			for command in commandhandler.commands.itervalues():
+				if command.responseCache:
+					cacheHits += command.responseCache.hitCount
+					cacheMisses += command.responseCache.missCount
+			replytext += u"; Caches: {:,} hits, {:,} misses".format(cacheHits, cacheMisses)
+			blockingStats = commandhandler.blockingDetector.getStats()
+			replytext += u"; Hub blocked {:,} times".format(sum(commandBlockingStats['incidents'] for commandBlockingStats in blockingStats.itervalues()))
+		elif parameter:
+			commandStats = commandhandler.commandMetrics.getStats(parameter)
+			blockingStats = commandhandler.blockingDetector.getStats(parameter)
+			if parameter not in commandStats and parameter not in blockingStats:
+				replytext = u"I don't have any stats for a module called '{}'. Maybe it hasn't been used yet, or you made a typo?".format(parameter)
+			else:
+				replytext = SharedFunctions.makeTextBold(parameter) + u":"
+				#Blocking incidents are also stored for code that isn't a module, so there may not be any call stats
+				if parameter in commandStats:
+					commandStats = commandStats[parameter]
+					replytext += u" {:,} calls, {:,} errors".format(commandStats['invocations'], commandStats['errors'])
+					replytext += u"; execute: " + self.formatHistogramStats(commandStats['execute'])
+					replytext += u"; shouldExecute: " + self.formatHistogramStats(commandStats['shouldExecute'])
+					if commandStats['scheduledFunction']['count'] > 0:
+						replytext += u"; scheduled function: " + self.formatHistogramStats(commandStats['scheduledFunction'])
+				if parameter in blockingStats:
+					replytext += u"{} blocked all bots {:,} times, longest {}".format(u";" if parameter in commandStats else u"", blockingStats[parameter]['incidents'], self.formatSeconds(blockingStats[parameter]['maxBlockedSeconds']))
+		else:
+			commandStats = commandhandler.commandMetrics.getStats()
+			executedCommandnames = [commandname for commandname in commandStats if commandStats[commandname]['execute']['count'] > 0]
+			if not executedCommandnames:
+				replytext = u"No modules have been called yet, so I don't have any stats"
+			else:
+				executedCommandnames.sort(key=lambda commandname: commandStats[commandname]['execute']['p95'], reverse=True)
+				slowestCommands = []
+				for commandname in executedCommandnames[:5]:
+					slowestCommands.append(u"{} (p95 {}, {:,} calls, {:,} errors)".format(commandname, self.formatSeconds(commandStats[commandname]['execute']['p95']),
+																						 commandStats[commandname]['invocations'], commandStats[commandname]['errors']))
+				replytext = u"Slowest modules: " + SharedFunctions.joinWithSeparator(slowestCommands)
+		message.reply(replytext, "say")
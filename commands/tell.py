@@ -38,7 +38,7 @@ class Command(CommandTemplate):
 		serverfolder = message.bot.serverfolder
 
 		#Check if the person that said something has tells waiting for them
-		usernick = message.userNickname.lower()
+		usernick = message.userNicknameLower
 		if serverfolder in self.storedTells and usernick in self.storedTells[serverfolder]:
 			publicTells = self.retrieveTells(serverfolder, usernick, message.source)
 			sentTell = False
@@ -4,12 +4,15 @@ import requests
 
 from CommandTemplate import CommandTemplate
 from IrcMessage import IrcMessage
+import SharedFunctions
 
 
 class Command(CommandTemplate):
 	triggers = ['translate']
 	helptext = "Translates the provided text. The first argument should be a two-letter country code ('it' for Italy, etc.) if you want to translate from English, " \
 			   "or the source language and the target language separated by a '|' (So 'fi|en' to translate from Finnish to English)"
+	responseCacheSeconds = 86400
+	responseCacheIsCaseSensitive = True  #Capitalisation can change a translation
 
 	def execute(self, message):
 		"""
@@ -32,12 +35,17 @@ class Command(CommandTemplate):
 				lang = 'en|' + lang
 
 			params = {'q': ' '.join(message.messageParts[1:]), 'langpair': lang, 'of': 'json'}
-			try:
-				result = json.loads(requests.get('http://api.mymemory.translated.net/get', params=params, timeout=15.0).text)
-			except requests.exceptions.Timeout:
-				message.reply("Apparently that's such a difficult {} the translation API had some trouble with it and/or has given up. "
-							  "Either way the API took too long to respond, sorry".format('sentence' if ' ' in params['q'] else 'word'))
-				return
+			cacheKey = (lang.lower(), params['q'])
+			result = self.responseCache.get(cacheKey)
+			if result is None:
+				try:
+					result = json.loads(SharedFunctions.httpGet('http://api.mymemory.translated.net/get', params=params, timeout=15.0).text)
+				except requests.exceptions.Timeout:
+					message.reply("Apparently that's such a difficult {} the translation API had some trouble with it and/or has given up. "
+								  "Either way the API took too long to respond, sorry".format('sentence' if ' ' in params['q'] else 'word'))
+					return
+				if result['responseStatus'] == 200:
+					self.responseCache.set(cacheKey, result)
 			if result['responseStatus'] != 200:
 				#Something went wrong, the error is in 'responseDetails' (though sometimes that field is not there)
 				#  It's in all-caps though, so reduce the shouting a bit
@@ -15,6 +15,7 @@ class Command(CommandTemplate):
 	helptext = "Shows the title of the page somebody just posted a link to"
 	showInCommandList = False
 	callInThread = True  #We can't know how slow sites are, so prevent the bot from locking up on slow sites
+	maxConcurrentCalls = 5
 
 	def shouldExecute(self, message):
 		if message.messageType != 'say':
@@ -39,20 +40,8 @@ class Command(CommandTemplate):
 
 			title = None
 			try:
-				#There's some special cases for often used pages.
-				if 'twitch.tv' in url:
-					title = self.retrieveTwitchTitle(url, timeout)
-				elif 'youtube.com' in url or 'youtu.be' in url:
-					title = self.retrieveYoutubetitle(url, timeout)
-				elif 'imgur.com' in url:
-					title = self.retrieveImgurTitle(url, timeout)
-				elif 'twitter.com' in url:
-					title = self.retrieveTwitterTitle(url, timeout)
-				elif re.match('https?://.{2}(?:\.m)?\.wikipedia.org', url, re.IGNORECASE):
-					title = GlobalStore.commandhandler.runCommandFunction('getWikipediaArticle', None, url, False)
-				#If nothing has been found so far, just display whatever is between the <title> tags
-				if title is None:
-					title = self.retrieveGenericTitle(url, timeout)
+				#If the same link gets posted in multiple channels at once, only retrieve it once
+				title = SharedFunctions.runSingleFlight(('urlTitleFinder', url), self.retrieveTitle, url, timeout)
 			except requests.exceptions.Timeout:
 				self.logError("[url] '{}' took too long to respond, ignoring".format(url))
 			except requests.exceptions.ConnectionError as error:
@@ -68,12 +57,30 @@ class Command(CommandTemplate):
 					title = title[:250] + "[...]"
 				message.reply(u"Title: {}".format(title), "say")
 
+	def retrieveTitle(self, url, timeout=5.0):
+		title = None
+		#There's some special cases for often used pages.
+		if 'twitch.tv' in url:
+			title = self.retrieveTwitchTitle(url, timeout)
+		elif 'youtube.com' in url or 'youtu.be' in url:
+			title = self.retrieveYoutubetitle(url, timeout)
+		elif 'imgur.com' in url:
+			title = self.retrieveImgurTitle(url, timeout)
+		elif 'twitter.com' in url:
+			title = self.retrieveTwitterTitle(url, timeout)
+		elif re.match('https?://.{2}(?:\.m)?\.wikipedia.org', url, re.IGNORECASE):
+			title = GlobalStore.commandhandler.runCommandFunction('getWikipediaArticle', None, url, False)
+		#If nothing has been found so far, just display whatever is between the <title> tags
+		if title is None:
+			title = self.retrieveGenericTitle(url, timeout)
+		return title
+
 	@staticmethod
 	def retrieveGenericTitle(url, timeout=5.0):
 		for ext in ('.jpg', '.jpeg', '.gif', '.png', '.bmp', '.avi', '.wav', '.mp3', '.ogg', '.zip', '.rar', '.7z', '.pdf', '.swf'):
 			if url.endswith(ext):
 				return None
-		titlematch = re.search(r'<title ?.*?>(.+)</title>', requests.get(url, timeout=timeout).text, re.DOTALL | re.IGNORECASE)
+		titlematch = re.search(r'<title ?.*?>(.+)</title>', SharedFunctions.httpGet(url, timeout=timeout).text, re.DOTALL | re.IGNORECASE)
 		if titlematch:
 			return titlematch.group(1)  #No need to do clean-up, that's handled in the main 'execute' function
 		return None
@@ -86,13 +93,13 @@ class Command(CommandTemplate):
 			channeldata = {}
 			isChannelOnline = False
 			twitchheaders = {'Accept': 'application/vnd.twitchtv.v2+json'}
-			twitchStreamPage = requests.get(u"https://api.twitch.tv/kraken/streams/" + channel, headers=twitchheaders, timeout=timeout)
+			twitchStreamPage = SharedFunctions.httpGet(u"https://api.twitch.tv/kraken/streams/" + channel, headers=twitchheaders, timeout=timeout)
 			streamdata = json.loads(twitchStreamPage.text.encode('utf-8'))
 			if 'stream' in streamdata and streamdata['stream'] is not None:
 				channeldata = streamdata['stream']['channel']
 				isChannelOnline = True
 			elif 'error' not in streamdata:
-				twitchChannelPage = requests.get(u"https://api.twitch.tv/kraken/channels/" + channel, headers=twitchheaders, timeout=timeout)
+				twitchChannelPage = SharedFunctions.httpGet(u"https://api.twitch.tv/kraken/channels/" + channel, headers=twitchheaders, timeout=timeout)
 				channeldata = json.loads(twitchChannelPage.text.encode('utf-8'))
 
 			if len(channeldata) > 0:
@@ -128,7 +135,7 @@ class Command(CommandTemplate):
 		googleUrl = "https://www.googleapis.com/youtube/v3/videos"
 		params = {'part': 'statistics,snippet,contentDetails', 'id': videoId, 'key': GlobalStore.commandhandler.apikeys['google'],
 				  'fields': 'items/snippet(title,description),items/contentDetails/duration,items/statistics(viewCount,likeCount,dislikeCount)'}
-		googleJson = json.loads(requests.get(googleUrl, params=params, timeout=timeout).text.encode('utf-8'))
+		googleJson = json.loads(SharedFunctions.httpGet(googleUrl, params=params, timeout=timeout).text.encode('utf-8'))
 
 		if 'error' in googleJson:
 			CommandTemplate.logError(u"[url] ERROR with Google requests. {}: {}. [{}]".format(googleJson['error']['code'],
@@ -176,7 +183,7 @@ class Command(CommandTemplate):
 			imageId = imageId[imageId.rfind('/')+1:]
 		headers = {"Authorization": "Client-ID " + GlobalStore.commandhandler.apikeys['imgur']['clientid']}
 		imgurUrl = "https://api.imgur.com/3/{type}/{id}".format(type=imageType, id=imageId)
-		imgurDataPage = requests.get(imgurUrl, headers=headers, timeout=timeout)
+		imgurDataPage = SharedFunctions.httpGet(imgurUrl, headers=headers, timeout=timeout)
 		imgdata = json.loads(imgurDataPage.text.encode('utf-8'))
 		if imgdata['success'] is not True or imgdata['status'] != 200:
 			CommandTemplate.logError("[url] Error while retrieving ImgUr image data: {}".format(imgurDataPage.text.encode('utf-8')))
@@ -215,7 +222,7 @@ class Command(CommandTemplate):
 		if 'id' in tweetMatches.groupdict() and tweetMatches.group('id') is not None:
 			#Specific tweet
 			twitterUrl = "https://api.twitter.com/1.1/statuses/show.json?id={id}".format(id=tweetMatches.group('id'))
-			twitterDataPage = requests.get(twitterUrl, headers=headers, timeout=timeout)
+			twitterDataPage = SharedFunctions.httpGet(twitterUrl, headers=headers, timeout=timeout)
 			twitterdata = json.loads(twitterDataPage.text.encode('utf-8'))
 
 			return u"@{username} ({name}): {text} [{timestamp}]".format(username=twitterdata['user']['screen_name'], name=twitterdata['user']['name'],
@@ -223,7 +230,7 @@ class Command(CommandTemplate):
 		else:
 			#User page
 			twitterUrl = u"https://api.twitter.com/1.1/users/show.json?screen_name={name}".format(name=tweetMatches.group('name'))
-			twitterDataPage = requests.get(twitterUrl, headers=headers, timeout=timeout)
+			twitterDataPage = SharedFunctions.httpGet(twitterUrl, headers=headers, timeout=timeout)
 			twitterdata = json.loads(twitterDataPage.text.encode('utf-8'))
 
 			title = u"{name} (@{screen_name}): {description} ({statuses_count:,} tweets posted, {followers_count:,} followers, following {friends_count:,})"
@@ -13,6 +13,19 @@ import SharedFunctions
 class Command(CommandTemplate):
 	triggers = ['weather', 'forecast']
 	helptext = "Gets the weather or the forecast for the provided location"
+	responseCacheSeconds = 600
+
+	def retrieveWeatherData(self, requestType, params, cacheKey):
+		req = SharedFunctions.httpGet("http://api.openweathermap.org/data/2.5/" + requestType, params=params, timeout=5.0)
+		try:
+			data = json.loads(req.text)
+		except ValueError:
+			self.logError("[weather] JSON load error. Data received:")
+			self.logError(req.text)
+			raise
+		if data['cod'] == 200 or data['cod'] == "200":
+			self.responseCache.set(cacheKey, data)
+		return data
 
 	def execute(self, message):
 		"""
@@ -30,15 +43,17 @@ class Command(CommandTemplate):
 			if message.trigger == 'forecast':
 				requestType = 'forecast/daily'
 				params['cnt'] = 4  #Number of days to get forecast for
+			#Weather doesn't change that fast, so if somebody already asked for this place recently, reuse that reply
+			cacheKey = (requestType, message.message)
+			data = self.responseCache.get(cacheKey)
 			try:
-				req = requests.get("http://api.openweathermap.org/data/2.5/" + requestType, params=params, timeout=5.0)
-				data = json.loads(req.text)
+				if data is None:
+					#If multiple people ask for the same place at the same time, only ask the API once
+					data = SharedFunctions.runSingleFlight(('weather', ) + self.responseCache.normalizeKey(cacheKey), self.retrieveWeatherData, requestType, params, cacheKey)
 			except requests.exceptions.Timeout:
 				replytext = u"Sorry, the weather API took too long to respond. Please try again in a little while"
 			except ValueError:
 				replytext = u"Sorry, I couldn't retrieve that data. Try again in a little while, maybe it'll work then"
-				self.logError("[weather] JSON load error. Data received:")
-				self.logError(req.text)
 			else:
 				if data['cod'] != 200 and data['cod'] != "200":
 					if data['cod'] == 404 or data['cod'] == '404':
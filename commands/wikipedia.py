@@ -12,6 +12,7 @@ class Command(CommandTemplate):
 	helptext = "Searches for the provided text on Wikipedia, and returns the start of the article, if it's found. " \
 			   "{commandPrefix}wiki only returns the first sentence, {commandPrefix}wikipedia returns the first paragraph. " \
 			   "{commandPrefix}wikirandom returns a random wikipedia page"
+	responseCacheSeconds = 3600
 
 	def onLoad(self):
 		GlobalStore.commandhandler.addCommandFunctions(__file__, 'searchWikipedia', self.searchWikipedia,
@@ -19,7 +20,7 @@ class Command(CommandTemplate):
 
 	def getRandomWikipediaArticle(self, addExtendedText=False):
 		try:
-			page = requests.get('http://en.m.wikipedia.org/wiki/Special:Random/#/random', timeout=10.0)
+			page = SharedFunctions.httpGet('http://en.m.wikipedia.org/wiki/Special:Random/#/random', timeout=10.0)
 		except requests.exceptions.Timeout:
 			return (False, "Apparently Wikipedia couldn't pick between all of its interesting articles, so it took too long to reply. Sorry!")
 		self.logDebug("[wiki] Random page url: {}".format(page.url))
@@ -27,9 +28,17 @@ class Command(CommandTemplate):
 		return self.getArticleText(articleName, addExtendedText)
 
 	def searchWikipedia(self, searchterm, addExtendedText=False):
+		#If multiple people search for the same thing at once (or the same link gets posted in multiple channels), only ask Wikipedia once
+		return SharedFunctions.runSingleFlight(('wikipedia', 'search', searchterm.lower(), addExtendedText), self.retrieveSearchResult, searchterm, addExtendedText)
+
+	def retrieveSearchResult(self, searchterm, addExtendedText=False):
+		#If we've searched for this recently, we already know which article it leads to
+		cachedArticleTitle = self.responseCache.get(('search', searchterm))
+		if cachedArticleTitle:
+			return self.getArticleText(cachedArticleTitle, addExtendedText)
 		url = u'https://en.wikipedia.org/w/api.php?format=json&utf8=1&action=query&list=search&srwhat=nearmatch&srlimit=1&srsearch={}&srprop='.format(searchterm)
 		try:
-			result = requests.get(url, timeout=10.0)
+			result = SharedFunctions.httpGet(url, timeout=10.0)
 		except requests.exceptions.Timeout:
 			return (False, "Either that's a difficult search query, or Wikipedia is tired. Either way, that search took too long, sorry")
 		result = json.loads(result.text)
@@ -40,10 +49,19 @@ class Command(CommandTemplate):
 		elif 'search' not in result['query'] or len(result['query']['search']) == 0:
 			return (False, "No search results for '{}'".format(searchterm))
 		else:
-			return self.getArticleText(result['query']['search'][0]['title'], addExtendedText)
+			articleTitle = result['query']['search'][0]['title']
+			self.responseCache.set(('search', searchterm), articleTitle)
+			return self.getArticleText(articleTitle, addExtendedText)
 
 	def getArticleText(self, pagename, addExtendedText=False, limitLength=True):
+		return SharedFunctions.runSingleFlight(('wikipedia', 'article', pagename.lower(), addExtendedText, limitLength), self.retrieveArticleText, pagename, addExtendedText, limitLength)
+
+	def retrieveArticleText(self, pagename, addExtendedText=False, limitLength=True):
 		replyLengthLimit = 310
+		cacheKey = ('article', pagename, addExtendedText, limitLength)
+		cachedReply = self.responseCache.get(cacheKey)
+		if cachedReply:
+			return cachedReply
 
 		url = u'https://en.wikipedia.org/w/api.php'
 		params = {'format': 'json', 'utf8': '1', 'action': 'query', 'prop': 'extracts', 'redirects': '1',
@@ -55,7 +73,7 @@ class Command(CommandTemplate):
 		else:
 			params['exsentences'] = '1'
 		try:
-			apireply = requests.get(url, params=params, timeout=10.0)
+			apireply = SharedFunctions.httpGet(url, params=params, timeout=10.0)
 		except requests.exceptions.Timeout:
 			return (False, "Article retrieval took too long, sorry")
 		result = json.loads(apireply.text)
@@ -84,6 +102,7 @@ class Command(CommandTemplate):
 				replytext += ' [...]'
 			#Add the URL
 			replytext += u'{}http://en.wikipedia.org/wiki/{}'.format(Constants.GREY_SEPARATOR, pagedata['title'].replace(u' ', u'_'))
+			self.responseCache.set(cacheKey, (True, replytext))
 			return (True, replytext)
 
 
@@ -17,6 +17,7 @@ class Command(CommandTemplate):
 	triggers = ['wolfram', 'wolframalpha', 'wa']
 	helptext = "Sends the provided query to Wolfram Alpha and shows the results, if any"
 	callInThread = True  #WolframAlpha can be a bit slow
+	responseCacheSeconds = 600  #Not too long, since some answers change, like currency conversions
 
 	def onLoad(self):
 		GlobalStore.commandhandler.addCommandFunctions(__file__, "fetchWolframAlphaData", self.fetchWolframData, "searchWolframAlpha", self.searchWolfram)
@@ -35,6 +36,11 @@ class Command(CommandTemplate):
 		if 'wolframalpha' not in GlobalStore.commandhandler.apikeys:
 			return (False, "No Wolfram Alpha API key found")
 
+		cacheKey = (query, podsToFetch)
+		cachedResult = self.responseCache.get(cacheKey)
+		if cachedResult:
+			return cachedResult
+
 		params = {'appid': GlobalStore.commandhandler.apikeys['wolframalpha'], 'input': query}
 		if podsToFetch > 0:
 			podIndexParam = ""
@@ -43,7 +49,7 @@ class Command(CommandTemplate):
 			podIndexParam = podIndexParam[:-1]
 			params['podindex'] = podIndexParam
 		try:
-			apireturn = requests.get("http://api.wolframalpha.com/v2/query", params=params, timeout=15.0)
+			apireturn = SharedFunctions.httpGet("http://api.wolframalpha.com/v2/query", params=params, timeout=15.0)
 		except requests.exceptions.Timeout:
 			return (False, "Sorry, Wolfram Alpha took too long to respond")
 		xmltext = apireturn.text
@@ -58,6 +64,7 @@ class Command(CommandTemplate):
 		# When making changes to the encoding, always test a 'euro to gbp' conversion (euro for utf8, gbp for latin-1),
 		# power-of-ten conversion (e.g. minutes to millenia), and pokemon (accented e and Japanese characters)
 		xmltext = xmltext.encode('utf8')  #Return a string, not a Unicode object
+		self.responseCache.set(cacheKey, (True, xmltext))
 		return (True, xmltext)
 
 	